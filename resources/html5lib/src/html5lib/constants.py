@@ -3083,3 +3083,6 @@ class DataLossWarning(UserWarning):
 
 class ReparseException(Exception):
     pass
+
+class NeedMoreInput(Exception):
+    pass
@@ -29,12 +29,16 @@ except:
 
 import sys
 import types
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
 
 import inputstream
 import tokenizer
 
 import treebuilders
-from treebuilders._base import Marker
+from treebuilders._base import Marker, ElementIndex
 from treebuilders import simpletree
 
 import utils
@@ -46,18 +50,127 @@ from constants import cdataElements, rcdataElements, voidElements
 from constants import tokenTypes, ReparseException, namespaces, spaceCharacters
 from constants import htmlIntegrationPointElements, mathmlTextIntegrationPointElements
 
+# Token types that go to the current phase at a MathML text integration
+# point or a HTML integration point
+textIntegrationTypes = frozenset([tokenTypes["StartTag"],
+                                  tokenTypes["Characters"],
+                                  tokenTypes["SpaceCharacters"]])
+# Start tags that go to the in foreign content phase at a MathML text
+# integration point anyway
+mathmlTextForeignTags = frozenset(["mglyph", "malignmark"])
+# Start tags that go to the current phase in a MathML annotation-xml element
+# that isn't a HTML integration point
+annotationXmlHTMLTags = frozenset(["svg"])
+
 def parse(doc, treebuilder="simpletree", encoding=None,
-          namespaceHTMLElements=True):
-    """Parse a string or file-like object into a tree"""
-    tb = treebuilders.getTreeBuilder(treebuilder)
-    p = HTMLParser(tb, namespaceHTMLElements=namespaceHTMLElements)
-    return p.parse(doc, encoding=encoding)
+          namespaceHTMLElements=True, errorPolicy="full",
+          coalesceCharacters=False, indexElements=False, **kwargs):
+    """Parse a string or file-like object into a tree
+
+    errorPolicy, coalesceCharacters and indexElements are as for
+    HTMLParser, except that indexElements raises ValueError for trees that
+    can't take the index as an attribute (e.g. cElementTree and lxml
+    elements); use an HTMLParser and its index attribute for those. Any
+    further keyword arguments (e.g. trackPositions) are passed on to
+    HTMLParser.parse"""
+    options = (treebuilders.getTreeBuilder(treebuilder),
+               namespaceHTMLElements, errorPolicy, coalesceCharacters,
+               indexElements)
+    p = takeParser(options)
+    try:
+        return checkIndexed(p, p.parse(doc, encoding=encoding, **kwargs))
+    finally:
+        releaseParser(options, p)
 
 def parseFragment(doc, container="div", treebuilder="simpletree", encoding=None, 
-                  namespaceHTMLElements=True):
-    tb = treebuilders.getTreeBuilder(treebuilder)
-    p = HTMLParser(tb, namespaceHTMLElements=namespaceHTMLElements)
-    return p.parseFragment(doc, container=container, encoding=encoding)
+                  namespaceHTMLElements=True, errorPolicy="full",
+                  coalesceCharacters=False, indexElements=False, **kwargs):
+    options = (treebuilders.getTreeBuilder(treebuilder),
+               namespaceHTMLElements, errorPolicy, coalesceCharacters,
+               indexElements)
+    p = takeParser(options)
+    try:
+        return checkIndexed(p, p.parseFragment(doc, container=container,
+                                               encoding=encoding, **kwargs))
+    finally:
+        releaseParser(options, p)
+
+def checkIndexed(parser, tree):
+    """Return tree, or raise ValueError if it should have been indexed
+    but can't hold the index, which is lost once the parser is released"""
+    if parser.indexElements and getattr(tree, "index", None) is not parser.index:
+        raise ValueError("%s trees can't hold an index; use HTMLParser and "
+                         "its index attribute" % type(tree).__name__)
+    return tree
+
+# The parsers parse and parseFragment reuse, by thread and then by
+# (treebuilder, namespaceHTMLElements, errorPolicy, coalesceCharacters,
+# indexElements)
+parserPool = threading.local()
+
+def takeParser(options):
+    """Take a parser for options out of this thread's pool, or make one if
+    there is none (e.g. as parse has been called while parsing)"""
+    parsers = getattr(parserPool, "parsers", None)
+    if parsers is None:
+        parsers = parserPool.parsers = {}
+    parser = parsers.pop(options, None)
+    if parser is None:
+        (tree, namespaceHTMLElements, errorPolicy, coalesceCharacters,
+         indexElements) = options
+        parser = HTMLParser(tree, namespaceHTMLElements=namespaceHTMLElements,
+                            errorPolicy=errorPolicy,
+                            coalesceCharacters=coalesceCharacters,
+                            indexElements=indexElements)
+    return parser
+
+def releaseParser(options, parser):
+    """Put a parser back in this thread's pool, without the references to
+    the document it has parsed"""
+    parser.tree.reset()
+    parser.errors = []
+    parser.tokenizer = None
+    parser.index = None
+    parserPool.parsers[options] = parser
+
+def parseStreamReader(reader, parser=None, readSize=65536, **kwargs):
+    """Parse the document read from an asyncio StreamReader
+
+    Returns a future that is given the document once the reader reaches
+    EOF. Each block read is passed to parser.feed as it arrives, so the
+    tree is built while the rest of the document is still being received.
+    parser defaults to an HTMLParser building a simpletree; any further
+    keyword arguments (e.g. encoding) are as for HTMLParser.feed, and the
+    tree and errors are as described there: invalid character errors
+    depend on the blocks the reader returns. trollius is used where
+    asyncio isn't available"""
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+    if parser is None:
+        parser = HTMLParser()
+    result = asyncio.Future()
+
+    def read():
+        asyncio.ensure_future(reader.read(readSize)).add_done_callback(received)
+
+    def received(future):
+        if result.cancelled():
+            return
+        try:
+            data = future.result()
+            if data:
+                parser.feed(data)
+                read()
+            else:
+                result.set_result(parser.close())
+        except Exception, e:
+            result.set_exception(e)
+
+    parser.feed("", **kwargs)
+    read()
+    return result
 
 def method_decorator_metaclass(function):
     class Decorated(type):
@@ -72,11 +185,17 @@ def method_decorator_metaclass(function):
 
 class HTMLParser(object):
     """HTML parser. Generates a tree structure from a stream of (possibly
-        malformed) HTML"""
+        malformed) HTML
+
+    A parser can be used for any number of documents, one at a time; the
+    module level parse and parseFragment keep parsers for reuse, one for
+    each thread and set of arguments"""
 
     def __init__(self, tree = simpletree.TreeBuilder,
                  tokenizer = tokenizer.HTMLTokenizer, strict = False,
-                 namespaceHTMLElements = True, debug=False):
+                 namespaceHTMLElements = True, debug=False,
+                 errorPolicy = "full", coalesceCharacters = False,
+                 profile = False, indexElements = False):
         """
         strict - raise an exception when a parse error is encountered
 
@@ -87,40 +206,124 @@ class HTMLParser(object):
         tokenizer - a class that provides a stream of tokens to the treebuilder.
         This may be replaced for e.g. a sanitizer which converts some tags to
         text
+
+        errorPolicy - what is kept of parse errors. "full" records each one
+        in self.errors as (position, errorcode, datavars); "counts" only
+        counts them by errorcode in self.errorCounts; "none" ignores them,
+        and the tokenizer doesn't produce them in the first place
+
+        coalesceCharacters - merge runs of adjacent character tokens into a
+        single token before they reach the tree construction phases, where
+        that doesn't change the tree or the parse errors
+
+        profile - count in self.dispatchCounts how many tokens each phase
+        handler is given, by (phase name, handler name)
+
+        indexElements - give each tree returned an ElementIndex of its
+        elements as tree.index, with by_tag, by_id and by_class lookups.
+        The index of the last tree is also self.index, for trees that
+        don't take attributes (e.g. cElementTree and lxml elements)
         """
 
+        if errorPolicy not in ("none", "counts", "full"):
+            raise ValueError("Unknown error policy %r" % (errorPolicy,))
+        if strict and errorPolicy == "none":
+            raise ValueError("Strict parsing needs parse errors")
+
         # Raise an exception on the first error encountered
         self.strict = strict
 
+        self.errorPolicy = errorPolicy
+        self.coalesceCharacters = coalesceCharacters
+        self.indexElements = indexElements
+        self.index = None
+        if errorPolicy == "counts":
+            self.parseError = self.countError
+        elif errorPolicy == "none":
+            self.parseError = self.ignoreError
+
+        # Number of times a change of encoding has made this parser start a
+        # document over
+        self.reparseCount = 0
+
         self.tree = tree(namespaceHTMLElements)
         self.tokenizer_class = tokenizer
+        self.tokenizer = None
         self.errors = []
+        self.errorCounts = {}
+
+        # The FeedQueue of a document being given to feed, and the options
+        # to start parsing it with once enough of it has been fed
+        self.feedQueue = None
+        self.feedOptions = None
 
         self.phases = dict([(name, cls(self, self.tree)) for name, cls in
                             getPhases(debug).iteritems()])
 
+        self.profile = profile
+        self.dispatchCounts = {}
+        self.phaseNames = dict([(phase, name) for name, phase in
+                                self.phases.iteritems()])
+        self.startTagTables, self.endTagTables = self.handlerTables(debug)
+
+    def handlerTables(self, debug):
+        """Return plain dicts, by phase, of (handlers by tag name, handler
+        for other names) for start tags and for end tags, for mainLoop to
+        look the handlers up in directly.
+
+        Phases without a startTagHandler (or endTagHandler) process the
+        tags some other way, so the dict is empty and the handler for other
+        names is processStartTag (or processEndTag). So is every phase's
+        when debugging, so that the calls are logged."""
+        startTagTables = {}
+        endTagTables = {}
+        for phase in self.phases.itervalues():
+            startTagHandler = getattr(phase, "startTagHandler", None)
+            if startTagHandler is None or debug:
+                startTagTables[phase] = ({}, phase.processStartTag)
+            else:
+                startTagTables[phase] = (dict(startTagHandler),
+                                         startTagHandler.default)
+            endTagHandler = getattr(phase, "endTagHandler", None)
+            if endTagHandler is None or debug:
+                endTagTables[phase] = ({}, phase.processEndTag)
+            else:
+                endTagTables[phase] = (dict(endTagHandler),
+                                       endTagHandler.default)
+        return startTagTables, endTagTables
+
     def _parse(self, stream, innerHTML=False, container="div",
                encoding=None, parseMeta=True, useChardet=True, **kwargs):
 
+        self.reparseCount = 0
         self.innerHTMLMode = innerHTML
         self.container = container
+        if self.errorPolicy == "none":
+            kwargs["reportErrors"] = False
         self.tokenizer = self.tokenizer_class(stream, encoding=encoding,
                                               parseMeta=parseMeta,
                                               useChardet=useChardet, 
                                               parser=self, **kwargs)
         self.reset()
+        self.run()
 
+    def run(self):
+        """Run the main loop, starting over whenever a change of encoding
+        needs the document to be parsed again"""
         while True:
             try:
                 self.mainLoop()
                 break
             except ReparseException, e:
+                self.reparseCount += 1
                 self.reset()
 
     def reset(self):
         self.tree.reset()
         self.firstStartTag = False
         self.errors = []
+        self.errorCounts = {}
+        self.dispatchCounts = {}
         self.log = [] #only used with debug mode
         # "quirks" / "limited quirks" / "no quirks"
         self.compatMode = "no quirks"
@@ -151,6 +354,11 @@ class HTMLParser(object):
 
         self.framesetOK = True
 
+        # State the phases keep between tokens
+        inBody = self.phases["inBody"]
+        inBody.processSpaceCharacters = inBody.processSpaceCharactersNonPre
+        self.phases["inTableText"].characterTokens = []
+
     def isHTMLIntegrationPoint(self, element):
         if (element.name == "annotation-xml" and 
             element.namespace == namespaces["mathml"]):
@@ -163,6 +371,22 @@ class HTMLParser(object):
 
     def isMathMLTextIntegrationPoint(self, element):
         return (element.namespace, element.name) in mathmlTextIntegrationPointElements
+
+    def dispatchRule(self, node):
+        """How tokens are dispatched while node is the current node: None
+        if they all go to the current phase, otherwise a pair of the token
+        types that go to the current phase rather than the in foreign
+        content phase and the start tag names that go the other way"""
+        if node is None or node.namespace == self.tree.defaultNamespace:
+            return None
+        if self.isMathMLTextIntegrationPoint(node):
+            return (textIntegrationTypes, mathmlTextForeignTags)
+        if self.isHTMLIntegrationPoint(node):
+            return (textIntegrationTypes, frozenset())
+        if (node.namespace == namespaces["mathml"] and
+            node.name == "annotation-xml"):
+            return (frozenset(), annotationXmlHTMLTags)
+        return (frozenset(), frozenset())
         
     def mainLoop(self):
         CharactersToken = tokenTypes["Characters"]
@@ -173,52 +397,69 @@ class HTMLParser(object):
         DoctypeToken = tokenTypes["Doctype"]
         ParseErrorToken = tokenTypes["ParseError"]
         
-        for token in self.normalizedTokens():
+        profile = self.profile
+        startTagTables = self.startTagTables
+        endTagTables = self.endTagTables
+        openElements = self.tree.openElements
+        inForeignContent = self.phases["inForeignContent"]
+        # The dispatch rule is only worked out again when the current node
+        # has changed
+        ruleNode = rule = None
+
+        tokens = self.normalizedTokens()
+        if self.coalesceCharacters:
+            tokens = self.coalescedTokens(tokens)
+        for token in tokens:
             new_token = token
             while new_token is not None:
-                currentNode = self.tree.openElements[-1] if self.tree.openElements else None
-                currentNodeNamespace = currentNode.namespace if currentNode else None
-                currentNodeName = currentNode.name if currentNode else None
-
-                type = new_token["type"]
+                type = new_token.type
                 
                 if type == ParseErrorToken:
-                    self.parseError(new_token["data"], new_token.get("datavars", {}))
+                    self.parseError(new_token.data, new_token.get("datavars", {}))
                     new_token = None
+                    continue
+
+                if openElements:
+                    currentNode = openElements[-1]
+                else:
+                    currentNode = None
+                if currentNode is not ruleNode:
+                    ruleNode = currentNode
+                    rule = self.dispatchRule(currentNode)
+                if (rule is None or
+                    (type in rule[0]) != (type == StartTagToken and
+                                          new_token.name in rule[1])):
+                    phase = self.phase
                 else:
-                    if (len(self.tree.openElements) == 0 or
-                        currentNodeNamespace == self.tree.defaultNamespace or
-                        (self.isMathMLTextIntegrationPoint(currentNode) and
-                         ((type == StartTagToken and
-                           token["name"] not in frozenset(["mglyph", "malignmark"])) or
-                         type in (CharactersToken, SpaceCharactersToken))) or
-                        (currentNodeNamespace == namespaces["mathml"] and
-                         currentNodeName == "annotation-xml" and
-                         token["name"] == "svg") or
-                        (self.isHTMLIntegrationPoint(currentNode) and
-                         type in (StartTagToken, CharactersToken, SpaceCharactersToken))):
-                        phase = self.phase
-                    else:
-                        phase = self.phases["inForeignContent"]
-
-                    if type == CharactersToken:
-                        new_token = phase.processCharacters(new_token)
-                    elif type == SpaceCharactersToken:
-                         new_token= phase.processSpaceCharacters(new_token)
-                    elif type == StartTagToken:
-                        new_token = phase.processStartTag(new_token)
-                    elif type == EndTagToken:
-                        new_token = phase.processEndTag(new_token)
-                    elif type == CommentToken:
-                        new_token = phase.processComment(new_token)
-                    elif type == DoctypeToken:
-                        new_token = phase.processDoctype(new_token)
-
-            if (type == StartTagToken and token["selfClosing"]
-                and not token["selfClosingAcknowledged"]):
+                    phase = inForeignContent
+
+                if type == CharactersToken:
+                    handler = phase.processCharacters
+                elif type == StartTagToken:
+                    table, default = startTagTables[phase]
+                    handler = table.get(new_token.name, default)
+                elif type == EndTagToken:
+                    table, default = endTagTables[phase]
+                    handler = table.get(new_token.name, default)
+                elif type == SpaceCharactersToken:
+                    handler = phase.processSpaceCharacters
+                elif type == CommentToken:
+                    handler = phase.processComment
+                else:
+                    handler = phase.processDoctype
+                if profile:
+                    key = (self.phaseNames[phase], handler.__name__)
+                    self.dispatchCounts[key] = self.dispatchCounts.get(key, 0) + 1
+                new_token = handler(new_token)
+
+            if (type == StartTagToken and token.selfClosing
+                and not token.selfClosingAcknowledged):
                 self.parseError("non-void-element-with-trailing-solidus",
-                                {"name":token["name"]})
+                                {"name":token.name})
 
+        if self.tokenizer.suspended:
+            # Only the end of the data fed so far
+            return
 
         # When the loop finishes it's EOF
         reprocess = True
@@ -233,7 +474,69 @@ class HTMLParser(object):
         for token in self.tokenizer:
             yield self.normalizeToken(token)
 
-    def parse(self, stream, encoding=None, parseMeta=True, useChardet=True):
+    def coalescedTokens(self, tokens):
+        """Merge runs of adjacent Characters and SpaceCharacters tokens
+
+        Runs are only collected in phases that insert character tokens as
+        text without switching phase or reporting errors, so processing the
+        merged token is the same as processing its parts one after another.
+        The NUL tokens the tokenizer emits on their own and any other token
+        (parse errors included) end a run. Characters and SpaceCharacters
+        tokens are only mixed where both are inserted alike, which in the
+        in body phase isn't true while a leading newline is to be dropped.
+
+        The tokenizer looks at the tree's current node when it reads
+        "<![CDATA[", and inserting text can change that node (by
+        reconstructing the active formatting elements). So a run is also
+        ended before the tokenizer is asked for a token that might start
+        with "<!".
+        """
+        CharactersToken = tokenTypes["Characters"]
+        SpaceCharactersToken = tokenTypes["SpaceCharacters"]
+        phases = self.phases
+        inBody = phases["inBody"]
+        mixingPhases = frozenset([phases[name] for name in
+                                  ("text", "inSelect", "inSelectInTable",
+                                   "inTableText")])
+        textPhases = mixingPhases | frozenset([inBody, phases["inCaption"],
+                                               phases["inCell"]])
+        tokenizer = self.tokenizer
+        run = []
+        for token in tokens:
+            type = token.type
+            if ((type == CharactersToken or type == SpaceCharactersToken) and
+                token.data != u"\u0000" and self.phase in textPhases):
+                if (run and type != run[-1].type and
+                    not (self.phase in mixingPhases or
+                         (self.phase is inBody and
+                          inBody.processSpaceCharacters ==
+                          inBody.processSpaceCharactersNonPre))):
+                    yield self.mergeCharacterTokens(run)
+                    run = []
+                run.append(token)
+                if not tokenizer.tokenQueue and tokenizer.mayReadTree():
+                    yield self.mergeCharacterTokens(run)
+                    run = []
+                continue
+            if run:
+                yield self.mergeCharacterTokens(run)
+                run = []
+            yield token
+        if run:
+            yield self.mergeCharacterTokens(run)
+
+    def mergeCharacterTokens(self, tokens):
+        token = tokens[0]
+        if len(tokens) > 1:
+            token.data = u"".join([item.data for item in tokens])
+            for item in tokens:
+                if item.type == tokenTypes["Characters"]:
+                    token.type = item.type
+                    break
+        return token
+
+    def parse(self, stream, encoding=None, parseMeta=True, useChardet=True,
+              trackPositions=True):
         """Parse a HTML document into a well-formed tree
 
         stream - a filelike object or string containing the HTML to be parsed
@@ -242,13 +545,17 @@ class HTMLParser(object):
         the encoding.  If specified, that encoding will be used,
         regardless of any BOM or later declaration (such as in a meta
         element)
+
+        trackPositions - if False, line and column numbers are not tracked
+        and the position recorded with each parse error is None
         """
         self._parse(stream, innerHTML=False, encoding=encoding, 
-                    parseMeta=parseMeta, useChardet=useChardet)
-        return self.tree.getDocument()
+                    parseMeta=parseMeta, useChardet=useChardet,
+                    trackPositions=trackPositions)
+        return self.indexTree(self.tree.getDocument())
     
     def parseFragment(self, stream, container="div", encoding=None,
-                      parseMeta=False, useChardet=True):
+                      parseMeta=False, useChardet=True, trackPositions=True):
         """Parse a HTML fragment into a well-formed tree fragment
         
         container - name of the element we're setting the innerHTML property
@@ -260,30 +567,123 @@ class HTMLParser(object):
         the encoding.  If specified, that encoding will be used,
         regardless of any BOM or later declaration (such as in a meta
         element)
+
+        trackPositions - as for parse
+        """
+        self._parse(stream, True, container=container, encoding=encoding,
+                    trackPositions=trackPositions)
+        return self.indexTree(self.tree.getFragment())
+
+    def feed(self, data, encoding=None, parseMeta=True, useChardet=True,
+             trackPositions=True):
+        """Parse the next part of a HTML document given a piece at a time
+
+        data - a byte string, the continuation of what has been fed so far
+
+        The first call starts a new document; its other arguments are as
+        for parse and later calls' are ignored. Each call tokenizes and
+        builds the tree as far as the data fed so far allows, and close()
+        finishes the document. Without an encoding, parsing starts once the
+        data fed starts with a BOM or the meta prescan finds an encoding in
+        it, and otherwise once there are as many bytes as encoding
+        detection looks at (or at close()), so the tree is the one parse
+        would produce. So are the parse errors, except for the errors the
+        input stream reports for invalid characters (e.g.
+        invalid-codepoint): they are reported as each piece is read, so
+        their positions, and their order among the other errors, depend on
+        how the document was divided.
         """
-        self._parse(stream, True, container=container, encoding=encoding)
-        return self.tree.getFragment()
+        if self.feedQueue is None:
+            self.feedQueue = inputstream.FeedQueue()
+            self.feedOptions = {"encoding": encoding, "parseMeta": parseMeta,
+                                "useChardet": useChardet,
+                                "trackPositions": trackPositions}
+        self.feedQueue.append(data)
+        self.resumeFeed()
+
+    def close(self):
+        """Finish the document given to feed and return its tree"""
+        if self.feedQueue is None:
+            self.feed("")
+        self.feedQueue.close()
+        self.resumeFeed()
+        self.feedQueue = None
+        return self.indexTree(self.tree.getDocument())
+
+    def indexTree(self, tree):
+        """Return tree, with an index of its elements if the parser makes
+        them"""
+        if self.indexElements:
+            self.index = ElementIndex(self.tree.iterElements(tree))
+            try:
+                tree.index = self.index
+            except AttributeError:
+                pass
+        return tree
+
+    def resumeFeed(self):
+        options = self.feedOptions
+        queue = self.feedQueue
+        inputStream = inputstream.HTMLInputStream
+        if options is None:
+            self.run()
+        elif (options["encoding"] is not None or queue.closed or
+              queue.length >= inputStream.detectionBlockSize(
+                  options["parseMeta"], options["useChardet"]) or
+              inputStream.encodingDeclared(queue.peek(inputStream.numBytesMeta),
+                                           options["parseMeta"])):
+            self.feedOptions = None
+            self._parse(self.feedQueue, **options)
+
+    def _getErrors(self):
+        # The positions of the errors parseError added are only worked out
+        # by the stream when they are asked for (or its chunk changes)
+        if self.tokenizer is not None:
+            positions = self.tokenizer.stream.takeMarkedPositions()
+            if positions:
+                errors = self._errors
+                start = len(errors) - len(positions)
+                errors[start:] = [(position,) + error[1:] for position, error
+                                  in zip(positions, errors[start:])]
+        return self._errors
+
+    def _setErrors(self, errors):
+        self._errors = errors
+
+    errors = property(_getErrors, _setErrors)
 
     def parseError(self, errorcode="XXX-undefined-error", datavars={}):
         # XXX The idea is to make errorcode mandatory.
-        self.errors.append((self.tokenizer.stream.position(), errorcode, datavars))
+        self.tokenizer.stream.markPosition()
+        self._errors.append((None, errorcode, datavars))
+        if self.strict:
+            raise ParseError
+
+    def countError(self, errorcode="XXX-undefined-error", datavars={}):
+        """parseError for the "counts" error policy"""
+        errorCounts = self.errorCounts
+        errorCounts[errorcode] = errorCounts.get(errorcode, 0) + 1
         if self.strict:
             raise ParseError
 
+    def ignoreError(self, errorcode="XXX-undefined-error", datavars={}):
+        """parseError for the "none" error policy"""
+        pass
+
     def normalizeToken(self, token):
         """ HTML5 specific normalizations to the token stream """
 
-        if token["type"] == tokenTypes["StartTag"]:
-            token["data"] = dict(token["data"][::-1])
+        if token.type == tokenTypes["StartTag"]:
+            token.data = dict(token.data[::-1])
 
         return token
 
     def adjustMathMLAttributes(self, token):
         replacements = {"definitionurl":u"definitionURL"}
         for k,v in replacements.iteritems():
-            if k in token["data"]:
-                token["data"][v] = token["data"][k]
-                del token["data"][k]
+            if k in token.data:
+                token.data[v] = token.data[k]
+                del token.data[k]
 
     def adjustSVGAttributes(self, token):
         replacements = {
@@ -350,11 +750,11 @@ class HTMLParser(object):
             "ychannelselector":u"yChannelSelector",
             "zoomandpan":u"zoomAndPan"
             }
-        for originalName in token["data"].keys():
+        for originalName in token.data.keys():
             if originalName in replacements:
                 svgName = replacements[originalName]
-                token["data"][svgName] = token["data"][originalName]
-                del token["data"][originalName]
+                token.data[svgName] = token.data[originalName]
+                del token.data[originalName]
 
     def adjustForeignAttributes(self, token):
         replacements = {
@@ -372,11 +772,11 @@ class HTMLParser(object):
             "xmlns:xlink":("xmlns", "xlink", namespaces["xmlns"])
             }
 
-        for originalName in token["data"].iterkeys():
+        for originalName in token.data.iterkeys():
             if originalName in replacements:
                 foreignName = replacements[originalName]
-                token["data"][foreignName] = token["data"][originalName]
-                del token["data"][originalName]
+                token.data[foreignName] = token.data[originalName]
+                del token.data[originalName]
 
     def reparseTokenNormal(self, token):
         self.parser.phase()
@@ -401,7 +801,12 @@ class HTMLParser(object):
             "frameset":"inFrameset",
             "html":"beforeHead"
         }
-        for node in self.tree.openElements[::-1]:
+        # Elements without a mode of their own are passed over, so start at
+        # the last element that might have one
+        positions = self.tree.openElements.positions
+        start = max([positions[name][-1] for name in newModes
+                     if name in positions] + [0])
+        for node in self.tree.openElements[start::-1]:
             nodeName = node.name
             new_phase = None
             if node == self.tree.openElements[0]:
@@ -442,7 +847,20 @@ class HTMLParser(object):
 
         self.phase = self.phases["text"]
 
+# The phase classes by debug mode, built by getPhases the first time they
+# are needed
+phaseClasses = {}
+
 def getPhases(debug):
+    """Return a dict of the phase classes by phase name"""
+    debug = bool(debug)
+    try:
+        return phaseClasses[debug]
+    except KeyError:
+        classes = phaseClasses[debug] = buildPhases(debug)
+        return classes
+
+def buildPhases(debug):
     def log(function):
         """Logger that records which phase processes each token"""
         type_names = dict((value, key) for key, value in 
@@ -451,11 +869,11 @@ def getPhases(debug):
             if function.__name__.startswith("process") and len(args) > 0:
                 token = args[0]
                 try:
-                    info = {"type":type_names[token['type']]}
+                    info = {"type":type_names[token.type]}
                 except:
                     raise
-                if token['type'] in constants.tagTokenTypes:
-                    info["name"] = token['name']
+                if token.type in constants.tagTokenTypes:
+                    info["name"] = token.name
 
                 self.parser.log.append((self.parser.tokenizer.state.__name__,
                                         self.parser.phase.__class__.__name__, 
@@ -465,6 +883,7 @@ def getPhases(debug):
                 return function(self, *args, **kwargs)
             else:
                 return function(self, *args, **kwargs)
+        wrapped.__name__ = function.__name__
         return wrapped
 
     def getMetaclass(use_metaclass, metaclass_func):
@@ -505,26 +924,24 @@ def getPhases(debug):
             self.parser.parseError("unexpected-doctype")
 
         def processCharacters(self, token):
-            self.tree.insertText(token["data"])
+            self.tree.insertText(token.data)
 
         def processSpaceCharacters(self, token):
-            self.tree.insertText(token["data"])
+            self.tree.insertText(token.data)
 
         def processStartTag(self, token):
-            return self.startTagHandler[token["name"]](token)
+            return self.startTagHandler[token.name](token)
 
         def startTagHtml(self, token):
-            if self.parser.firstStartTag == False and token["name"] == "html":
+            if self.parser.firstStartTag == False and token.name == "html":
                self.parser.parseError("non-html-root")
             # XXX Need a check here to see if the first start tag token emitted is
             # this token... If it's not, invoke self.parser.parseError().
-            for attr, value in token["data"].iteritems():
-                if attr not in self.tree.openElements[0].attributes:
-                    self.tree.openElements[0].attributes[attr] = value
+            self.tree.openElements[0].addAttributes(token.data)
             self.parser.firstStartTag = False
 
         def processEndTag(self, token):
-            return self.endTagHandler[token["name"]](token)
+            return self.endTagHandler[token.name](token)
 
     class InitialPhase(Phase):
         def processSpaceCharacters(self, token):
@@ -534,10 +951,10 @@ def getPhases(debug):
             self.tree.insertComment(token, self.tree.document)
 
         def processDoctype(self, token):
-            name = token["name"]
-            publicId = token["publicId"]
-            systemId = token["systemId"]
-            correct = token["correct"]
+            name = token.name
+            publicId = token.publicId
+            systemId = token.systemId
+            correct = token.correct
 
             if (name != "html" or publicId != None or
                 systemId != None and systemId != "about:legacy-compat"):
@@ -551,7 +968,7 @@ def getPhases(debug):
             if publicId != "":
                 publicId = publicId.translate(asciiUpper2Lower)
 
-            if (not correct or token["name"] != "html"
+            if (not correct or token.name != "html"
                 or startswithany(publicId,
                 ("+//silmaril//dtd html pro v0r11 19970101//",
                  "-//advasoft ltd//dtd html 3.0 aswedit + extensions//",
@@ -640,13 +1057,13 @@ def getPhases(debug):
 
         def processStartTag(self, token):
             self.parser.parseError("expected-doctype-but-got-start-tag",
-              {"name": token["name"]})
+              {"name": token.name})
             self.anythingElse()
             return token
 
         def processEndTag(self, token):
             self.parser.parseError("expected-doctype-but-got-end-tag",
-              {"name": token["name"]})
+              {"name": token.name})
             self.anythingElse()
             return token
 
@@ -678,15 +1095,15 @@ def getPhases(debug):
             return token
 
         def processStartTag(self, token):
-            if token["name"] == "html":
+            if token.name == "html":
                 self.parser.firstStartTag = True
             self.insertHtmlElement()
             return token
 
         def processEndTag(self, token):
-            if token["name"] not in ("head", "body", "html", "br"):
+            if token.name not in ("head", "body", "html", "br"):
                 self.parser.parseError("unexpected-end-tag-before-html",
-                  {"name": token["name"]})
+                  {"name": token.name})
             else:
                 self.insertHtmlElement()
                 return token
@@ -736,7 +1153,7 @@ def getPhases(debug):
 
         def endTagOther(self, token):
             self.parser.parseError("end-tag-after-implied-root",
-              {"name": token["name"]})
+              {"name": token.name})
 
     class InHeadPhase(Phase):
         def __init__(self, parser, tree):
@@ -778,14 +1195,14 @@ def getPhases(debug):
         def startTagBaseLinkCommand(self, token):
             self.tree.insertElement(token)
             self.tree.openElements.pop()
-            token["selfClosingAcknowledged"] = True
+            token.selfClosingAcknowledged = True
 
         def startTagMeta(self, token):
             self.tree.insertElement(token)
             self.tree.openElements.pop()
-            token["selfClosingAcknowledged"] = True
+            token.selfClosingAcknowledged = True
 
-            attributes = token["data"]
+            attributes = token.data
             if self.parser.tokenizer.stream.charEncoding[1] == "tentative":
                 if "charset" in attributes:
                     self.parser.tokenizer.stream.changeEncoding(attributes["charset"])
@@ -794,7 +1211,7 @@ def getPhases(debug):
                     # the abstract Unicode string, and just use the
                     # ContentAttrParser on that, but using UTF-8 allows all chars
                     # to be encoded and as a ASCII-superset works.
-                    data = inputstream.EncodingBytes(attributes["content"].encode("utf-8"))
+                    data = attributes["content"].encode("utf-8")
                     parser = inputstream.ContentAttrParser(data)
                     codec = parser.parse()
                     self.parser.tokenizer.stream.changeEncoding(codec)
@@ -826,7 +1243,7 @@ def getPhases(debug):
             return token
 
         def endTagOther(self, token):
-            self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+            self.parser.parseError("unexpected-end-tag", {"name": token.name})
 
         def anythingElse(self):
             self.endTagHead(impliedTagToken("head"))
@@ -877,7 +1294,7 @@ def getPhases(debug):
 
         def startTagFromHead(self, token):
             self.parser.parseError("unexpected-start-tag-out-of-my-head",
-              {"name": token["name"]})
+              {"name": token.name})
             self.tree.openElements.append(self.tree.headPointer)
             self.parser.phases["inHead"].processStartTag(token)
             for node in self.tree.openElements[::-1]:
@@ -886,7 +1303,7 @@ def getPhases(debug):
                     break
 
         def startTagHead(self, token):
-            self.parser.parseError("unexpected-start-tag", {"name":token["name"]})
+            self.parser.parseError("unexpected-start-tag", {"name":token.name})
 
         def startTagOther(self, token):
             self.anythingElse()
@@ -897,7 +1314,7 @@ def getPhases(debug):
             return token
 
         def endTagOther(self, token):
-            self.parser.parseError("unexpected-end-tag", {"name":token["name"]})
+            self.parser.parseError("unexpected-end-tag", {"name":token.name})
 
         def anythingElse(self):
             self.tree.insertElement(impliedTagToken("body", "StartTag"))
@@ -978,31 +1395,13 @@ def getPhases(debug):
                 ])
             self.endTagHandler.default = self.endTagOther
 
-        def isMatchingFormattingElement(self, node1, node2):
-            if node1.name != node2.name or node1.namespace != node2.namespace:
-                return False
-            elif len(node1.attributes) != len(node2.attributes):
-                return False
-            else:
-                attributes1 = sorted(node1.attributes.items())
-                attributes2 = sorted(node2.attributes.items())
-                for attr1, attr2 in zip(attributes1, attributes2):
-                    if attr1 != attr2:
-                        return False
-            return True
-
         # helper
         def addFormattingElement(self, token):
             self.tree.insertElement(token)
             element = self.tree.openElements[-1]
             
-            matchingElements = []
-            for node in self.tree.activeFormattingElements[::-1]:
-                if node is Marker:
-                    break
-                elif self.isMatchingFormattingElement(node, element):
-                    matchingElements.append(node)
-                    
+            matchingElements = list(
+                self.tree.activeFormattingElements.matching(element))
             assert len(matchingElements) <= 3
             if len(matchingElements) == 3:
                 self.tree.activeFormattingElements.remove(matchingElements[-1])
@@ -1022,7 +1421,7 @@ def getPhases(debug):
         def processSpaceCharactersDropNewline(self, token):
             # Sometimes (start of <pre>, <listing>, and <textarea> blocks) we
             # want to drop leading newlines
-            data = token["data"]
+            data = token.data
             self.processSpaceCharacters = self.processSpaceCharactersNonPre
             if (data.startswith("\n") and
                 self.tree.openElements[-1].name in ("pre", "listing", "textarea")
@@ -1033,20 +1432,20 @@ def getPhases(debug):
                 self.tree.insertText(data)
 
         def processCharacters(self, token):
-            if token["data"] == u"\u0000":
+            if token.data == u"\u0000":
                 #The tokenizer should always emit null on its own
                 return
             self.tree.reconstructActiveFormattingElements()
-            self.tree.insertText(token["data"])
+            self.tree.insertText(token.data)
             #This must be bad for performance
             if (self.parser.framesetOK and
                 any([char not in spaceCharacters
-                     for char in token["data"]])):
+                     for char in token.data])):
                 self.parser.framesetOK = False
 
         def processSpaceCharacters(self, token):
             self.tree.reconstructActiveFormattingElements()
-            self.tree.insertText(token["data"])
+            self.tree.insertText(token.data)
 
         def startTagProcessInHead(self, token):
             return self.parser.phases["inHead"].processStartTag(token)
@@ -1058,9 +1457,7 @@ def getPhases(debug):
                 assert self.parser.innerHTML
             else:
                 self.parser.framesetOK = False
-                for attr, value in token["data"].iteritems():
-                    if attr not in self.tree.openElements[1].attributes:
-                        self.tree.openElements[1].attributes[attr] = value
+                self.tree.openElements[1].addAttributes(token.data)
 
         def startTagFrameset(self, token):
             self.parser.parseError("unexpected-start-tag", {"name": "frameset"})
@@ -1103,7 +1500,7 @@ def getPhases(debug):
             stopNamesMap = {"li":["li"],
                             "dt":["dt", "dd"],
                             "dd":["dt", "dd"]}
-            stopNames = stopNamesMap[token["name"]]
+            stopNames = stopNamesMap[token.name]
             for node in reversed(self.tree.openElements):
                 if node.name in stopNames:
                     self.parser.phase.processEndTag(
@@ -1129,7 +1526,7 @@ def getPhases(debug):
             if self.tree.elementInScope("p", variant="button"):
                 self.endTagP(impliedTagToken("p"))
             if self.tree.openElements[-1].name in headingElements:
-                self.parser.parseError("unexpected-start-tag", {"name": token["name"]})
+                self.parser.parseError("unexpected-start-tag", {"name": token.name})
                 self.tree.openElements.pop()
             self.tree.insertElement(token)
 
@@ -1196,28 +1593,28 @@ def getPhases(debug):
             self.tree.reconstructActiveFormattingElements()
             self.tree.insertElement(token)
             self.tree.openElements.pop()
-            token["selfClosingAcknowledged"] = True
+            token.selfClosingAcknowledged = True
             self.parser.framesetOK = False
 
         def startTagInput(self, token):
             framesetOK = self.parser.framesetOK
             self.startTagVoidFormatting(token)
-            if ("type" in token["data"] and
-                token["data"]["type"].translate(asciiUpper2Lower) == "hidden"):
+            if ("type" in token.data and
+                token.data["type"].translate(asciiUpper2Lower) == "hidden"):
                 #input type=hidden doesn't change framesetOK
                 self.parser.framesetOK = framesetOK
 
         def startTagParamSource(self, token):
             self.tree.insertElement(token)
             self.tree.openElements.pop()
-            token["selfClosingAcknowledged"] = True
+            token.selfClosingAcknowledged = True
 
         def startTagHr(self, token):
             if self.tree.elementInScope("p", variant="button"):
                 self.endTagP(impliedTagToken("p"))
             self.tree.insertElement(token)
             self.tree.openElements.pop()
-            token["selfClosingAcknowledged"] = True
+            token.selfClosingAcknowledged = True
             self.parser.framesetOK = False
 
         def startTagImage(self, token):
@@ -1225,28 +1622,28 @@ def getPhases(debug):
             self.parser.parseError("unexpected-start-tag-treated-as",
               {"originalName": "image", "newName": "img"})
             self.processStartTag(impliedTagToken("img", "StartTag",
-                                                 attributes=token["data"],
-                                                 selfClosing=token["selfClosing"]))
+                                                 attributes=token.data,
+                                                 selfClosing=token.selfClosing))
 
         def startTagIsIndex(self, token):
             self.parser.parseError("deprecated-tag", {"name": "isindex"})
             if self.tree.formPointer:
                 return
             form_attrs = {}
-            if "action" in token["data"]:
-                form_attrs["action"] = token["data"]["action"]
+            if "action" in token.data:
+                form_attrs["action"] = token.data["action"]
             self.processStartTag(impliedTagToken("form", "StartTag",
                                                  attributes=form_attrs))
             self.processStartTag(impliedTagToken("hr", "StartTag"))
             self.processStartTag(impliedTagToken("label", "StartTag"))
             # XXX Localization ...
-            if "prompt" in token["data"]:
-                prompt = token["data"]["prompt"]
+            if "prompt" in token.data:
+                prompt = token.data["prompt"]
             else:
                 prompt = u"This is a searchable index. Enter search keywords: "
             self.processCharacters(
-                {"type":tokenTypes["Characters"], "data":prompt})
-            attributes = token["data"].copy()
+                tokenizer.CharacterToken(tokenTypes["Characters"], prompt))
+            attributes = token.data.copy()
             if "action" in attributes:
                 del attributes["action"]
             if "prompt" in attributes:
@@ -1255,7 +1652,7 @@ def getPhases(debug):
             self.processStartTag(impliedTagToken("input", "StartTag", 
                                                  attributes = attributes,
                                                  selfClosing = 
-                                                 token["selfClosing"]))
+                                                 token.selfClosing))
             self.processEndTag(impliedTagToken("label"))
             self.processStartTag(impliedTagToken("hr", "StartTag"))
             self.processEndTag(impliedTagToken("form"))
@@ -1305,25 +1702,25 @@ def getPhases(debug):
             self.tree.reconstructActiveFormattingElements()
             self.parser.adjustMathMLAttributes(token)
             self.parser.adjustForeignAttributes(token)
-            token["namespace"] = namespaces["mathml"]
+            token.namespace = namespaces["mathml"]
             self.tree.insertElement(token)
             #Need to get the parse error right for the case where the token 
             #has a namespace not equal to the xmlns attribute
-            if token["selfClosing"]:
+            if token.selfClosing:
                 self.tree.openElements.pop()
-                token["selfClosingAcknowledged"] = True
+                token.selfClosingAcknowledged = True
 
         def startTagSvg(self, token):
             self.tree.reconstructActiveFormattingElements()
             self.parser.adjustSVGAttributes(token)
             self.parser.adjustForeignAttributes(token)
-            token["namespace"] = namespaces["svg"]
+            token.namespace = namespaces["svg"]
             self.tree.insertElement(token)
             #Need to get the parse error right for the case where the token 
             #has a namespace not equal to the xmlns attribute
-            if token["selfClosing"]:
+            if token.selfClosing:
                 self.tree.openElements.pop()
-                token["selfClosingAcknowledged"] = True
+                token.selfClosingAcknowledged = True
 
         def startTagMisplaced(self, token):
             """ Elements that should be children of other elements that have a
@@ -1332,7 +1729,7 @@ def getPhases(debug):
             "option", "optgroup", "tbody", "td", "tfoot", "th", "thead",
             "tr", "noscript"
             """
-            self.parser.parseError("unexpected-start-tag-ignored", {"name": token["name"]})
+            self.parser.parseError("unexpected-start-tag-ignored", {"name": token.name})
 
         def startTagOther(self, token):
             self.tree.reconstructActiveFormattingElements()
@@ -1377,16 +1774,16 @@ def getPhases(debug):
 
         def endTagBlock(self, token):
             #Put us back in the right whitespace handling mode
-            if token["name"] == "pre":
+            if token.name == "pre":
                 self.processSpaceCharacters = self.processSpaceCharactersNonPre
-            inScope = self.tree.elementInScope(token["name"])
+            inScope = self.tree.elementInScope(token.name)
             if inScope:
                 self.tree.generateImpliedEndTags()
-            if self.tree.openElements[-1].name != token["name"]:
-                 self.parser.parseError("end-tag-too-early", {"name": token["name"]})
+            if self.tree.openElements[-1].name != token.name:
+                 self.parser.parseError("end-tag-too-early", {"name": token.name})
             if inScope:
                 node = self.tree.openElements.pop()
-                while node.name != token["name"]:
+                while node.name != token.name:
                     node = self.tree.openElements.pop()
 
         def endTagForm(self, token):
@@ -1403,20 +1800,20 @@ def getPhases(debug):
                 self.tree.openElements.remove(node)
 
         def endTagListItem(self, token):
-            if token["name"] == "li":
+            if token.name == "li":
                 variant = "list"
             else:
                 variant = None
-            if not self.tree.elementInScope(token["name"], variant=variant):
-                self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+            if not self.tree.elementInScope(token.name, variant=variant):
+                self.parser.parseError("unexpected-end-tag", {"name": token.name})
             else:
-                self.tree.generateImpliedEndTags(exclude = token["name"])
-                if self.tree.openElements[-1].name != token["name"]:
+                self.tree.generateImpliedEndTags(exclude = token.name)
+                if self.tree.openElements[-1].name != token.name:
                     self.parser.parseError(
                         "end-tag-too-early",
-                        {"name": token["name"]})
+                        {"name": token.name})
                 node = self.tree.openElements.pop()
-                while node.name != token["name"]:
+                while node.name != token.name:
                     node = self.tree.openElements.pop()
 
         def endTagHeading(self, token):
@@ -1424,8 +1821,8 @@ def getPhases(debug):
                 if self.tree.elementInScope(item):
                     self.tree.generateImpliedEndTags()
                     break
-            if self.tree.openElements[-1].name != token["name"]:
-                self.parser.parseError("end-tag-too-early", {"name": token["name"]})
+            if self.tree.openElements[-1].name != token.name:
+                self.parser.parseError("end-tag-too-early", {"name": token.name})
 
             for item in headingElements:
                 if self.tree.elementInScope(item):
@@ -1438,7 +1835,7 @@ def getPhases(debug):
             """The much-feared adoption agency algorithm"""
             # http://www.whatwg.org/specs/web-apps/current-work/#adoptionAgency
             # XXX Better parseError messages appreciated.
-            name = token["name"]
+            name = token.name
 
             outerLoopCounter = 0
             while outerLoopCounter < 8:
@@ -1446,22 +1843,22 @@ def getPhases(debug):
 
                 # Step 1 paragraph 1
                 formattingElement = self.tree.elementInActiveFormattingElements(
-                    token["name"])
+                    token.name)
                 if (not formattingElement or 
                     (formattingElement in self.tree.openElements and
                      not self.tree.elementInScope(formattingElement.name))):
-                    self.parser.parseError("adoption-agency-1.1", {"name": token["name"]})
+                    self.parser.parseError("adoption-agency-1.1", {"name": token.name})
                     return
 
                 # Step 1 paragraph 2
                 elif formattingElement not in self.tree.openElements:
-                    self.parser.parseError("adoption-agency-1.2", {"name": token["name"]})
+                    self.parser.parseError("adoption-agency-1.2", {"name": token.name})
                     self.tree.activeFormattingElements.remove(formattingElement)
                     return
 
                 # Step 1 paragraph 3
                 if formattingElement != self.tree.openElements[-1]:
-                    self.parser.parseError("adoption-agency-1.3", {"name": token["name"]})
+                    self.parser.parseError("adoption-agency-1.3", {"name": token.name})
 
                 # Step 2
                 # Start of the adoption agency algorithm proper
@@ -1562,14 +1959,14 @@ def getPhases(debug):
                   self.tree.openElements.index(furthestBlock) + 1, clone)
 
         def endTagAppletMarqueeObject(self, token):
-            if self.tree.elementInScope(token["name"]):
+            if self.tree.elementInScope(token.name):
                 self.tree.generateImpliedEndTags()
-            if self.tree.openElements[-1].name != token["name"]:
-                self.parser.parseError("end-tag-too-early", {"name": token["name"]})
+            if self.tree.openElements[-1].name != token.name:
+                self.parser.parseError("end-tag-too-early", {"name": token.name})
 
-            if self.tree.elementInScope(token["name"]):
+            if self.tree.elementInScope(token.name):
                 element = self.tree.openElements.pop()
-                while element.name != token["name"]:
+                while element.name != token.name:
                     element = self.tree.openElements.pop()
                 self.tree.clearActiveFormattingElements()
 
@@ -1582,16 +1979,16 @@ def getPhases(debug):
 
         def endTagOther(self, token):
             for node in self.tree.openElements[::-1]:
-                if node.name == token["name"]:
-                    self.tree.generateImpliedEndTags(exclude=token["name"])
-                    if self.tree.openElements[-1].name != token["name"]:
-                        self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+                if node.name == token.name:
+                    self.tree.generateImpliedEndTags(exclude=token.name)
+                    if self.tree.openElements[-1].name != token.name:
+                        self.parser.parseError("unexpected-end-tag", {"name": token.name})
                     while self.tree.openElements.pop() != node:
                         pass
                     break
                 else:
                     if node.nameTuple in specialElements:
-                        self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+                        self.parser.parseError("unexpected-end-tag", {"name": token.name})
                         break
 
     class TextPhase(Phase):
@@ -1604,7 +2001,7 @@ def getPhases(debug):
             self.endTagHandler.default = self.endTagOther
 
         def processCharacters(self, token):
-            self.tree.insertText(token["data"])
+            self.tree.insertText(token.data)
 
         def processEOF(self):
             self.parser.parseError("expected-named-closing-tag-but-got-eof", 
@@ -1614,7 +2011,7 @@ def getPhases(debug):
             return True
 
         def startTagOther(self, token):
-            assert False, "Tried to process start tag %s in RCDATA/RAWTEXT mode"%token['name']
+            assert False, "Tried to process start tag %s in RCDATA/RAWTEXT mode"%token.name
 
         def endTagScript(self, token):
             node = self.tree.openElements.pop()
@@ -1723,8 +2120,8 @@ def getPhases(debug):
             return self.parser.phases["inHead"].processStartTag(token)
 
         def startTagInput(self, token):
-            if ("type" in token["data"] and 
-                token["data"]["type"].translate(asciiUpper2Lower) == "hidden"):
+            if ("type" in token.data and 
+                token.data["type"].translate(asciiUpper2Lower) == "hidden"):
                 self.parser.parseError("unexpected-hidden-input-in-table")
                 self.tree.insertElement(token)
                 # XXX associate with form
@@ -1740,7 +2137,7 @@ def getPhases(debug):
                 self.tree.openElements.pop()
 
         def startTagOther(self, token):
-            self.parser.parseError("unexpected-start-tag-implies-table-voodoo", {"name": token["name"]})
+            self.parser.parseError("unexpected-start-tag-implies-table-voodoo", {"name": token.name})
             # Do the table magic!
             self.tree.insertFromTable = True
             self.parser.phases["inBody"].processStartTag(token)
@@ -1763,10 +2160,10 @@ def getPhases(debug):
                 self.parser.parseError()
 
         def endTagIgnore(self, token):
-            self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+            self.parser.parseError("unexpected-end-tag", {"name": token.name})
 
         def endTagOther(self, token):
-            self.parser.parseError("unexpected-end-tag-implies-table-voodoo", {"name": token["name"]})
+            self.parser.parseError("unexpected-end-tag-implies-table-voodoo", {"name": token.name})
             # Do the table magic!
             self.tree.insertFromTable = True
             self.parser.phases["inBody"].processEndTag(token)
@@ -1779,9 +2176,9 @@ def getPhases(debug):
             self.characterTokens = []
 
         def flushCharacters(self):
-            data = "".join([item["data"] for item in self.characterTokens])
+            data = "".join([item.data for item in self.characterTokens])
             if any([item not in spaceCharacters for item in data]):
-                token = {"type":tokenTypes["Characters"], "data":data}
+                token = tokenizer.CharacterToken(tokenTypes["Characters"], data)
                 self.parser.phases["inTable"].insertText(token)
             elif data:
                 self.tree.insertText(data)
@@ -1798,7 +2195,7 @@ def getPhases(debug):
             return True
 
         def processCharacters(self, token):
-            if token["data"] == u"\u0000":
+            if token.data == u"\u0000":
                 return
             self.characterTokens.append(token)
 
@@ -1884,7 +2281,7 @@ def getPhases(debug):
                 return token
 
         def endTagIgnore(self, token):
-            self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+            self.parser.parseError("unexpected-end-tag", {"name": token.name})
 
         def endTagOther(self, token):
             return self.parser.phases["inBody"].processEndTag(token)
@@ -2004,7 +2401,7 @@ def getPhases(debug):
 
         def startTagTableCell(self, token):
             self.parser.parseError("unexpected-cell-in-table-body", 
-                                   {"name": token["name"]})
+                                   {"name": token.name})
             self.startTagTr(impliedTagToken("tr", "StartTag"))
             return token
 
@@ -2026,13 +2423,13 @@ def getPhases(debug):
             return self.parser.phases["inTable"].processStartTag(token)
 
         def endTagTableRowGroup(self, token):
-            if self.tree.elementInScope(token["name"], variant="table"):
+            if self.tree.elementInScope(token.name, variant="table"):
                 self.clearStackToTableBodyContext()
                 self.tree.openElements.pop()
                 self.parser.phase = self.parser.phases["inTable"]
             else:
                 self.parser.parseError("unexpected-end-tag-in-table-body",
-                  {"name": token["name"]})
+                  {"name": token.name})
 
         def endTagTable(self, token):
             if (self.tree.elementInScope("tbody", variant="table") or
@@ -2049,7 +2446,7 @@ def getPhases(debug):
 
         def endTagIgnore(self, token):
             self.parser.parseError("unexpected-end-tag-in-table-body",
-              {"name": token["name"]})
+              {"name": token.name})
 
         def endTagOther(self, token):
             return self.parser.phases["inTable"].processEndTag(token)
@@ -2131,7 +2528,7 @@ def getPhases(debug):
                 return token
 
         def endTagTableRowGroup(self, token):
-            if self.tree.elementInScope(token["name"], variant="table"):
+            if self.tree.elementInScope(token.name, variant="table"):
                 self.endTagTr(impliedTagToken("tr"))
                 return token
             else:
@@ -2139,7 +2536,7 @@ def getPhases(debug):
 
         def endTagIgnore(self, token):
             self.parser.parseError("unexpected-end-tag-in-table-row",
-                {"name": token["name"]})
+                {"name": token.name})
 
         def endTagOther(self, token):
             return self.parser.phases["inTable"].processEndTag(token)
@@ -2190,27 +2587,27 @@ def getPhases(debug):
             return self.parser.phases["inBody"].processStartTag(token)
 
         def endTagTableCell(self, token):
-            if self.tree.elementInScope(token["name"], variant="table"):
-                self.tree.generateImpliedEndTags(token["name"])
-                if self.tree.openElements[-1].name != token["name"]:
+            if self.tree.elementInScope(token.name, variant="table"):
+                self.tree.generateImpliedEndTags(token.name)
+                if self.tree.openElements[-1].name != token.name:
                     self.parser.parseError("unexpected-cell-end-tag",
-                      {"name": token["name"]})
+                      {"name": token.name})
                     while True:
                         node = self.tree.openElements.pop()
-                        if node.name == token["name"]:
+                        if node.name == token.name:
                             break
                 else:
                     self.tree.openElements.pop()
                 self.tree.clearActiveFormattingElements()
                 self.parser.phase = self.parser.phases["inRow"]
             else:
-                self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+                self.parser.parseError("unexpected-end-tag", {"name": token.name})
 
         def endTagIgnore(self, token):
-            self.parser.parseError("unexpected-end-tag", {"name": token["name"]})
+            self.parser.parseError("unexpected-end-tag", {"name": token.name})
 
         def endTagImply(self, token):
-            if self.tree.elementInScope(token["name"], variant="table"):
+            if self.tree.elementInScope(token.name, variant="table"):
                 self.closeCell()
                 return token
             else:
@@ -2249,9 +2646,9 @@ def getPhases(debug):
                 assert self.parser.innerHTML
 
         def processCharacters(self, token):
-            if token["data"] == u"\u0000":
+            if token.data == u"\u0000":
                 return
-            self.tree.insertText(token["data"])
+            self.tree.insertText(token.data)
 
         def startTagOption(self, token):
             # We need to imply </option> if <option> is the current node.
@@ -2283,7 +2680,7 @@ def getPhases(debug):
 
         def startTagOther(self, token):
             self.parser.parseError("unexpected-start-tag-in-select",
-              {"name": token["name"]})
+              {"name": token.name})
 
         def endTagOption(self, token):
             if self.tree.openElements[-1].name == "option":
@@ -2318,7 +2715,7 @@ def getPhases(debug):
 
         def endTagOther(self, token):
             self.parser.parseError("unexpected-end-tag-in-select",
-              {"name": token["name"]})
+              {"name": token.name})
 
 
     class InSelectInTablePhase(Phase):
@@ -2344,7 +2741,7 @@ def getPhases(debug):
             return self.parser.phases["inSelect"].processCharacters(token)
 
         def startTagTable(self, token):
-            self.parser.parseError("unexpected-table-element-start-tag-in-select-in-table", {"name": token["name"]})
+            self.parser.parseError("unexpected-table-element-start-tag-in-select-in-table", {"name": token.name})
             self.endTagOther(impliedTagToken("select"))
             return token
 
@@ -2352,8 +2749,8 @@ def getPhases(debug):
             return self.parser.phases["inSelect"].processStartTag(token)
 
         def endTagTable(self, token):
-            self.parser.parseError("unexpected-table-element-end-tag-in-select-in-table", {"name": token["name"]})
-            if self.tree.elementInScope(token["name"], variant="table"):
+            self.parser.parseError("unexpected-table-element-end-tag-in-select-in-table", {"name": token.name})
+            if self.tree.elementInScope(token.name, variant="table"):
                 self.endTagOther(impliedTagToken("select"))
                 return token
 
@@ -2411,24 +2808,24 @@ def getPhases(debug):
                             u"radialgradient":u"radialGradient",
                             u"textpath":u"textPath"}
 
-            if token["name"] in replacements:
-                token["name"] = replacements[token["name"]]
+            if token.name in replacements:
+                token.name = replacements[token.name]
 
         def processCharacters(self, token):
-            if token["data"] == u"\u0000":
-                token["data"] = u"\uFFFD"
+            if token.data == u"\u0000":
+                token.data = u"\uFFFD"
             elif (self.parser.framesetOK and 
-                  any(char not in spaceCharacters for char in token["data"])):
+                  any(char not in spaceCharacters for char in token.data)):
                 self.parser.framesetOK = False
             Phase.processCharacters(self, token)
 
         def processStartTag(self, token):
             currentNode = self.tree.openElements[-1]
-            if (token["name"] in self.breakoutElements or
-                (token["name"] == "font" and
-                 set(token["data"].keys()) & set(["color", "face", "size"]))):
+            if (token.name in self.breakoutElements or
+                (token.name == "font" and
+                 set(token.data.keys()) & set(["color", "face", "size"]))):
                 self.parser.parseError("unexpected-html-element-in-foreign-content",
-                                       token["name"])
+                                       token.name)
                 while (self.tree.openElements[-1].namespace !=
                        self.tree.defaultNamespace and 
                        not self.parser.isHTMLIntegrationPoint(self.tree.openElements[-1]) and
@@ -2443,20 +2840,20 @@ def getPhases(debug):
                     self.adjustSVGTagNames(token)
                     self.parser.adjustSVGAttributes(token)
                 self.parser.adjustForeignAttributes(token)
-                token["namespace"] = currentNode.namespace
+                token.namespace = currentNode.namespace
                 self.tree.insertElement(token)
-                if token["selfClosing"]:
+                if token.selfClosing:
                     self.tree.openElements.pop()
-                    token["selfClosingAcknowledged"] = True
+                    token.selfClosingAcknowledged = True
 
         def processEndTag(self, token):
             nodeIndex = len(self.tree.openElements) - 1
             node = self.tree.openElements[-1]
-            if node.name != token["name"]:
-                self.parser.parseError("unexpected-end-tag", token["name"])
+            if node.name != token.name:
+                self.parser.parseError("unexpected-end-tag", token.name)
 
             while True:
-                if node.name.translate(asciiUpper2Lower) == token["name"]:
+                if node.name.translate(asciiUpper2Lower) == token.name:
                     #XXX this isn't in the spec but it seems necessary
                     if self.parser.phase == self.parser.phases["inTableText"]:
                         self.parser.phase.flushCharacters()
@@ -2507,7 +2904,7 @@ def getPhases(debug):
 
         def startTagOther(self, token):
             self.parser.parseError("unexpected-start-tag-after-body",
-              {"name": token["name"]})
+              {"name": token.name})
             self.parser.phase = self.parser.phases["inBody"]
             return token
 
@@ -2519,7 +2916,7 @@ def getPhases(debug):
 
         def endTagOther(self, token):
             self.parser.parseError("unexpected-end-tag-after-body",
-              {"name": token["name"]})
+              {"name": token.name})
             self.parser.phase = self.parser.phases["inBody"]
             return token
 
@@ -2562,7 +2959,7 @@ def getPhases(debug):
 
         def startTagOther(self, token):
             self.parser.parseError("unexpected-start-tag-in-frameset",
-              {"name": token["name"]})
+              {"name": token.name})
 
         def endTagFrameset(self, token):
             if self.tree.openElements[-1].name == "html":
@@ -2578,7 +2975,7 @@ def getPhases(debug):
 
         def endTagOther(self, token):
             self.parser.parseError("unexpected-end-tag-in-frameset",
-              {"name": token["name"]})
+              {"name": token.name})
 
 
     class AfterFramesetPhase(Phase):
@@ -2609,14 +3006,14 @@ def getPhases(debug):
 
         def startTagOther(self, token):
             self.parser.parseError("unexpected-start-tag-after-frameset",
-              {"name": token["name"]})
+              {"name": token.name})
 
         def endTagHtml(self, token):
             self.parser.phase = self.parser.phases["afterAfterFrameset"]
 
         def endTagOther(self, token):
             self.parser.parseError("unexpected-end-tag-after-frameset",
-              {"name": token["name"]})
+              {"name": token.name})
 
 
     class AfterAfterBodyPhase(Phase):
@@ -2647,13 +3044,13 @@ def getPhases(debug):
 
         def startTagOther(self, token):
             self.parser.parseError("expected-eof-but-got-start-tag",
-              {"name": token["name"]})
+              {"name": token.name})
             self.parser.phase = self.parser.phases["inBody"]
             return token
 
         def processEndTag(self, token):
             self.parser.parseError("expected-eof-but-got-end-tag",
-              {"name": token["name"]})
+              {"name": token.name})
             self.parser.phase = self.parser.phases["inBody"]
             return token
 
@@ -2687,11 +3084,11 @@ def getPhases(debug):
 
         def startTagOther(self, token):
             self.parser.parseError("expected-eof-but-got-start-tag",
-              {"name": token["name"]})
+              {"name": token.name})
 
         def processEndTag(self, token):
             self.parser.parseError("expected-eof-but-got-end-tag",
-              {"name": token["name"]})
+              {"name": token.name})
 
 
     return {
@@ -2725,8 +3122,8 @@ def impliedTagToken(name, type="EndTag", attributes = None,
                     selfClosing = False):
     if attributes is None:
         attributes = {}
-    return {"type":tokenTypes[type], "name":unicode(name), "data":attributes,
-            "selfClosing":selfClosing}
+    return tokenizer.TagToken(tokenTypes[type], unicode(name), attributes,
+                              selfClosing)
 
 class ParseError(Exception):
     """Error in parsed document"""
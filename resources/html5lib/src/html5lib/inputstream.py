@@ -2,19 +2,66 @@ import codecs
 import re
 import types
 import sys
-
-from constants import EOF, spaceCharacters, asciiLetters, asciiUppercase
-from constants import encodings, ReparseException
+import os
+import stat
+from bisect import bisect_left
+from collections import deque
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+try:
+    from io import BytesIO
+except:
+    # 2to3 converts this line to: from io import StringIO  
+    from cStringIO import StringIO as BytesIO
+
+from constants import EOF, spaceCharacters, asciiLetters, asciiUpper2Lower
+from constants import encodings, ReparseException, NeedMoreInput
 import utils
 
 #Non-unicode versions of constants for use in the pre-parser
 spaceCharactersBytes = frozenset([str(item) for item in spaceCharacters])
 asciiLettersBytes = frozenset([str(item) for item in asciiLetters])
-asciiUppercaseBytes = frozenset([str(item) for item in asciiUppercase])
-spacesAngleBrackets = spaceCharactersBytes | frozenset([">", "<"])
+
+# The byte order marks detectBOM recognises (UTF-32 ones start like UTF-16
+# ones, so four bytes are needed to tell which)
+bomBytes = (codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE,
+            codecs.BOM_UTF32_BE)
+
+# Byte patterns used by the meta prescan
+spaceBytesRe = re.compile("[\t\n\x0c\r ]*")
+attributeGapRe = re.compile("[\t\n\x0c\r /]*")
+attributeNameRe = re.compile("[^\t\n\x0c\r />=]*")
+attributeValueEndRe = re.compile("[\t\n\x0c\r <>]")
+nonSpaceBytesRe = re.compile("[^\t\n\x0c\r ]*")
+tagNameRe = re.compile("[^\t\n\x0c\r <>]*")
 
 invalid_unicode_re = re.compile(u"[\u0001-\u0008\u000B\u000E-\u001F\u007F-\u009F\uD800-\uDFFF\uFDD0-\uFDEF\uFFFE\uFFFF\U0001FFFE\U0001FFFF\U0002FFFE\U0002FFFF\U0003FFFE\U0003FFFF\U0004FFFE\U0004FFFF\U0005FFFE\U0005FFFF\U0006FFFE\U0006FFFF\U0007FFFE\U0007FFFF\U0008FFFE\U0008FFFF\U0009FFFE\U0009FFFF\U000AFFFE\U000AFFFF\U000BFFFE\U000BFFFF\U000CFFFE\U000CFFFF\U000DFFFE\U000DFFFF\U000EFFFE\U000EFFFF\U000FFFFE\U000FFFFF\U0010FFFE\U0010FFFF]")
 
+# Characters readChunk has to act on: CR, invalid codepoints within the BMP
+# and, on UCS4 builds, anything outside the BMP (which includes the invalid
+# U+1FFFE, U+1FFFF, ... codepoints). A single range for the latter keeps the
+# regexp much faster than listing the individual non-BMP codepoints.
+if len(u"\U0010FFFF") == 1:
+    special_characters_re = re.compile(u"[\r\u0001-\u0008\u000B\u000E-\u001F\u007F-\u009F\uD800-\uDFFF\uFDD0-\uFDEF\uFFFE\uFFFF\U00010000-\U0010FFFF]")
+else:
+    special_characters_re = re.compile(u"[\r\u0001-\u0008\u000B\u000E-\u001F\u007F-\u009F\uD800-\uDFFF\uFDD0-\uFDEF\uFFFE\uFFFF]")
+
+# On UCS4 builds a surrogate pair in a unicode source becomes a single
+# character when the source is round-tripped through UTF-8
+if len(u"\U0010FFFF") == 1:
+    surrogate_pair_re = re.compile(u"[\uD800-\uDBFF][\uDC00-\uDFFF]")
+else:
+    surrogate_pair_re = None
+
+# The same characters within ASCII, for the pure-ASCII fast path
+asciiSpecialBytes = "".join([chr(item) for item in
+                             range(0x01, 0x09) + [0x0B, 0x0D] +
+                             range(0x0E, 0x20) + [0x7F]])
+
 non_bmp_invalid_codepoints = set([0x1FFFE, 0x1FFFF, 0x2FFFE, 0x2FFFF, 0x3FFFE,
                                   0x3FFFF, 0x4FFFE, 0x4FFFF, 0x5FFFE, 0x5FFFF,
                                   0x6FFFE, 0x6FFFF, 0x7FFFE, 0x7FFFF, 0x8FFFE,
@@ -25,83 +72,218 @@ non_bmp_invalid_codepoints = set([0x1FFFE, 0x1FFFF, 0x2FFFE, 0x2FFFF, 0x3FFFE,
 
 ascii_punctuation_re = re.compile(ur"[\u0009-\u000D\u0020-\u002F\u003A-\u0040\u005B-\u0060\u007B-\u007E]")
 
+newline_re = re.compile(u"\n")
+
 # Cache for charsUntil()
 charsUntilRegEx = {}
+
+# Characters that end the tag name of an end tag
+endTagNameEnd = frozenset((u"/", u">")) | spaceCharacters
         
 class BufferedStream:
     """Buffering for streams that do not have buffering of their own
 
-    The buffer is implemented as a list of chunks on the assumption that 
-    joining many strings will be slow since it is O(n**2)
+    Everything read is kept in a single buffer so that tell() and seek()
+    are O(1), but only while rewinds may still be needed: once release()
+    has been called or more than maxBufferSize bytes have been read, data
+    left in the buffer is returned and then dropped, and the stream is
+    read from directly. From then on seek() raises IOError.
     """
-    
+
+    maxBufferSize = 1048576
+
     def __init__(self, stream):
         self.stream = stream
-        self.buffer = []
-        self.position = [-1,0] #chunk number, offset
+        self.buffer = BytesIO()
+        self.rewindable = True
+        # Number of bytes read from the underlying stream
+        self.streamPosition = 0
 
     def tell(self):
-        pos = 0
-        for chunk in self.buffer[:self.position[0]]:
-            pos += len(chunk)
-        pos += self.position[1]
-        return pos
+        if self.buffer is not None:
+            return self.buffer.tell()
+        return self.streamPosition
 
     def seek(self, pos):
-        assert pos < self._bufferedBytes()
-        offset = pos
-        i = 0
-        while len(self.buffer[i]) < offset:
-            offset -= pos
-            i += 1
-        self.position = [i, offset]
-
-    def read(self, bytes):
-        if not self.buffer:
-            return self._readStream(bytes)
-        elif (self.position[0] == len(self.buffer) and
-              self.position[1] == len(self.buffer[-1])):
-            return self._readStream(bytes)
-        else:
-            return self._readFromBuffer(bytes)
-    
-    def _bufferedBytes(self):
-        return sum([len(item) for item in self.buffer])
-
-    def _readStream(self, bytes):
+        if not self.rewindable or pos > self.streamPosition:
+            raise IOError("Can't seek to %d in an unbuffered stream" % pos)
+        self.buffer.seek(pos)
+
+    def release(self):
+        """Stop keeping data for rewinds"""
+        self.rewindable = False
+        if (self.buffer is not None and
+            self.buffer.tell() == self.streamPosition):
+            self.buffer = None
+
+    def read(self, bytes=-1):
+        rv = ""
+        if self.buffer is not None:
+            rv = self.buffer.read(bytes)
+            if bytes >= 0:
+                bytes -= len(rv)
+                if not bytes:
+                    return rv
+            if not self.rewindable:
+                # Everything buffered has been read and won't be needed again
+                self.buffer = None
         data = self.stream.read(bytes)
-        self.buffer.append(data)
-        self.position[0] += 1
-        self.position[1] = len(data)
-        return data
+        self.streamPosition += len(data)
+        if self.buffer is not None:
+            if self.streamPosition <= self.maxBufferSize:
+                self.buffer.write(data)
+            else:
+                # Too much to keep; the stream can't be rewound from here on
+                self.buffer = None
+                self.rewindable = False
+        return rv + data
 
-    def _readFromBuffer(self, bytes):
-        remainingBytes = bytes
-        rv = []
-        bufferIndex = self.position[0]
-        bufferOffset = self.position[1]
-        while bufferIndex < len(self.buffer) and remainingBytes != 0:
-            assert remainingBytes > 0
-            bufferedData = self.buffer[bufferIndex]
-            
-            if remainingBytes <= len(bufferedData) - bufferOffset:
-                bytesToRead = remainingBytes
-                self.position = [bufferIndex, bufferOffset + bytesToRead]
+
+class MappedStreamReader(object):
+    """Decodes characters straight out of a memory-mapped file
+
+    This stands in for the codecs StreamReader when the raw stream is an
+    mmap; each read decodes one large slice of the mapping with an
+    incremental decoder rather than going through a buffered file read and
+    the StreamReader's own character buffer.
+    """
+
+    def __init__(self, mapping, encoding, sliceSize=65536):
+        self.mapping = mapping
+        self.position = mapping.tell()
+        self.sliceSize = sliceSize
+        self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+
+    def read(self, size=-1):
+        mapping = self.mapping
+        if mapping is None:
+            return u""
+        length = len(mapping)
+        rv = u""
+        # Loop because a slice can end part way through a multi-byte
+        # character, in which case the decoder returns nothing yet
+        while not rv and self.position < length:
+            start = self.position
+            if size < 0:
+                end = length
             else:
-                bytesToRead = len(bufferedData) - bufferOffset
-                self.position = [bufferIndex, len(bufferedData)]
-                bufferIndex += 1
-            data = rv.append(bufferedData[bufferOffset: 
-                                          bufferOffset + bytesToRead])
-            remainingBytes -= bytesToRead
+                end = min(start + max(size, self.sliceSize), length)
+            self.position = end
+            rv = self.decoder.decode(mapping[start:end], end == length)
+        return rv
 
-            bufferOffset = 0
+    def tell(self):
+        """Offset of the first byte that has not been decoded yet"""
+        return self.position - len(self.decoder.getstate()[0])
 
-        if remainingBytes:
-            rv.append(self._readStream(remainingBytes))
-        
+    def close(self):
+        """Unmap the file; read() returns nothing from then on"""
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+class UnicodeStreamReader(object):
+    """Reads characters from a unicode source that is already decoded
+
+    Used in place of a codecs StreamReader for unicode input, so the text
+    is sliced directly instead of being encoded to UTF-8 and decoded again.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.position = 0
+
+    def read(self, size=-1):
+        start = self.position
+        length = len(self.text)
+        if size < 0:
+            end = length
+        else:
+            end = min(start + size, length)
+        self.position = end
+        if start == 0 and end == length:
+            # Hand back the whole source without copying it
+            return self.text
+        return self.text[start:end]
+
+
+class PrefixedStream(object):
+    """Reads bytes already taken from a stream ahead of the rest of it
+
+    Encoding detection reads the start of the stream once; the decoder is
+    handed that block through this wrapper instead of the stream being
+    rewound to read it again. tell() reports offsets in the wrapped stream.
+    """
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        prefix = self.prefix
+        if not prefix:
+            return self.stream.read(size)
+        if size < 0:
+            self.prefix = ""
+            return prefix + self.stream.read()
+        self.prefix = prefix[size:]
+        return prefix[:size]
+
+    def tell(self):
+        return self.stream.tell() - len(self.prefix)
+
+
+class FeedQueue(object):
+    """The source of a document given to HTMLParser.feed a piece at a time
+
+    read() returns no more than has been fed so far, so it returns no data
+    both when everything fed has been read and at the end of the document;
+    closed tells the two apart.
+    """
+
+    def __init__(self):
+        self.parts = deque()
+        # Number of bytes fed so far
+        self.length = 0
+        self.closed = False
+
+    def append(self, data):
+        if self.closed:
+            raise ValueError("Can't feed data after the end of the document")
+        if data:
+            self.parts.append(data)
+            self.length += len(data)
+
+    def close(self):
+        self.closed = True
+
+    def peek(self, size):
+        """Return the first size bytes not read yet (or fewer, if fewer
+        have been fed) without reading them"""
+        rv = []
+        for part in self.parts:
+            if size <= 0:
+                break
+            rv.append(part[:size])
+            size -= len(part)
+        return "".join(rv)
+
+    def read(self, size=-1):
+        parts = self.parts
+        if size < 0:
+            data = "".join(parts)
+            parts.clear()
+            return data
+        rv = []
+        while parts and size > 0:
+            part = parts.popleft()
+            if len(part) > size:
+                parts.appendleft(part[size:])
+                part = part[:size]
+            rv.append(part)
+            size -= len(part)
         return "".join(rv)
-        
 
 
 class HTMLInputStream:
@@ -114,7 +296,25 @@ class HTMLInputStream:
 
     _defaultChunkSize = 10240
 
-    def __init__(self, source, encoding=None, parseMeta=True, chardet=True):
+    # Streamed input is read in chunks that start at _defaultChunkSize and
+    # double on every read up to maxChunkSize. In-memory documents of at
+    # most maxChunkSize bytes (or characters) are read in one go
+    maxChunkSize = 1048576
+
+    # Memory-map sources that are regular files on disk
+    useMmap = True
+
+    # Number of bytes to use when looking for a meta element with encoding
+    # information
+    numBytesMeta = 512
+
+    # Most bytes given to chardet. Encoding detection reads a single block
+    # of max(numBytesMeta, numBytesChardet) bytes from the start of the
+    # stream and the BOM, meta and chardet checks all work on that block
+    numBytesChardet = 65536
+
+    def __init__(self, source, encoding=None, parseMeta=True, chardet=True,
+                 trackPositions=True, reportErrors=True):
         """Initialises the HTMLInputStream.
 
         HTMLInputStream(source, [encoding]) -> Normalized stream from source
@@ -129,6 +329,13 @@ class HTMLInputStream:
         
         parseMeta - Look for a <meta> element containing encoding information
 
+        trackPositions - Keep track of line and column numbers. If False no
+        line accounting is done as chunks are read and position() returns
+        None
+
+        reportErrors - Add the invalid characters found to self.errors. If
+        False they are replaced without being looked at any further
+
         """
 
         #Craziness
@@ -138,22 +345,39 @@ class HTMLInputStream:
         else:
             self.reportCharacterErrors = self.characterErrorsUCS2
             self.replaceCharactersRegexp = re.compile(u"([\uD800-\uDBFF](?![\uDC00-\uDFFF])|(?<![\uD800-\uDBFF])[\uDC00-\uDFFF])")
+        if not reportErrors:
+            self.reportCharacterErrors = self.ignoreCharacterErrors
 
         # List of where new lines occur
         self.newLines = [0]
 
+        self.trackPositions = trackPositions
+
         self.charEncoding = (codecName(encoding), "certain")
 
+        # Length of an in-memory source (in characters for unicode, bytes
+        # otherwise), None for file objects
+        self.sourceLength = None
+
+        # The FeedQueue of a document given to HTMLParser.feed. Until it is
+        # closed, running out of data raises NeedMoreInput and the chunk is
+        # extended instead of replaced, keeping the characters from
+        # chunkMark on so the tokenizer can go back to it and try again
+        self.feedQueue = None
+
+        # The file object a memory-mapped rawStream maps, and the reader
+        # of the characters of rawStream (set by reset)
+        self.mappedFile = None
+        self.dataStream = None
+
         # Raw Stream - for unicode objects this will encode to utf-8 and set
         #              self.charEncoding as appropriate
         self.rawStream = self.openStream(source)
 
+        # Bytes read by detectEncoding that the decoder hasn't been given yet
+        self.detectedPrefix = None
+
         # Encoding Information
-        #Number of bytes to use when looking for a meta element with
-        #encoding information
-        self.numBytesMeta = 512
-        #Number of bytes to use when using detecting encoding using chardet
-        self.numBytesChardet = 100
         #Encoding to use if no other information can be found
         self.defaultEncoding = "windows-1252"
         
@@ -163,43 +387,94 @@ class HTMLInputStream:
 
 
         self.reset()
+        self.releaseStream()
 
     def reset(self):
-        self.dataStream = codecs.getreader(self.charEncoding[0])(self.rawStream,
-                                                                 'replace')
+        if isinstance(self.dataStream, MappedStreamReader):
+            # Unmap the file rather than leave it to the garbage collector,
+            # and read it again from a new mapping
+            self.dataStream.close()
+            self.rawStream = self.mapFile(self.mappedFile)
+        self.dataStream = self.openDataStream()
 
         self.chunk = u""
         self.chunkSize = 0
         self.chunkOffset = 0
+        self.chunkMark = 0
         self.errors = []
 
+        if (self.sourceLength is not None and
+            self.sourceLength <= self.maxChunkSize):
+            # The whole document is already in memory; read it as one chunk
+            self.nextChunkSize = -1
+        else:
+            self.nextChunkSize = min(self._defaultChunkSize,
+                                     self.maxChunkSize)
+
         # number of (complete) lines in previous chunks
         self.prevNumLines = 0
         # number of columns in the last line of the previous chunk
         self.prevNumCols = 0
+        # number of characters in previous chunks
+        self.prevNumChars = 0
+        # offsets of the newlines in the current chunk, built on demand
+        self._lineOffsets = None
+        # chunk offsets given to markPosition in the current chunk, and the
+        # (line, col) positions of those in earlier chunks
+        self.markedOffsets = []
+        self.markedPositions = []
         
         #Deal with CR LF and surrogates split over chunk boundaries
         self._bufferedCharacter = None
 
+    def openDataStream(self):
+        """Returns a reader for the characters of rawStream from its current
+        position, decoded with the current encoding"""
+        if isinstance(self.rawStream, unicode):
+            return UnicodeStreamReader(self.rawStream)
+        prefix, self.detectedPrefix = self.detectedPrefix, None
+        if mmap is not None and isinstance(self.rawStream, mmap.mmap):
+            if prefix:
+                # Moving a mapping's position costs nothing; decode the
+                # detection block from the mapped pages
+                self.rawStream.seek(self.rawStream.tell() - len(prefix))
+            return MappedStreamReader(self.rawStream, self.charEncoding[0])
+        elif prefix:
+            return codecs.getreader(self.charEncoding[0])(
+                PrefixedStream(prefix, self.rawStream), 'replace')
+        else:
+            return codecs.getreader(self.charEncoding[0])(self.rawStream,
+                                                          'replace')
+
     def openStream(self, source):
         """Produces a file object from source.
 
         source can be either a file object, local filename or a string.
 
         """
+        if isinstance(source, FeedQueue):
+            self.feedQueue = source
         # Already a file object
         if hasattr(source, 'read'):
-            stream = source
+            stream = self.mapFile(source)
+            if stream is None:
+                stream = source
+            else:
+                self.mappedFile = source
+        elif (isinstance(source, unicode) and
+              not (surrogate_pair_re and surrogate_pair_re.search(source))):
+            # Already decoded; reset() reads the characters straight from it.
+            # charEncoding is reported as utf-8, as it always has been for
+            # unicode input
+            self.charEncoding = ("utf-8", "certain")
+            self.sourceLength = len(source)
+            return source
         else:
             # Otherwise treat source as a string and convert to a file object
             if isinstance(source, unicode):
                 source = source.encode('utf-8')
                 self.charEncoding = ("utf-8", "certain")
-            try:
-                from io import BytesIO
-            except:
-                # 2to3 converts this line to: from io import StringIO  
-                from cStringIO import StringIO as BytesIO
+            self.sourceLength = len(source)
             stream = BytesIO(source)
 
         if (not(hasattr(stream, "tell") and hasattr(stream, "seek")) or
@@ -208,32 +483,57 @@ class HTMLInputStream:
 
         return stream
 
+    def mapFile(self, source):
+        """Return a read-only memory map of source if it is a non-empty
+        regular file, otherwise None. The BOM and meta prescans then read
+        directly from the mapped pages and MappedStreamReader decodes from
+        them, without a separate buffered copy of the file."""
+        if mmap is None or not self.useMmap:
+            return None
+        try:
+            fileno = source.fileno()
+            fileStat = os.fstat(fileno)
+            if not stat.S_ISREG(fileStat.st_mode) or not fileStat.st_size:
+                return None
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            # No usable file descriptor (e.g. StringIO) or a file that can't
+            # be mapped; read it the ordinary way instead
+            return None
+
     def detectEncoding(self, parseMeta=True, chardet=True):
+        # Read the start of the stream once and look for the encoding in
+        # that block only; whatever follows the BOM is kept for the decoder
+        # so the stream doesn't have to be rewound
+        size = self.detectionBlockSize(parseMeta, chardet)
+        # A BufferedStream can only be rewound over what it retains
+        size = min(size, getattr(self.rawStream, "maxBufferSize", size))
+        block = self.readBlock(size)
+
         #First look for a BOM
-        #This will also read past the BOM if present
-        encoding = self.detectBOM()
+        encoding, bomLength = self.detectBOM(block)
+        self.detectedPrefix = block[bomLength:]
         confidence = "certain"
         #If there is no BOM need to look for meta elements with encoding 
         #information
         if encoding is None and parseMeta:
-            encoding = self.detectEncodingMeta()
+            encoding = self.detectEncodingMeta(block[:self.numBytesMeta])
             confidence = "tentative"
         #Guess with chardet, if avaliable
         if encoding is None and chardet:
             confidence = "tentative"
             try:
                 from chardet.universaldetector import UniversalDetector
-                buffers = []
                 detector = UniversalDetector()
-                while not detector.done:
-                    buffer = self.rawStream.read(self.numBytesChardet)
-                    if not buffer:
+                # Feed small pieces so that detection stops as soon as
+                # chardet is sure
+                for start in xrange(0, min(len(block), self.numBytesChardet),
+                                    100):
+                    if detector.done:
                         break
-                    buffers.append(buffer)
-                    detector.feed(buffer)
+                    detector.feed(block[start:start + 100])
                 detector.close()
                 encoding = detector.result['encoding']
-                self.rawStream.seek(0)
             except ImportError:
                 pass
         # If all else fails use the default encoding
@@ -249,56 +549,176 @@ class HTMLInputStream:
 
         return encoding, confidence
 
+    def detectionBlockSize(cls, parseMeta=True, chardet=True):
+        """Number of bytes detectEncoding looks at"""
+        size = 4
+        if parseMeta:
+            size = max(size, cls.numBytesMeta)
+        if chardet:
+            size = max(size, cls.numBytesChardet)
+        return size
+    detectionBlockSize = classmethod(detectionBlockSize)
+
+    def encodingDeclared(cls, data, parseMeta=True):
+        """Return whether data, the first bytes of a document, starts with a
+        BOM or, if parseMeta, has a meta element that the prescan takes the
+        encoding from. detectEncoding then settles on the same encoding
+        given just data as given the whole detection block: the prescan
+        only reports an encoding whose attribute value ends inside the data
+        it is given."""
+        if len(data) >= 4 and data.startswith(bomBytes):
+            return True
+        return (parseMeta and EncodingParser(
+            data[:cls.numBytesMeta]).getEncoding() is not None)
+    encodingDeclared = classmethod(encodingDeclared)
+
     def changeEncoding(self, newEncoding):
         newEncoding = codecName(newEncoding)
         if newEncoding in ("utf-16", "utf-16-be", "utf-16-le"):
             newEncoding = "utf-8"
         if newEncoding is None:
             return
-        elif newEncoding == self.charEncoding[0]:
+        elif (newEncoding == self.charEncoding[0] or
+              isinstance(self.rawStream, unicode)):
+            # unicode input has no bytes to decode differently
+            self.charEncoding = (self.charEncoding[0], "certain")
+        elif not getattr(self.rawStream, "rewindable", True):
+            # The start of the document is no longer available to reparse,
+            # so carry on with the current encoding
             self.charEncoding = (self.charEncoding[0], "certain")
         else:
-            self.rawStream.seek(0)
-            self.reset()
+            oldEncoding = self.charEncoding[0]
             self.charEncoding = (newEncoding, "certain")
-            raise ReparseException, "Encoding changed from %s to %s"%(self.charEncoding[0], newEncoding)
+            if not self.switchDecoder(oldEncoding):
+                self.rawStream.seek(0)
+                self.reset()
+                self.releaseStream()
+                raise ReparseException, "Encoding changed from %s to %s"%(oldEncoding, newEncoding)
+            self.releaseStream()
+
+    def switchDecoder(self, oldEncoding):
+        """Carry on from the current position with a decoder for the new
+        encoding if every character consumed so far is the same in
+        oldEncoding and the new one, so the document need not be reparsed.
+
+        The bytes decoded so far are decoded again in both encodings;
+        characters read ahead of the current position are replaced with
+        their new decoding. Returns False, changing nothing, if the
+        decodings differ before the current position or would report
+        different invalid characters after it."""
+        position = self.decodedBytes()
+        self.rawStream.seek(0)
+        data = self.rawStream.read(position)
+        oldText = data.decode(oldEncoding, 'replace')
+        decoder = codecs.getincrementaldecoder(self.charEncoding[0])('replace')
+        newText = decoder.decode(data)
+        pendingBytes = decoder.getstate()[0]
+
+        # Split both decodings where they start to differ, but not after a
+        # CR or high surrogate as their normalization depends on the
+        # character after them
+        common = len(os.path.commonprefix([oldText, newText]))
+        if common and (oldText[common - 1] == u"\r" or
+                       u"\uD800" <= oldText[common - 1] <= u"\uDBFF"):
+            common -= 1
+        newTail = newText[common:]
+        bufferedCharacter = None
+        if newTail and (newTail[-1] == u"\r" or
+                        u"\uD800" <= newTail[-1] <= u"\uDBFF"):
+            bufferedCharacter = newTail[-1]
+            newTail = newTail[:-1]
+
+        errors = self.errors
+        try:
+            self.errors = []
+            head = self.normalizeChunk(oldText[:common])
+            consumed = self.prevNumChars + self.chunkOffset
+            if len(head) < consumed:
+                return False
+            self.errors = []
+            self.normalizeChunk(oldText[common:])
+            oldErrors = self.errors
+            self.errors = []
+            newTail = self.normalizeChunk(newTail)
+            if self.errors != oldErrors:
+                return False
+        finally:
+            self.errors = errors
+
+        self.resolveMarks()
+        if self.trackPositions:
+            self.prevNumLines, self.prevNumCols = self._position(
+                self.chunkOffset)
+        self.prevNumChars = consumed
+        self.chunk = head[consumed:] + newTail
+        self.chunkSize = len(self.chunk)
+        self.chunkOffset = 0
+        self._lineOffsets = None
+        self._bufferedCharacter = bufferedCharacter
+
+        self.rawStream.seek(position - len(pendingBytes))
+        self.dataStream = self.openDataStream()
+        return True
+
+    def decodedBytes(self):
+        """Returns the number of bytes of rawStream decoded so far"""
+        if isinstance(self.dataStream, MappedStreamReader):
+            return self.dataStream.tell()
+        # Bytes the codecs reader holds back from the end of the stream are
+        # the start of a character it hasn't decoded yet
+        return self.dataStream.stream.tell() - len(self.dataStream.bytebuffer)
             
-    def detectBOM(self):
-        """Attempts to detect at BOM at the start of the stream. If
-        an encoding can be determined from the BOM return the name of the
-        encoding otherwise return None"""
+    def releaseStream(self):
+        """Let a BufferedStream stop keeping data once the encoding is
+        certain, as no ReparseException can then need to rewind it"""
+        if (self.charEncoding[1] == "certain" and
+            isinstance(self.rawStream, BufferedStream)):
+            self.rawStream.release()
+
+    def readBlock(self, size):
+        """Read size bytes from the raw stream, or as many as there are,
+        even if the stream returns fewer per read (as pipes do)"""
+        data = self.rawStream.read(size)
+        if len(data) == size or not data:
+            return data
+        parts = [data]
+        size -= len(data)
+        while size > 0:
+            data = self.rawStream.read(size)
+            if not data:
+                break
+            parts.append(data)
+            size -= len(data)
+        return "".join(parts)
+
+    def detectBOM(self, data):
+        """Attempts to detect a BOM at the start of data. Returns the name
+        of the encoding it gives and the length of the BOM, or (None, 0)"""
         bomDict = {
             codecs.BOM_UTF8: 'utf-8',
             codecs.BOM_UTF16_LE: 'utf-16-le', codecs.BOM_UTF16_BE: 'utf-16-be',
             codecs.BOM_UTF32_LE: 'utf-32-le', codecs.BOM_UTF32_BE: 'utf-32-be'
         }
 
-        # Go to beginning of file and read in 4 bytes
-        string = self.rawStream.read(4)
-
-        # Try detecting the BOM using bytes from the string
-        encoding = bomDict.get(string[:3])         # UTF-8
-        seek = 3
+        # Try detecting the BOM using the first bytes of data
+        encoding = bomDict.get(data[:3])         # UTF-8
+        length = 3
         if not encoding:
             # Need to detect UTF-32 before UTF-16
-            encoding = bomDict.get(string)         # UTF-32
-            seek = 4
+            encoding = bomDict.get(data[:4])     # UTF-32
+            length = 4
             if not encoding:
-                encoding = bomDict.get(string[:2]) # UTF-16
-                seek = 2
+                encoding = bomDict.get(data[:2]) # UTF-16
+                length = 2
 
-        # Set the read position past the BOM if one was found, otherwise
-        # set it to the start of the stream
-        self.rawStream.seek(encoding and seek or 0)
-
-        return encoding
+        if not encoding:
+            return None, 0
+        return encoding, length
 
-    def detectEncodingMeta(self):
-        """Report the encoding declared by the meta element
+    def detectEncodingMeta(self, data):
+        """Report the encoding declared by a meta element in data
         """
-        buffer = self.rawStream.read(self.numBytesMeta)
-        parser = EncodingParser(buffer)
-        self.rawStream.seek(0)
+        parser = EncodingParser(data)
         encoding = parser.getEncoding()
         
         if encoding in ("utf-16", "utf-16-be", "utf-16-le"):
@@ -307,21 +727,67 @@ class HTMLInputStream:
         return encoding
 
     def _position(self, offset):
-        chunk = self.chunk
-        nLines = chunk.count(u'\n', 0, offset)
+        lineOffsets = self._lineOffsets
+        if lineOffsets is None:
+            # Index the newlines in this chunk once; every later lookup in
+            # the same chunk is a bisection
+            lineOffsets = self._lineOffsets = [match.start() for match in
+                                               newline_re.finditer(self.chunk)]
+        nLines = bisect_left(lineOffsets, offset)
         positionLine = self.prevNumLines + nLines
-        lastLinePos = chunk.rfind(u'\n', 0, offset)
-        if lastLinePos == -1:
+        if nLines == 0:
             positionColumn = self.prevNumCols + offset
         else:
-            positionColumn = offset - (lastLinePos + 1)
+            positionColumn = offset - (lineOffsets[nLines - 1] + 1)
         return (positionLine, positionColumn)
 
+    def _chunkEndPosition(self):
+        """Return (line, col) at the end of the current chunk, without
+        building its newline index if position() never needed it"""
+        if self._lineOffsets is not None:
+            return self._position(self.chunkSize)
+        chunk = self.chunk
+        nLines = chunk.count(u'\n')
+        if nLines == 0:
+            return (self.prevNumLines, self.prevNumCols + self.chunkSize)
+        return (self.prevNumLines + nLines,
+                self.chunkSize - (chunk.rfind(u'\n') + 1))
+
     def position(self):
-        """Returns (line, col) of the current position in the stream."""
+        """Returns (line, col) of the current position in the stream, or
+        None if positions are not being tracked."""
+        if not self.trackPositions:
+            return None
         line, col = self._position(self.chunkOffset)
         return (line+1, col)
 
+    def markPosition(self):
+        """Note the current position, for takeMarkedPositions to return.
+        Only the chunk offset is kept until the chunk is about to change"""
+        self.markedOffsets.append(self.chunkOffset)
+
+    def resolveMarks(self):
+        """Turn the offsets noted in the current chunk into positions,
+        before the chunk changes"""
+        offsets = self.markedOffsets
+        if offsets:
+            if self.trackPositions:
+                position = self._position
+                for offset in offsets:
+                    line, col = position(offset)
+                    self.markedPositions.append((line+1, col))
+            else:
+                self.markedPositions.extend([None] * len(offsets))
+            self.markedOffsets = []
+
+    def takeMarkedPositions(self):
+        """Return, and forget, the positions of the calls to markPosition
+        so far, in order, as position() would have returned them"""
+        self.resolveMarks()
+        positions = self.markedPositions
+        self.markedPositions = []
+        return positions
+
     def char(self):
         """ Read one character from the stream or queue if available. Return
             EOF when EOF is reached.
@@ -339,15 +805,23 @@ class HTMLInputStream:
 
     def readChunk(self, chunkSize=None):
         if chunkSize is None:
-            chunkSize = self._defaultChunkSize
+            chunkSize = self.nextChunkSize
+            if 0 < chunkSize < self.maxChunkSize:
+                self.nextChunkSize = min(chunkSize * 2, self.maxChunkSize)
+
+        data = self.dataStream.read(chunkSize)
+        self.resolveMarks()
+        if self.feedQueue is not None and not self.feedQueue.closed:
+            return self.extendChunk(data)
 
-        self.prevNumLines, self.prevNumCols = self._position(self.chunkSize)
+        if self.trackPositions:
+            self.prevNumLines, self.prevNumCols = self._chunkEndPosition()
+        self.prevNumChars += self.chunkSize
 
         self.chunk = u""
         self.chunkSize = 0
         self.chunkOffset = 0
-
-        data = self.dataStream.read(chunkSize)
+        self._lineOffsets = None
         
         #Deal with CR LF and surrogates broken across chunks
         if self._bufferedCharacter:
@@ -355,6 +829,8 @@ class HTMLInputStream:
             self._bufferedCharacter = None
         elif not data:
             # We have no more data, bye-bye stream
+            if isinstance(self.dataStream, MappedStreamReader):
+                self.dataStream.close()
             return False
         
         if len(data) > 1:
@@ -363,25 +839,86 @@ class HTMLInputStream:
                 self._bufferedCharacter = data[-1]
                 data = data[:-1]
         
-        self.reportCharacterErrors(data)
-        
-        # Replace invalid characters
-        # Note U+0000 is dealt with in the tokenizer
-        data = self.replaceCharactersRegexp.sub(u"\ufffd", data)
-                    
-        data = data.replace(u"\r\n", u"\n")
-        data = data.replace(u"\r", u"\n")
+        data = self.normalizeChunk(data)
 
         self.chunk = data
         self.chunkSize = len(data)
 
         return True
 
-    def characterErrorsUCS4(self, data):
-        for i in xrange(len(invalid_unicode_re.findall(data))):
-            self.errors.append("invalid-codepoint")
+    def extendChunk(self, data):
+        """readChunk for a document that is still being fed: data is added
+        to the characters of the chunk from chunkMark on. Raises
+        NeedMoreInput, leaving the chunk as it is, if there is nothing to
+        add; a CR or high surrogate at the end is always held back, as the
+        next character may not have been fed yet"""
+        if self._bufferedCharacter:
+            data = self._bufferedCharacter + data
+            self._bufferedCharacter = None
+        if data:
+            lastv = ord(data[-1])
+            if lastv == 0x0D or 0xD800 <= lastv <= 0xDBFF:
+                self._bufferedCharacter = data[-1]
+                data = data[:-1]
+        if not data:
+            raise NeedMoreInput
+
+        mark = self.chunkMark
+        if self.trackPositions:
+            self.prevNumLines, self.prevNumCols = self._position(mark)
+        self.prevNumChars += mark
+
+        self.chunk = self.chunk[mark:] + self.normalizeChunk(data)
+        self.chunkSize = len(self.chunk)
+        self.chunkOffset -= mark
+        self.chunkMark = 0
+        self._lineOffsets = None
+        return True
+
+    def normalizeChunk(self, data):
+        """Report invalid codepoints in data, replace lone surrogates and
+        convert CR and CRLF to LF. Note U+0000 is dealt with in the tokenizer.
 
-    def characterErrorsUCS2(self, data):
+        A single regexp scan finds every character that needs attention;
+        pure-ASCII data without CR or control characters is returned as-is.
+        """
+        try:
+            asciiData = data.encode("ascii")
+        except UnicodeEncodeError:
+            pass
+        else:
+            if (len(asciiData.translate(None, asciiSpecialBytes)) ==
+                len(asciiData)):
+                return data
+
+        specials = special_characters_re.findall(data)
+        if not specials:
+            return data
+
+        numCR = specials.count(u"\r")
+        if numCR != len(specials):
+            self.reportCharacterErrors(data, specials)
+            # Replace invalid characters
+            data = self.replaceCharactersRegexp.sub(u"\ufffd", data)
+
+        if numCR:
+            data = data.replace(u"\r\n", u"\n")
+            if u"\r" in data:
+                data = data.replace(u"\r", u"\n")
+
+        return data
+
+    def characterErrorsUCS4(self, data, specials):
+        for char in specials:
+            if char != u"\r" and (char <= u"\uFFFF" or
+                                  ord(char) in non_bmp_invalid_codepoints):
+                self.errors.append("invalid-codepoint")
+
+    def ignoreCharacterErrors(self, data, specials):
+        """Stands in for reportCharacterErrors when errors aren't reported"""
+        pass
+
+    def characterErrorsUCS2(self, data, specials):
         #Someone picked the wrong compile option
         #You lose
         skip = False
@@ -424,6 +961,18 @@ class HTMLInputStream:
                 regex = u"^%s" % regex
             chars = charsUntilRegEx[(characters, opposite)] = re.compile(u"[%s]+" % regex)
 
+        # Most runs end inside the current chunk
+        chunkOffset = self.chunkOffset
+        m = chars.match(self.chunk, chunkOffset)
+        if m is None:
+            if chunkOffset != self.chunkSize:
+                return u""
+        else:
+            end = m.end()
+            if end != self.chunkSize:
+                self.chunkOffset = end
+                return self.chunk[chunkOffset:end]
+
         rv = []
 
         while True:
@@ -445,6 +994,7 @@ class HTMLInputStream:
             # If the whole remainder of the chunk matched,
             # use it all and read the next chunk
             rv.append(self.chunk[self.chunkOffset:])
+            self.chunkOffset = self.chunkSize
             if not self.readChunk():
                 # Reached EOF
                 break
@@ -452,6 +1002,55 @@ class HTMLInputStream:
         r = u"".join(rv)
         return r
 
+    def charsUntilEndTag(self, characters, endTag, lessThanSign):
+        """ Returns a string of characters from the stream up to but not
+        including any character in 'characters', a "<" that starts the end
+        tag named endTag, or EOF. Used for the content of script, RAWTEXT and
+        RCDATA elements, it looks for each "<" with find rather than stopping
+        at every one of them.
+
+        endTag is the lowercase tag name, or None if no end tag closes the
+        content. lessThanSign is a regexp matched against the text after
+        every other "<": if it matches, the string ends before that "<" too.
+        It must match wherever the end of the chunk leaves this undecided.
+        """
+        if endTag is not None:
+            endTag = u"/" + endTag
+            nameLength = len(endTag)
+        rv = []
+        while True:
+            chunk = self.chunk
+            chunkOffset = self.chunkOffset
+            chunkSize = self.chunkSize
+            end = chunkSize
+            for character in characters:
+                index = chunk.find(character, chunkOffset, end)
+                if index != -1:
+                    end = index
+
+            index = chunk.find(u"<", chunkOffset, end)
+            while index != -1:
+                start = index + 1
+                # Stream errors are reported when the tokenizer state returns,
+                # at the position reached, so while there are some stop at
+                # the next "<" as charsUntil would have
+                if (self.errors or lessThanSign.match(chunk, start) or
+                    (endTag is not None and
+                     chunk[start:start + nameLength].translate(
+                         asciiUpper2Lower) == endTag and
+                     chunk[start + nameLength:start + nameLength + 1] in
+                     endTagNameEnd)):
+                    end = index
+                    break
+                index = chunk.find(u"<", start, end)
+
+            rv.append(chunk[chunkOffset:end])
+            self.chunkOffset = end
+            if end != chunkSize or not self.readChunk():
+                break
+
+        return u"".join(rv)
+
     def unget(self, char):
         # Only one character is allowed to be ungotten at once - it must
         # be consumed again before any further call to unget
@@ -462,115 +1061,27 @@ class HTMLInputStream:
                 # called char and charsUntil.
                 # So, just prepend the ungotten character onto the current
                 # chunk:
+                self.resolveMarks()
                 self.chunk = char + self.chunk
                 self.chunkSize += 1
+                self.prevNumChars -= 1
+                self._lineOffsets = None
             else:
                 self.chunkOffset -= 1
                 assert self.chunk[self.chunkOffset] == char
 
-class EncodingBytes(str):
-    """String-like object with an associated position and various extra methods
-    If the position is ever greater than the string length then an exception is
-    raised"""
-    def __new__(self, value):
-        return str.__new__(self, value.lower())
-
-    def __init__(self, value):
-        self._position=-1
-    
-    def __iter__(self):
-        return self
-    
-    def next(self):
-        p = self._position = self._position + 1
-        if p >= len(self):
-            raise StopIteration
-        elif p < 0:
-            raise TypeError
-        return self[p]
-
-    def previous(self):
-        p = self._position
-        if p >= len(self):
-            raise StopIteration
-        elif p < 0:
-            raise TypeError
-        self._position = p = p - 1
-        return self[p]
-    
-    def setPosition(self, position):
-        if self._position >= len(self):
-            raise StopIteration
-        self._position = position
-    
-    def getPosition(self):
-        if self._position >= len(self):
-            raise StopIteration
-        if self._position >= 0:
-            return self._position
-        else:
-            return None
-    
-    position = property(getPosition, setPosition)
-
-    def getCurrentByte(self):
-        return self[self.position]
-    
-    currentByte = property(getCurrentByte)
-
-    def skip(self, chars=spaceCharactersBytes):
-        """Skip past a list of characters"""
-        p = self.position               # use property for the error-checking
-        while p < len(self):
-            c = self[p]
-            if c not in chars:
-                self._position = p
-                return c
-            p += 1
-        self._position = p
-        return None
-
-    def skipUntil(self, chars):
-        p = self.position
-        while p < len(self):
-            c = self[p]
-            if c in chars:
-                self._position = p
-                return c
-            p += 1
-        self._position = p
-        return None
-
-    def matchBytes(self, bytes):
-        """Look for a sequence of bytes at the start of a string. If the bytes 
-        are found return True and advance the position to the byte after the 
-        match. Otherwise return False and leave the position alone"""
-        p = self.position
-        data = self[p:p+len(bytes)]
-        rv = data.startswith(bytes)
-        if rv:
-            self.position += len(bytes)
-        return rv
-    
-    def jumpTo(self, bytes):
-        """Look for the next sequence of bytes matching a given sequence. If
-        a match is found advance the position to the last byte of the match"""
-        newPosition = self[self.position:].find(bytes)
-        if newPosition > -1:
-            # XXX: This is ugly, but I can't see a nicer way to fix this.
-            if self._position == -1:
-                self._position = 0
-            self._position += (newPosition + len(bytes)-1)
-            return True
-        else:
-            raise StopIteration
-
 class EncodingParser(object):
-    """Mini parser for detecting character encoding from meta elements"""
+    """Mini parser for detecting character encoding from meta elements
+
+    The data is searched with str.find and regular expressions so that
+    only tags and attributes are looked at in Python, not every byte. Each
+    handle* method takes the position just after the bytes that led to it
+    and returns the position to continue searching from, or None once the
+    prescan is over."""
 
     def __init__(self, data):
         """string - the data to work on for encoding detection"""
-        self.data = EncodingBytes(data)
+        self.data = data.lower()
         self.encoding = None
 
     def getEncoding(self):
@@ -581,195 +1092,175 @@ class EncodingParser(object):
             ("<!",self.handleOther),
             ("<?",self.handleOther),
             ("<",self.handlePossibleStartTag))
-        for byte in self.data:
-            keepParsing = True
+        data = self.data
+        position = data.find("<")
+        while position != -1:
             for key, method in methodDispatch:
-                if self.data.matchBytes(key):
-                    try:
-                        keepParsing = method()    
-                        break
-                    except StopIteration:
-                        keepParsing=False
-                        break
-            if not keepParsing:
+                if data.startswith(key, position):
+                    position = method(position + len(key))
+                    break
+            if position is None:
                 break
-        
+            position = data.find("<", position)
+
         return self.encoding
 
-    def handleComment(self):
+    def handleComment(self, position):
         """Skip over comments"""
-        return self.data.jumpTo("-->")
+        end = self.data.find("-->", position)
+        if end == -1:
+            return None
+        return end + 3
 
-    def handleMeta(self):
-        if self.data.currentByte not in spaceCharactersBytes:
+    def handleMeta(self, position):
+        data = self.data
+        if position >= len(data):
+            return None
+        if data[position] not in spaceCharactersBytes:
             #if we have <meta not followed by a space so just keep going
-            return True
+            return position + 1
         #We have a valid meta element we want to search for attributes
         while True:
             #Try to find the next attribute after the current position
-            attr = self.getAttribute()
+            attr = self.getAttribute(position)
             if attr is None:
-                return True
-            else:
-                if attr[0] == "charset":
-                    tentativeEncoding = attr[1]
-                    codec = codecName(tentativeEncoding)
-                    if codec is not None:
-                        self.encoding = codec
-                        return False
-                elif attr[0] == "content":
-                    contentParser = ContentAttrParser(EncodingBytes(attr[1]))
-                    tentativeEncoding = contentParser.parse()
-                    codec = codecName(tentativeEncoding)
-                    if codec is not None:
-                        self.encoding = codec
-                        return False
-
-    def handlePossibleStartTag(self):
-        return self.handlePossibleTag(False)
-
-    def handlePossibleEndTag(self):
-        self.data.next()
-        return self.handlePossibleTag(True)
-
-    def handlePossibleTag(self, endTag):
+                return None
+            name, value, position = attr
+            if name is None:
+                return position + 1
+            elif name == "charset":
+                codec = codecName(value)
+                if codec is not None:
+                    self.encoding = codec
+                    return None
+            elif name == "content":
+                codec = codecName(ContentAttrParser(value).parse())
+                if codec is not None:
+                    self.encoding = codec
+                    return None
+
+    def handlePossibleStartTag(self, position):
         data = self.data
-        if data.currentByte not in asciiLettersBytes:
-            #If the next byte is not an ascii letter either ignore this
-            #fragment (possible start tag case) or treat it according to 
-            #handleOther
-            if endTag:
-                data.previous()
-                self.handleOther()
-            return True
-        
-        c = data.skipUntil(spacesAngleBrackets)
-        if c == "<":
+        if position >= len(data):
+            return None
+        if data[position] not in asciiLettersBytes:
+            #Not a tag; ignore this fragment
+            return position + 1
+        return self.handlePossibleTag(position)
+
+    def handlePossibleEndTag(self, position):
+        data = self.data
+        if position + 1 >= len(data):
+            return None
+        if data[position + 1] not in asciiLettersBytes:
+            return self.handleOther(position)
+        return self.handlePossibleTag(position + 1)
+
+    def handlePossibleTag(self, position):
+        data = self.data
+        position = tagNameRe.match(data, position).end()
+        if position == len(data):
+            return None
+        if data[position] == "<":
             #return to the first step in the overall "two step" algorithm
             #reprocessing the < byte
-            data.previous()
-        else:
-            #Read all attributes
-            attr = self.getAttribute()
-            while attr is not None:
-                attr = self.getAttribute()
-        return True
+            return position
+        #Read all attributes
+        while True:
+            attr = self.getAttribute(position)
+            if attr is None:
+                return None
+            name, value, position = attr
+            if name is None:
+                return position + 1
 
-    def handleOther(self):
-        return self.data.jumpTo(">")
+    def handleOther(self, position):
+        end = self.data.find(">", position)
+        if end == -1:
+            return None
+        return end + 1
 
-    def getAttribute(self):
-        """Return a name,value pair for the next attribute in the stream, 
-        if one is found, or None"""
+    def getAttribute(self, position):
+        """Return a (name, value, position) triple for the next attribute
+        starting at position, with name None if the tag ended at position
+        first, or None if the data ran out"""
         data = self.data
+        length = len(data)
         # Step 1 (skip chars)
-        c = data.skip(spaceCharactersBytes | frozenset("/"))
+        position = attributeGapRe.match(data, position).end()
         # Step 2
-        if c in (">", None):
+        if position == length:
             return None
-        # Step 3
-        attrName = []
-        attrValue = []
-        #Step 4 attribute name
-        while True:
-            if c == "=" and attrName:   
-                break
-            elif c in spaceCharactersBytes:
-                #Step 6!
-                c = data.skip()
-                c = data.next()
-                break
-            elif c in ("/", ">"):
-                return "".join(attrName), ""
-            elif c in asciiUppercaseBytes:
-                attrName.append(c.lower())
-            elif c == None:
+        elif data[position] == ">":
+            return None, None, position
+        # Steps 3-5 attribute name; its first byte may be "="
+        end = attributeNameRe.match(data, position + 1).end()
+        if end == length:
+            return None
+        name = data[position:end]
+        c = data[end]
+        if c in ("/", ">"):
+            return name, "", end
+        elif c != "=":
+            # Step 6: skip spaces; the byte after them is examined next
+            position = spaceBytesRe.match(data, end).end()
+            if position + 1 >= length:
                 return None
-            else:
-                attrName.append(c)
-            #Step 5
-            c = data.next()
-        #Step 7
-        if c != "=":
-            data.previous()
-            return "".join(attrName), ""
-        #Step 8
-        data.next()
-        #Step 9
-        c = data.skip()
-        #Step 10
+            # Step 7
+            if data[position + 1] != "=":
+                return name, "", position
+            end = position + 1
+        # Steps 8 and 9
+        if end + 1 >= length:
+            return None
+        position = spaceBytesRe.match(data, end + 1).end()
+        if position == length:
+            return None
+        # Step 10
+        c = data[position]
         if c in ("'", '"'):
-            #10.1
-            quoteChar = c
-            while True:
-                #10.2
-                c = data.next()
-                #10.3
-                if c == quoteChar:
-                    data.next()
-                    return "".join(attrName), "".join(attrValue)
-                #10.4
-                elif c in asciiUppercaseBytes:
-                    attrValue.append(c.lower())
-                #10.5
-                else:
-                    attrValue.append(c)
+            end = data.find(c, position + 1)
+            if end == -1 or end + 1 >= length:
+                return None
+            return name, data[position + 1:end], end + 1
         elif c == ">":
-            return "".join(attrName), ""
-        elif c in asciiUppercaseBytes:
-            attrValue.append(c.lower())
-        elif c is None:
-            return None
-        else:
-            attrValue.append(c)
+            return name, "", position
         # Step 11
-        while True:
-            c = data.next()
-            if c in spacesAngleBrackets:
-                return "".join(attrName), "".join(attrValue)
-            elif c in asciiUppercaseBytes:
-                attrValue.append(c.lower())
-            elif c is None:
-                return None
-            else:
-                attrValue.append(c)
+        match = attributeValueEndRe.search(data, position + 1)
+        if match is None:
+            return None
+        return name, data[position:match.start()], match.start()
 
 
 class ContentAttrParser(object):
     def __init__(self, data):
-        self.data = data
+        self.data = data.lower()
+
     def parse(self):
-        try:
-            #Check if the attr name is charset 
-            #otherwise return
-            self.data.jumpTo("charset")
-            self.data.position += 1
-            self.data.skip()
-            if not self.data.currentByte == "=":
-                #If there is no = sign keep looking for attrs
-                return None
-            self.data.position += 1
-            self.data.skip()
-            #Look for an encoding between matching quote marks
-            if self.data.currentByte in ('"', "'"):
-                quoteMark = self.data.currentByte
-                self.data.position += 1
-                oldPosition = self.data.position
-                if self.data.jumpTo(quoteMark):
-                    return self.data[oldPosition:self.data.position]
-                else:
-                    return None
-            else:
-                #Unquoted value
-                oldPosition = self.data.position
-                try:
-                    self.data.skipUntil(spaceCharactersBytes)
-                    return self.data[oldPosition:self.data.position]
-                except StopIteration:
-                    #Return the whole remaining value
-                    return self.data[oldPosition:]
-        except StopIteration:
+        data = self.data
+        #Check if the attr name is charset
+        #otherwise return
+        position = data.find("charset")
+        if position == -1:
+            return None
+        position = spaceBytesRe.match(data, position + 7).end()
+        if position >= len(data) or data[position] != "=":
+            #If there is no = sign keep looking for attrs
             return None
+        position = spaceBytesRe.match(data, position + 1).end()
+        if position >= len(data):
+            return None
+        #Look for an encoding between matching quote marks
+        quoteMark = data[position]
+        if quoteMark in ('"', "'"):
+            end = data.find(quoteMark, position + 1)
+            if end == -1:
+                return None
+            return data[position + 1:end]
+        else:
+            #Unquoted value
+            end = nonSpaceBytesRe.match(data, position).end()
+            return data[position:end]
 
 
 def codecName(encoding):
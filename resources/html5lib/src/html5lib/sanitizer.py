@@ -245,11 +245,14 @@ class HTMLSanitizerMixin(object):
 
 class HTMLSanitizer(HTMLTokenizer, HTMLSanitizerMixin):
     def __init__(self, stream, encoding=None, parseMeta=True, useChardet=True,
-                 lowercaseElementName=False, lowercaseAttrName=False, parser=None):
+                 lowercaseElementName=False, lowercaseAttrName=False, parser=None,
+                 trackPositions=True, reportErrors=True):
         #Change case matching defaults as we only output lowercase html anyway
         #This solution doesn't seem ideal...
         HTMLTokenizer.__init__(self, stream, encoding, parseMeta, useChardet,
-                               lowercaseElementName, lowercaseAttrName, parser=parser)
+                               lowercaseElementName, lowercaseAttrName, parser=parser,
+                               trackPositions=trackPositions,
+                               reportErrors=reportErrors)
 
     def __iter__(self):
         for token in HTMLTokenizer.__iter__(self):
@@ -0,0 +1,41 @@
+"""Tokenizer throughput with fixed size chunks against adaptive chunking
+
+Documents are taken from the WebGL conformance suites (or from the
+directory given on the command line) and grouped by size. "fixed" caps
+HTMLInputStream.maxChunkSize at _defaultChunkSize, which reads every
+document in 10240 character chunks as before; "adaptive" uses the default
+cap, so in-memory documents are decoded as one chunk.
+"""
+import sys
+import timeit
+
+from html5lib import inputstream, tokenizer
+
+from corpus import loadDocuments
+
+documents = loadDocuments()
+
+bands = [(0, 2048), (2048, 8192), (8192, 32768), (32768, 131072),
+         (131072, sys.maxint)]
+
+def tokenize(docs):
+    for doc in docs:
+        for token in tokenizer.HTMLTokenizer(doc):
+            pass
+
+adaptiveCap = inputstream.HTMLInputStream.maxChunkSize
+fixedCap = inputstream.HTMLInputStream._defaultChunkSize
+
+for low, high in bands:
+    docs = [doc for doc in documents if low <= len(doc) < high]
+    if not docs:
+        continue
+    megabytes = sum(map(len, docs)) / float(2 ** 20)
+    results = []
+    for cap in (fixedCap, adaptiveCap):
+        inputstream.HTMLInputStream.maxChunkSize = cap
+        t = timeit.Timer(lambda: tokenize(docs))
+        results.append(min(t.repeat(3, 1)) * 1000 / megabytes)
+    print "%7d-%-10s %5d docs  fixed %7.1f ms/MB  adaptive %7.1f ms/MB" % (
+        (low, high == sys.maxint and "" or high, len(docs)) + tuple(results))
+inputstream.HTMLInputStream.maxChunkSize = adaptiveCap
@@ -0,0 +1,25 @@
+"""The documents the performance scripts are run on
+
+By default these are the documents of the WebGL conformance suites; a
+different directory can be given as the first command line argument.
+"""
+import os
+import sys
+
+def loadDocuments(root=None):
+    """Return the contents of the .html and .htm files under root, which
+    defaults to the directory given on the command line or else the
+    conformance suites"""
+    if root is None:
+        if len(sys.argv) > 1:
+            root = sys.argv[1]
+        else:
+            root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                *([os.pardir] * 6 + ["conformance-suites"]))
+    documents = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith((".html", ".htm")):
+                documents.append(
+                    open(os.path.join(dirpath, filename), "rb").read())
+    return documents
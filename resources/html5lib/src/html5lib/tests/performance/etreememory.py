@@ -0,0 +1,60 @@
+"""Objects kept alive while building ElementTree trees
+
+The documents of the WebGL conformance suites (or of the directory given on
+the command line), and a long run of paragraphs with text around inline
+elements, are parsed to ElementTree and cElementTree trees. While each
+document is parsed, the objects the garbage collector tracks and the
+element wrappers the tree builder keeps alive are sampled every 100
+elements, and the peaks are reported (the objects per element of the
+finished tree). The time to parse all documents is reported as well.
+"""
+import gc
+import timeit
+import xml.etree.ElementTree as ElementTree
+import xml.etree.cElementTree as cElementTree
+
+from html5lib import html5parser, treebuilders
+from html5lib.treebuilders import etree
+
+from corpus import loadDocuments
+
+documents = loadDocuments()
+documents.append("<div>" + "<p>x<b>y</b>z</p>" * 20000)
+
+def parseAll(parser):
+    for document in documents:
+        parser.parse(document, encoding="utf-8")
+
+for name, implementation in (("ElementTree", ElementTree),
+                             ("cElementTree", cElementTree)):
+    builder = treebuilders.getTreeBuilder("etree", implementation)
+    wrappers = etree.getETreeModule(implementation).wrappers
+
+    class SamplingBuilder(builder):
+        """Samples the live objects every 100 elements inserted"""
+        def insertElementNormal(self, token):
+            self.created += 1
+            if self.created % 100 == 0:
+                self.peakObjects = max(self.peakObjects,
+                                       len(gc.get_objects()) - self.before)
+                self.peakWrappers = max(self.peakWrappers, len(wrappers))
+            return builder.insertElementNormal(self, token)
+
+    elements = objects = peakWrappers = 0
+    for document in documents:
+        parser = html5parser.HTMLParser(tree=SamplingBuilder)
+        gc.collect()
+        parser.tree.created = parser.tree.peakObjects = 0
+        parser.tree.peakWrappers = 0
+        parser.tree.before = len(gc.get_objects())
+        tree = parser.parse(document, encoding="utf-8")
+        objects += parser.tree.peakObjects
+        peakWrappers = max(peakWrappers, parser.tree.peakWrappers)
+        elements += len(list(tree.getiterator()))
+        del parser, tree
+    parser = html5parser.HTMLParser(tree=builder)
+    t = timeit.Timer(lambda: parseAll(parser))
+    print ("%-12s %7d elements %6.2f peak objects/element "
+           "%6d peak wrappers %8.1f ms" % (
+            name, elements, float(objects) / elements, peakWrappers,
+            min(t.repeat(3, 1)) * 1000))
@@ -0,0 +1,29 @@
+"""Parse time of tables with misnested content
+
+Content that is not allowed directly in a table is foster parented: it is
+inserted into the table's parent right before the table, and text goes onto
+the node before it. In a table with a stray element or text after every row
+that parent's children grow with every row. The documents are parsed to
+simpletree and etree trees.
+"""
+import timeit
+import xml.etree.ElementTree as ElementTree
+
+from html5lib import html5parser, treebuilders
+
+documents = (
+    ("div", lambda n: "<table>" + "<tr><td>x</td></tr><div>y</div>" * n),
+    ("text", lambda n: "<table>" + "<tr><td>x</td></tr>y<br>" * n),
+    ("b", lambda n: "<table>" + "<tr><td>x</td></tr><b>y" * n))
+
+builders = (("simpletree", treebuilders.getTreeBuilder("simpletree")),
+            ("etree", treebuilders.getTreeBuilder("etree", ElementTree)))
+
+for builderName, builder in builders:
+    parser = html5parser.HTMLParser(tree=builder)
+    for name, markup in documents:
+        for count in (2500, 5000, 10000):
+            doc = markup(count)
+            t = timeit.Timer(lambda: parser.parse(doc, encoding="utf-8"))
+            print "%-10s %-4s %6d rows %8.1f ms" % (
+                builderName, name, count, min(t.repeat(3, 1)) * 1000)
@@ -0,0 +1,48 @@
+"""Memory held by parsed simpletree documents
+
+The documents of the WebGL conformance suites (or of the directory given on
+the command line) are parsed to simpletree trees. For each tree the objects
+it keeps alive (nodes, their instance dictionaries, child lists, attribute
+dictionaries and strings) are counted once each, and the total is reported
+per node.
+"""
+import gc
+import sys
+import types
+
+from html5lib import html5parser
+
+from corpus import loadDocuments
+
+# Objects that belong to the program rather than to a tree
+shared = (type, types.ModuleType, types.FunctionType, types.MethodType,
+          types.BuiltinFunctionType)
+
+def treeSize(document):
+    """Return the number of nodes in document and the bytes it keeps alive"""
+    seen = set()
+    stack = [document]
+    nodes = 0
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, shared):
+            continue
+        seen.add(id(obj))
+        if hasattr(obj, "childNodes"):
+            nodes += 1
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return nodes, size
+
+parser = html5parser.HTMLParser()
+documents = nodes = size = 0
+for data in loadDocuments():
+    document = parser.parse(data, encoding="utf-8")
+    documentNodes, documentSize = treeSize(document)
+    documents += 1
+    nodes += documentNodes
+    size += documentSize
+
+print "%d documents %d nodes %.1f MB %.1f bytes/node" % (
+    documents, nodes, size / float(2 ** 20), size / float(nodes))
@@ -0,0 +1,27 @@
+"""Parse time of markup with many unclosed or misnested formatting elements
+
+Pages that open hundreds of <font> and <b> elements without closing them
+keep those elements on the list of active formatting elements and the stack
+of open elements, where every later formatting element, end tag, paragraph
+and table looks them up.
+"""
+import timeit
+
+from html5lib import html5parser
+
+documents = (
+    ("font", lambda n: "".join(["<font color=c%d>x" % i for i in xrange(n)])),
+    ("font/b", lambda n: "".join(["<font size=%d><b>x</font>" % (i % 7)
+                                  for i in xrange(n)])),
+    ("b/div", lambda n: "<b>" * n + "<div>x</b>" * n),
+    ("b/p", lambda n: "<font><b>" * n + "<p>x</p>" * n),
+    ("b/table", lambda n: "<b>" * n + "<table><td>x</td></table>" * n))
+
+parser = html5parser.HTMLParser()
+
+for name, markup in documents:
+    for count in (250, 500, 1000, 2000):
+        doc = markup(count)
+        t = timeit.Timer(lambda: parser.parse(doc, encoding="utf-8"))
+        print "%-8s %5d elements %8.1f ms" % (name, count,
+                                              min(t.repeat(3, 1)) * 1000)
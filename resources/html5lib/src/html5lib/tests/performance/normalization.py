@@ -0,0 +1,40 @@
+"""Per-MB cost of the chunk normalization done by HTMLInputStream.readChunk
+
+Compares the old four pass pipeline (error count, surrogate replacement and
+two newline replacements) against HTMLInputStream.normalizeChunk.
+"""
+import timeit
+
+from html5lib import inputstream
+
+line = u"The quick brown fox <b>jumps</b> over the lazy dog &amp; so on.."
+documents = {
+    "ascii-lf": (line + u"\n") * 16000,
+    "ascii-crlf": (line + u"\r\n") * 16000,
+    "latin1-lf": (line.replace(u"fox", u"f\xf6x") + u"\n") * 16000,
+    "non-bmp-lf": (line + u"\U0001F600\n") * 16000,
+    "invalid": (line + u"\x0c\x01\n") * 16000,
+}
+
+stream = inputstream.HTMLInputStream(u"")
+
+def multiPass(data):
+    stream.errors.extend(["invalid-codepoint"] *
+                         len(inputstream.invalid_unicode_re.findall(data)))
+    data = stream.replaceCharactersRegexp.sub(u"\ufffd", data)
+    data = data.replace(u"\r\n", u"\n")
+    data = data.replace(u"\r", u"\n")
+    return data
+
+def singlePass(data):
+    return stream.normalizeChunk(data)
+
+for name, data in sorted(documents.iteritems()):
+    assert multiPass(data) == singlePass(data)
+    megabytes = len(data.encode("utf-8")) / float(2 ** 20)
+    for function in (multiPass, singlePass):
+        del stream.errors[:]
+        t = timeit.Timer(lambda: function(data))
+        r = min(t.repeat(3, 10)) / 10
+        print "%-12s %-10s %6.2f ms/MB" % (name, function.__name__,
+                                            r * 1000 / megabytes)
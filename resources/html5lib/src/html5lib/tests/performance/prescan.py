@@ -0,0 +1,26 @@
+"""Cost of the meta charset prescan for a range of byte budgets
+
+Uses the start of each document in the WebGL conformance suites (or in the
+directory given on the command line), once as is and once with its meta
+elements renamed so that the whole budget has to be scanned.
+"""
+import timeit
+
+from html5lib import inputstream
+
+from corpus import loadDocuments
+
+documents = loadDocuments()
+
+def prescan(heads):
+    for head in heads:
+        inputstream.EncodingParser(head).getEncoding()
+
+for budget in (512, 4096, 65536):
+    for name, docs in (("as is", documents),
+                       ("no meta", [doc.replace("<meta", "<mota")
+                                    for doc in documents])):
+        heads = [doc[:budget] for doc in docs]
+        t = timeit.Timer(lambda: prescan(heads))
+        r = min(t.repeat(3, 1)) / len(heads)
+        print "%6d bytes %-8s %7.1f us/doc" % (budget, name, r * 1e6)
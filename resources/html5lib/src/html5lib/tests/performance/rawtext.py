@@ -0,0 +1,40 @@
+"""Tokenizer throughput on script, style and title content
+
+The inline scripts, styles and titles of the documents in the WebGL
+conformance suites (or in the directory given on the command line) are
+tokenized on their own in the state their start tag switches the tokenizer
+to, closing end tag included.
+"""
+import re
+import timeit
+
+from html5lib import tokenizer
+from html5lib.constants import tokenTypes
+
+from corpus import loadDocuments
+
+elementRe = re.compile(r"<(script|style|title)\b[^>]*>(.*?</\1\s*>)",
+                       re.I | re.S)
+
+contents = {"script": [], "style": [], "title": []}
+for data in loadDocuments():
+    for name, content in elementRe.findall(data):
+        contents[name.lower()].append(content)
+
+def tokenize(name, state, docs):
+    for doc in docs:
+        t = tokenizer.HTMLTokenizer(doc, encoding="utf-8")
+        t.state = getattr(t, state)
+        t.currentToken = tokenizer.TagToken(tokenTypes["StartTag"], name, [])
+        for token in t:
+            pass
+
+for name, state in (("script", "scriptDataState"), ("style", "rawtextState"),
+                    ("title", "rcdataState")):
+    docs = contents[name]
+    if not docs:
+        continue
+    megabytes = sum(map(len, docs)) / float(2 ** 20)
+    t = timeit.Timer(lambda: tokenize(name, state, docs))
+    print "%-6s %6d elements %8.2f MB %8.1f ms/MB" % (
+        name, len(docs), megabytes, min(t.repeat(3, 1)) * 1000 / megabytes)
@@ -0,0 +1,22 @@
+"""Parse time of deeply nested markup
+
+Each start tag of a div, list item or table cell checks whether a p, li or
+table element is in scope. Nesting the elements depth deep makes each check
+look at the whole stack of open elements unless the stack is indexed.
+"""
+import timeit
+
+from html5lib import html5parser
+
+documents = (("div", "<div>x"),
+             ("ul/li", "<ul><li>x"),
+             ("table/td", "<table><tr><td>x"))
+
+parser = html5parser.HTMLParser()
+
+for name, markup in documents:
+    for depth in (250, 500, 1000, 2000):
+        doc = markup * depth
+        t = timeit.Timer(lambda: parser.parse(doc, encoding="utf-8"))
+        print "%-9s depth %5d %8.1f ms" % (name, depth,
+                                            min(t.repeat(3, 1)) * 1000)
@@ -0,0 +1,28 @@
+"""Parse time of long text that reaches the tree builders in many tokens
+
+Every character reference and every run of text between them is a separate
+character token, so entity-heavy prose and escaped <pre> dumps append to the
+same text many times over. The documents are parsed to simpletree, dom and
+etree trees.
+"""
+import timeit
+import xml.etree.ElementTree as ElementTree
+
+from html5lib import html5parser, treebuilders
+
+documents = (
+    ("prose", lambda n: "<p>" + "caf&eacute; &amp; cr&egrave;me " * n),
+    ("pre", lambda n: "<pre>\n" + "if (a &lt; b &amp;&amp; c &gt; d)\n" * n))
+
+builders = (("simpletree", treebuilders.getTreeBuilder("simpletree")),
+            ("dom", treebuilders.getTreeBuilder("dom")),
+            ("etree", treebuilders.getTreeBuilder("etree", ElementTree)))
+
+for builderName, builder in builders:
+    parser = html5parser.HTMLParser(tree=builder)
+    for name, markup in documents:
+        for count in (2500, 5000, 10000, 20000):
+            doc = markup(count)
+            t = timeit.Timer(lambda: parser.parse(doc, encoding="utf-8"))
+            print "%-10s %-5s %6d repeats %8.1f ms" % (
+                builderName, name, count, min(t.repeat(3, 1)) * 1000)
@@ -0,0 +1,38 @@
+"""Size and throughput of the tokens produced by HTMLTokenizer
+
+Tokenizes the documents in the WebGL conformance suites (or in the
+directory given on the command line) and reports the container size of the
+slotted tokens against the dicts the same tokens used to be, and the
+tokenizer and parser throughput.
+"""
+import sys
+import timeit
+
+from html5lib import html5parser, tokenizer
+
+from corpus import loadDocuments
+
+documents = loadDocuments()
+megabytes = sum(map(len, documents)) / float(2 ** 20)
+
+tokens = []
+for doc in documents:
+    tokens.extend(tokenizer.HTMLTokenizer(doc))
+slotted = sum(map(sys.getsizeof, tokens))
+dicts = sum([sys.getsizeof(dict(token)) for token in tokens])
+print "%d tokens  slots %.1f bytes/token  dicts %.1f bytes/token" % (
+    len(tokens), slotted / float(len(tokens)), dicts / float(len(tokens)))
+del tokens
+
+def tokenize():
+    for doc in documents:
+        for token in tokenizer.HTMLTokenizer(doc):
+            pass
+
+def parse():
+    for doc in documents:
+        html5parser.parse(doc)
+
+for name, function in (("tokenize", tokenize), ("parse", parse)):
+    t = timeit.Timer(function)
+    print "%-8s %7.1f ms/MB" % (name, min(t.repeat(3, 1)) * 1000 / megabytes)
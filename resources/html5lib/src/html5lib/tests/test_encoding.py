@@ -13,6 +13,28 @@ class Html5EncodingTestCase(unittest.TestCase):
         self.assertEquals(inputstream.codecName("  utf8  "), "utf-8")
         self.assertEquals(inputstream.codecName("ISO_8859--1"), "windows-1252")
 
+    def test_meta_prescan(self):
+        for data, encoding in (
+            ('<meta charset="koi8-r">', "koi8-r"),
+            ("<!-- <meta charset=koi8-r> --><META CHARSET='ISO-8859-2'>",
+             "iso8859-2"),
+            ('<meta http-equiv=Content-Type content="text/html; '
+             'charset=koi8-r">', "koi8-r"),
+            ('<p title="<meta charset=koi8-r>"><meta charset=utf-8>x',
+             "utf-8"),
+            ('<meta charset="koi8-r', None),
+            ('<metacharset=koi8-r>', None)):
+            parser = inputstream.EncodingParser(data)
+            self.assertEquals(parser.getEncoding(), encoding, data)
+
+    def test_content_attr(self):
+        for data, encoding in (("text/html; charset=KOI8-R", "koi8-r"),
+                               ("text/html; charset = 'utf-8' ", "utf-8"),
+                               ("text/html; charset", None),
+                               ("text/html", None)):
+            parser = inputstream.ContentAttrParser(data)
+            self.assertEquals(parser.parse(), encoding, data)
+
 def buildTestSuite():
     for filename in html5lib_test_files("encoding"):
         test_name = os.path.basename(filename).replace('.dat',''). \
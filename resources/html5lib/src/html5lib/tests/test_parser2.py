@@ -1,9 +1,88 @@
 import support
 from html5lib import html5parser
 from html5lib.constants import namespaces
-from html5lib.treebuilders import dom
+from html5lib.treebuilders._base import Marker
+from html5lib import treebuilders
+from html5lib.treebuilders import dom, etree, simpletree
 
+import gc
+import sys
+import types
 import unittest
+import xml.etree.ElementTree as ElementTree
+
+class FakeLoop(object):
+  """Runs the callbacks of done futures in turn, as an event loop would"""
+  def __init__(self):
+    self.ready = []
+
+  def run(self):
+    while self.ready:
+      self.ready.pop(0)()
+
+def fakeAsyncio(loop):
+  """A module with the parts of asyncio parseStreamReader uses"""
+  class Future(object):
+    def __init__(self):
+      self.callbacks = []
+      self.finished = False
+      self.value = self.exception = None
+
+    def done(self):
+      return self.finished
+
+    def cancelled(self):
+      return False
+
+    def result(self):
+      if self.exception is not None:
+        raise self.exception
+      return self.value
+
+    def set_result(self, value):
+      self.value = value
+      self.finish()
+
+    def set_exception(self, exception):
+      self.exception = exception
+      self.finish()
+
+    def finish(self):
+      self.finished = True
+      for callback in self.callbacks:
+        self.add_done_callback(callback)
+
+    def add_done_callback(self, callback):
+      if self.finished:
+        loop.ready.append(lambda: callback(self))
+      else:
+        self.callbacks.append(callback)
+
+  module = types.ModuleType("asyncio")
+  module.Future = Future
+  module.ensure_future = lambda future: future
+  return module
+
+class FakeReader(object):
+  """Returns data a block of blockSize bytes at a time, then raises
+  exception if one is given"""
+  def __init__(self, asyncio, data, blockSize, exception=None):
+    self.asyncio = asyncio
+    self.data = data
+    self.blockSize = blockSize
+    self.exception = exception
+    self.reads = 0
+
+  def read(self, size):
+    self.reads += 1
+    future = self.asyncio.Future()
+    data = self.data[:self.blockSize]
+    self.data = self.data[self.blockSize:]
+    if not data and self.exception is not None:
+      future.set_exception(self.exception)
+    else:
+      future.set_result(data)
+    return future
 
 # tests that aren't autogenerated from text files
 class MoreParserTests(unittest.TestCase):
@@ -28,6 +107,391 @@ class MoreParserTests(unittest.TestCase):
     doc = parser.parse("<html></html>")
     self.assert_(doc.childNodes[0].namespace == None)
 
+  def test_untracked_positions(self):
+    parser = html5parser.HTMLParser()
+    parser.parse("<p>\n</b>", trackPositions=False)
+    self.assert_(parser.errors)
+    for position, errorcode, datavars in parser.errors:
+      self.assertEquals(position, None)
+
+  def test_error_positions(self):
+    doc = "<p>\n</b>\r\n" * 20 + "</i>"
+    expected = ([(1, 3)] + [(line, 4) for line in range(2, 42, 2)] +
+                [(41, 4)])
+    for readEachTime in (False, True):
+      parser = html5parser.HTMLParser()
+      parser.feed("", encoding="utf-8")
+      for i in range(0, len(doc), 7):
+        parser.feed(doc[i:i + 7])
+        if readEachTime:
+          for position, errorcode, datavars in parser.errors:
+            self.assertNotEquals(position, None)
+      parser.close()
+      self.assertEquals([position for position, errorcode, datavars
+                         in parser.errors], expected)
+
+  def test_late_meta_without_reparse(self):
+    parser = html5parser.HTMLParser()
+    doc = parser.parse("<!--" + "x" * 1024 + "--><meta charset=utf-8>"
+                       "<p>\xc3\xa9", useChardet=False)
+    self.assertEquals(parser.tokenizer.stream.charEncoding,
+                      ("utf-8", "certain"))
+    self.assertEquals(parser.reparseCount, 0)
+    self.assertEquals(doc.childNodes[-1].childNodes[-1].childNodes[0]
+                      .childNodes[0].value, u"\xe9")
+
+  def test_late_meta_reparse(self):
+    parser = html5parser.HTMLParser()
+    doc = parser.parse("<!--" + "x" * 1024 + "--><p>\xe9<meta charset=koi8-r>"
+                       "\xe9", useChardet=False)
+    self.assertEquals(parser.tokenizer.stream.charEncoding,
+                      ("koi8-r", "certain"))
+    self.assertEquals(parser.reparseCount, 1)
+    self.assertEquals(doc.childNodes[-1].childNodes[-1].childNodes[0]
+                      .childNodes[0].value, u"\u0418")
+
+  def test_error_policy_counts(self):
+    parser = html5parser.HTMLParser(errorPolicy="counts")
+    parser.parse("<p>\x00</b></i>&foo")
+    self.assertEquals(parser.errors, [])
+    self.assertEquals(parser.errorCounts["adoption-agency-1.1"], 2)
+    self.assertEquals(parser.errorCounts["invalid-codepoint"], 1)
+    full = html5parser.HTMLParser()
+    full.parse("<p>\x00</b></i>&foo")
+    self.assertEquals(sum(parser.errorCounts.values()), len(full.errors))
+
+  def test_error_policy_none(self):
+    parser = html5parser.HTMLParser(errorPolicy="none")
+    doc = parser.parse("<p>\x00</b>&foo")
+    self.assertEquals(parser.errors, [])
+    self.assertEquals(parser.errorCounts, {})
+    self.assertEquals(doc.toxml(), html5parser.parse("<p>\x00</b>&foo").toxml())
+    stream = parser.tokenizer.stream
+    self.assertEquals(stream.normalizeChunk(u"a\x01\ud800"), u"a\x01\ufffd")
+    self.assertEquals(stream.errors, [])
+    self.assertRaises(ValueError, html5parser.HTMLParser, strict=True,
+                      errorPolicy="none")
+
+  def test_coalesce_characters(self):
+    for doc in ("<p>a &amp; b&lt;c\x00d",
+                "<pre>&#10;\n\nx &amp; y</pre>",
+                "<table><caption><b>x</b>&amp; y<td> &amp; z",
+                "<table>x &amp; <tr> y&amp;z",
+                "<select><option>a &amp; b</select>",
+                "<svg>a &amp;\x00 b</svg><textarea>\n&lt;</textarea>",
+                "<svg><foreignObject><p><b></p>x<![CDATA[y]]>",
+                "<svg><foreignObject><b><i></b>x<![CDATA[y]]>z",
+                "<svg><foreignObject><p><b></p> <![CDATA[y]]>"):
+      plain = html5parser.HTMLParser()
+      coalesced = html5parser.HTMLParser(coalesceCharacters=True)
+      self.assertEquals(coalesced.parse(doc).toxml(), plain.parse(doc).toxml())
+      self.assertEquals(coalesced.errors, plain.errors)
+    tokens = []
+    parser = html5parser.HTMLParser(coalesceCharacters=True)
+    parser.phases["inBody"].processCharacters = tokens.append
+    parser.parse("<p>a &amp; b &lt; c")
+    self.assertEquals([token.data for token in tokens], [u"a & b < c"])
+
+  def test_feed(self):
+    doc = ("<!DOCTYPE html><title>a &amp; b</title><p class=x>caf\xc3\xa9\r\n"
+           "<script>if (a<b) {}</script><!-- c --><table><tr><td>x</table>")
+    plain = html5parser.HTMLParser()
+    expected = plain.parse(doc).toxml()
+    for size in (1, 2, 7):
+      parser = html5parser.HTMLParser()
+      parser.feed("", encoding="utf-8")
+      for i in range(0, len(doc), size):
+        parser.feed(doc[i:i + size])
+      self.assertEquals(parser.close().toxml(), expected)
+      self.assertEquals(parser.errors, plain.errors)
+
+  def test_feed_incremental(self):
+    parser = html5parser.HTMLParser()
+    parser.feed("<p>a<b", encoding="utf-8")
+    self.assertEquals(parser.tree.openElements[-1].name, "p")
+    parser.feed(">b")
+    self.assertEquals(parser.tree.openElements[-1].name, "b")
+    self.assertEquals(parser.close().toxml(),
+                      html5parser.parse("<p>a<b>b").toxml())
+    # Without an encoding nothing is parsed before encoding detection has
+    # as much data as it looks at
+    parser = html5parser.HTMLParser()
+    parser.feed("<p>a", useChardet=False)
+    self.assertEquals(parser.tree.openElements, [])
+    parser.feed("<meta charset=koi8-r>" + " " * 512)
+    self.assertEquals(parser.tree.openElements[-1].name, "p")
+    self.assertEquals(parser.tokenizer.stream.charEncoding,
+                      ("koi8-r", "certain"))
+    parser.feed("\xe9")
+    doc = parser.close()
+    self.assertEquals(doc.childNodes[-1].childNodes[-1].childNodes[0]
+                      .childNodes[-1].value, u" " * 512 + u"\u0418")
+
+  def test_feed_declared_encoding(self):
+    # With chardet, parsing starts as soon as a BOM or a meta element
+    # settles the encoding rather than after a chardet-sized block
+    doc = '<meta charset="koi8-r"><title>\xe9</title><p>a<b>b'
+    parser = html5parser.HTMLParser()
+    parser.feed(doc[:20])
+    self.assertEquals(parser.tree.openElements, [])
+    parser.feed(doc[20:])
+    self.assertEquals(parser.tree.openElements[-1].name, "b")
+    self.assertEquals(parser.tokenizer.stream.charEncoding,
+                      ("koi8-r", "certain"))
+    self.assertEquals(parser.close().toxml(), html5parser.parse(doc).toxml())
+    parser = html5parser.HTMLParser()
+    parser.feed("\xef\xbb\xbf<p>\xc3\xa9")
+    self.assertEquals(parser.tree.openElements[-1].name, "p")
+    self.assertEquals(parser.close().toxml(),
+                      html5parser.parse(u"<p>\xe9").toxml())
+    # Without either the whole detection block is waited for
+    parser = html5parser.HTMLParser()
+    parser.feed("<p>a" * 1000)
+    self.assertEquals(parser.tree.openElements, [])
+
+  def test_parse_stream_reader(self):
+    doc = "<!DOCTYPE html><title>a</title><p>caf\xc3\xa9<b>b"
+    expected = html5parser.parse(doc, encoding="utf-8").toxml()
+    saved = [(name, sys.modules[name]) for name in ("asyncio", "trollius")
+             if name in sys.modules]
+    try:
+      # asyncio, then trollius where asyncio can't be imported
+      for name in ("asyncio", "trollius"):
+        loop = FakeLoop()
+        sys.modules["asyncio"] = None
+        sys.modules[name] = asyncio = fakeAsyncio(loop)
+        reader = FakeReader(asyncio, doc, 5)
+        result = html5parser.parseStreamReader(reader, readSize=5,
+                                               encoding="utf-8")
+        self.failIf(result.done())
+        loop.run()
+        self.assertEquals(reader.reads, len(doc) // 5 + 2)
+        self.assertEquals(result.result().toxml(), expected)
+      # An error reading is passed on through the future
+      reader = FakeReader(asyncio, doc, 5, IOError("reset"))
+      result = html5parser.parseStreamReader(reader, encoding="utf-8")
+      loop.run()
+      self.assertRaises(IOError, result.result)
+    finally:
+      for name in ("asyncio", "trollius"):
+        sys.modules.pop(name, None)
+      sys.modules.update(saved)
+
+  def test_dispatch_counts(self):
+    parser = html5parser.HTMLParser(profile=True)
+    parser.parse("<p>a<b>b</b><svg><g/></svg>")
+    counts = parser.dispatchCounts
+    self.assertEquals(counts[("inBody", "startTagFormatting")], 1)
+    self.assertEquals(counts[("inBody", "endTagFormatting")], 1)
+    self.assertEquals(counts[("inBody", "processCharacters")], 2)
+    self.assertEquals(counts[("inForeignContent", "processStartTag")], 1)
+    self.assertEquals(html5parser.HTMLParser().dispatchCounts, {})
+
+  def test_annotation_xml_content(self):
+    doc = html5parser.parse("<math><annotation-xml>x<!--c--><svg></svg>"
+                            "</annotation-xml></math>")
+    annotation = doc.childNodes[-1].childNodes[-1].childNodes[0].childNodes[0]
+    self.assertEquals([node.name for node in annotation.childNodes],
+                      [None, None, "svg"])
+
+  def test_parser_reuse(self):
+    parser = html5parser.HTMLParser()
+    parser.parse("<!--" + "x" * 1024 + "--><p>\xe9<meta charset=koi8-r>\xe9<pre>",
+                 useChardet=False)
+    self.assertEquals(parser.reparseCount, 1)
+    doc = parser.parse("<table>a<p>\nb")
+    self.assertEquals(parser.reparseCount, 0)
+    inBody = parser.phases["inBody"]
+    self.assertEquals(inBody.processSpaceCharacters,
+                      inBody.processSpaceCharactersNonPre)
+    fresh = html5parser.HTMLParser()
+    self.assertEquals(doc.toxml(), fresh.parse("<table>a<p>\nb").toxml())
+    self.assertEquals(parser.errors, fresh.errors)
+
+  def test_parser_pool(self):
+    self.assert_(html5parser.getPhases(False) is html5parser.getPhases(False))
+    first = html5parser.parseFragment("<b>x</b>")
+    second = html5parser.parseFragment("<i>y</i>")
+    self.assertEquals(first.toxml(), "<b>x</b>")
+    self.assertEquals(second.toxml(), "<i>y</i>")
+
+  def test_element_in_scope(self):
+    tree = simpletree.TreeBuilder(True)
+    for name in ("html", "body", "ul", "li", "button", "select", "option",
+                 "table", "tr", "td", "p"):
+      tree.openElements.append(tree.elementClass(name, namespaces["html"]))
+    self.assert_(tree.elementInScope("p"))
+    self.assert_(tree.elementInScope("td", variant="table"))
+    self.failIf(tree.elementInScope("li"))
+    self.failIf(tree.elementInScope("table"))
+    self.assert_(tree.elementInScope("table", variant="table"))
+    td = tree.openElements[-2]
+    self.assert_(tree.elementInScope(td))
+    tree.openElements.remove(td)
+    self.failIf(tree.elementInScope(td))
+    self.assertEquals(tree.openElements.positions["p"], [9])
+    tree.openElements.insert(-1, td)
+    self.assert_(tree.elementInScope(td))
+    del tree.openElements[-4:]
+    self.assert_(tree.elementInScope("option", variant="select"))
+    self.failIf(tree.elementInScope("button", variant="select"))
+    self.failIf(tree.elementInScope("li", variant="button"))
+    self.assert_(tree.elementInScope("li", variant="list"))
+    self.failIf("td" in tree.openElements.positions)
+
+  def test_active_formatting_elements(self):
+    tree = simpletree.TreeBuilder(True)
+    afe = tree.activeFormattingElements
+    elements = []
+    for i in range(5):
+      element = tree.elementClass("b", namespaces["html"])
+      element.attributes = {"class": "x"}
+      elements.append(element)
+      afe.append(element)
+    # Only the last three equal elements are kept
+    self.assertEquals(list(afe), elements[2:])
+    self.assertEquals(afe.index(elements[4]), 2)
+    self.failIf(elements[0] in afe)
+    afe.append(Marker)
+    self.failIf(tree.elementInActiveFormattingElements("b"))
+    i = tree.elementClass("i", namespaces["html"])
+    afe.append(i)
+    self.assert_(tree.elementInActiveFormattingElements("i") is i)
+    afe.pop()
+    afe.pop()
+    self.assert_(tree.elementInActiveFormattingElements("b") is elements[4])
+    afe[0] = elements[0]
+    self.assertEquals(afe.index(elements[0]), 0)
+    self.failIf(elements[2] in afe)
+    self.assertEquals(list(afe.matching(elements[1])),
+                      [elements[4], elements[3], elements[0]])
+
+  def test_simpletree_sharing(self):
+    doc = html5parser.parse("<p>a<br><!--c--><body id=b>")
+    body = doc.childNodes[0].childNodes[1]
+    p = body.childNodes[0]
+    br = p.childNodes[1]
+    self.assert_(br.childNodes is simpletree.emptyChildNodes)
+    self.assert_(br.attributes is simpletree.emptyAttributes)
+    self.assert_(p.childNodes[0].attributes is simpletree.emptyAttributes)
+    self.failIf(hasattr(p.childNodes[0], "__dict__"))
+    self.assertEquals(body.attributes, {"id": "b"})
+    self.assertRaises(TypeError, br.attributes.__setitem__, "id", "x")
+    self.assertEquals(br.cloneNode().attributes, {})
+    br._flags.append("flag")
+    self.assertEquals(br._flags, ["flag"])
+
+  def test_text_pieces(self):
+    markup = "<p>a&amp;b<i>c</i>d&lt;e<table>f&gt;g<tr></table>h&quot;"
+    text = simpletree.TextNode(u"a")
+    text.appendData(u"&")
+    text.appendData(u"b")
+    self.assertEquals(text.value, u"a&b")
+    self.assertEquals(text.value, u"a&b")
+    parser = html5parser.HTMLParser(tree=dom.TreeBuilder)
+    p = parser.parse(markup).getElementsByTagName("p")[0]
+    self.assertEquals([node.nodeValue for node in p.childNodes[:2]],
+                      [u"a&b", None])
+    parser = html5parser.HTMLParser(
+      tree=treebuilders.getTreeBuilder("etree", ElementTree))
+    p = parser.parse(markup).getiterator("{%s}p" % namespaces["html"])[0]
+    self.assertEquals((p.text, p[0].text, p[0].tail, p[1].tail),
+                      (u"a&b", u"c", u"d<ef>g", u'h"'))
+    parser = html5parser.HTMLParser(tree=dom.TreeBuilder)
+    pre = parser.parse("<pre>&#10;&#10;x").getElementsByTagName("pre")[0]
+    self.assertEquals(pre.firstChild.nodeValue, u"\nx")
+
+  def test_pending_text(self):
+    # Only the node given text last holds text that isn't joined yet, so
+    # the nodes given text earlier aren't kept alive while parsing
+    parser = html5parser.HTMLParser(tree=dom.TreeBuilder)
+    parser.feed("<div>" + "<p>x<b>y</b>z</p>" * 100, encoding="utf-8")
+    nodes = [node for node in gc.get_objects()
+             if isinstance(node, dom.NodeBuilder)]
+    self.assert_(len(nodes) < 20)
+    self.assertEquals(len([node for node in nodes
+                           if node._textPieces is not None]), 1)
+    p = parser.close().getElementsByTagName("p")[-1]
+    self.assertEquals(p.toxml(), "<p>x<b>y</b>z</p>")
+
+  def test_child_index(self):
+    parent = simpletree.Element("div")
+    children = [simpletree.Element(name) for name in "abcde"]
+    for child in children:
+      parent.appendChild(child)
+    parent.removeChild(children[1])
+    parent.insertBefore(children[1], children[4])
+    parent.insertBefore(simpletree.Element("f"), children[0])
+    parent.removeChild(children[4])
+    self.assertEquals([child.name for child in parent.childNodes],
+                      ["f", "a", "c", "d", "b"])
+    self.assertEquals(parent._childIndex.index(parent.childNodes,
+                                               children[3]), 3)
+    self.assertRaises(ValueError, parent.removeChild, children[4])
+    self.assertRaises(ValueError, parent.insertBefore,
+                      simpletree.Element("g"), simpletree.Element("h"))
+    for child in list(parent.childNodes):
+      parent.removeChild(child)
+    self.assert_(parent.childNodes is simpletree.emptyChildNodes)
+
+  def test_etree_wrappers(self):
+    parser = html5parser.HTMLParser(
+      tree=treebuilders.getTreeBuilder("etree", ElementTree))
+    wrappers = etree.getETreeModule(ElementTree).wrappers
+    parser.parse("<p>x</p>" * 100 + "<b><div><i>y</b>z")
+    # Only the elements the parser still refers to have wrappers
+    self.assert_(len(wrappers) < 20)
+    for node in parser.tree.openElements[1:]:
+      self.assert_(node._element in list(node.parent._element))
+    # Nor are wrappers kept for the text they were given while parsing
+    parser.feed("<div>" + "<p>x<b>y</b>z</p>" * 100, encoding="utf-8")
+    self.assert_(len(wrappers) < 20)
+    tree = parser.close()
+    self.assertEquals(len(tree.findall(".//{%s}p" % namespaces["html"])), 100)
+    Element = etree.getETreeModule(ElementTree).Element
+    div, p, b = Element("div"), Element("p"), Element("b")
+    div.insertText(u"x")
+    div.appendChild(p)
+    div.insertText(u"y")
+    div.reparentChildren(b)
+    self.assert_(p.parent is b)
+    self.assertEquals(list(b._element), [p._element])
+    self.assertEquals((b._element.text, p._element.tail), (u"x", u"y"))
+    self.failIf(div.hasContent())
+
+  def test_element_index(self):
+    # The pre elements are moved by foster parenting and by the adoption
+    # agency algorithm; the body and its div are removed for the frameset
+    markup = ('<table><pre class="idl x">1</pre><tr><td>x</td></tr></table>'
+              '<p id=a><b><pre class="x\tidl" id=a>2</b>3</pre>')
+    for treebuilder in ("simpletree", "dom"):
+      doc = html5parser.parse(markup, treebuilder, indexElements=True)
+      pres = doc.index.by_tag("pre")
+      self.assertEquals(len(pres), 2)
+      self.assertEquals(doc.index.by_class("idl"), pres)
+      self.assertEquals(doc.index.by_class("x"), pres)
+      self.assertEquals(doc.index.by_id("a"), doc.index.by_tag("p")[0])
+      self.assertEquals(doc.index.by_class("y"), [])
+      if treebuilder == "dom":
+        self.assertEquals(pres, doc.getElementsByTagName("pre"))
+    doc = html5parser.parse("<div id=a></div><frameset></frameset>",
+                            indexElements=True)
+    self.assertEquals(doc.index.by_id("a"), None)
+    self.assertEquals(doc.index.by_tag("frameset")[0].name, "frameset")
+    parser = html5parser.HTMLParser(
+      tree=treebuilders.getTreeBuilder("etree", ElementTree),
+      indexElements=True)
+    tree = parser.parse(markup)
+    self.assertEquals(parser.index.by_tag("pre"),
+                      list(tree.getiterator("{%s}pre" % namespaces["html"])))
+    self.failIf(hasattr(html5parser.parse(markup), "index"))
+    # cElementTree elements can't hold the index parse would return
+    self.assertRaises(ValueError, html5parser.parse, markup, "etree",
+                      indexElements=True)
+    self.assertRaises(ValueError, html5parser.parseFragment, markup,
+                      treebuilder="etree", indexElements=True)
+    self.failIf(hasattr(html5parser.parse(markup, "etree"), "index"))
+
 def buildTestSuite():
   return unittest.defaultTestLoader.loadTestsFromName(__name__)
 
@@ -1,10 +1,21 @@
 import support
-import unittest, codecs
+import unittest, codecs, tempfile, mmap, StringIO
 
-from html5lib.inputstream import HTMLInputStream
+from html5lib.inputstream import HTMLInputStream, MappedStreamReader
+from html5lib.inputstream import BufferedStream, FeedQueue
+from html5lib.constants import NeedMoreInput
+from html5lib.tokenizer import scriptDataLessThanSign
 
 class HTMLInputStreamShortChunk(HTMLInputStream):
     _defaultChunkSize = 2
+    maxChunkSize = 2
+
+class UnseekableStream(object):
+    def __init__(self, data):
+        self.stream = StringIO.StringIO(data)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
 
 class HTMLInputStreamTest(unittest.TestCase):
 
@@ -39,6 +50,43 @@ class HTMLInputStreamTest(unittest.TestCase):
         self.assert_(stream.charEncoding[0] in ['utf-16-le', 'utf-16-be'], stream.charEncoding)
         self.assertEquals(len(stream.charsUntil(' ', True)), 1025)
 
+    def test_unicode(self):
+        stream = HTMLInputStream(u"\u2018a\r\nb\r")
+        self.assert_(isinstance(stream.rawStream, unicode))
+        self.assertEquals(stream.charEncoding, ("utf-8", "certain"))
+        self.assertEquals(stream.charsUntil('x'), u"\u2018a\nb\n")
+
+    def test_unicode_surrogate_pair(self):
+        stream = HTMLInputStream(u"a\ud83d\ude00")
+        self.assertEquals(stream.charsUntil('x'), u"a\U0001f600")
+
+    def assertNormalized(self, data, expected, numErrors):
+        stream = HTMLInputStream(u"")
+        self.assertEquals(stream.normalizeChunk(data), expected)
+        self.assertEquals(stream.errors, ["invalid-codepoint"] * numErrors)
+
+    def test_normalize_cr_split(self):
+        stream = HTMLInputStreamShortChunk(StringIO.StringIO("a\r\nb\r\rc\r"),
+                                           encoding="utf-8")
+        self.assertEquals(stream.readChunk(), True)
+        # The CR ending the chunk waits for the LF starting the next one
+        self.assertEquals(stream.chunk, u"a")
+        self.assertEquals(stream.charsUntil('x'), u"a\nb\n\nc\n")
+        self.assertEquals(stream.errors, [])
+
+    def test_normalize_non_bmp_noncharacters(self):
+        self.assertNormalized(u"a\U0001FFFE\U0010FFFFb\U0001FFFD",
+                              u"a\U0001FFFE\U0010FFFFb\U0001FFFD", 2)
+
+    def test_normalize_control_characters(self):
+        self.assertNormalized(u"\x01\x08\x0b\x0e\x1f\x7f\x80\x9f",
+                              u"\x01\x08\x0b\x0e\x1f\x7f\x80\x9f", 8)
+        self.assertNormalized(u"\t\n\x0c \xa0", u"\t\n\x0c \xa0", 0)
+
+    def test_normalize_lone_surrogates(self):
+        self.assertNormalized(u"a\ud800b\udfff\ufdd0",
+                              u"a\ufffdb\ufffd\ufdd0", 3)
+
     def test_newlines(self):
         stream = HTMLInputStreamShortChunk(codecs.BOM_UTF8 + "a\nbb\r\nccc\rddddxe")
         self.assertEquals(stream.position(), (1, 0))
@@ -54,6 +102,28 @@ class HTMLInputStreamTest(unittest.TestCase):
         stream = HTMLInputStream("\r" * size + "\n")
         self.assertEquals(stream.charsUntil('x'), "\n" * size)
 
+    def test_newlines_streamed(self):
+        size = HTMLInputStream._defaultChunkSize
+        stream = HTMLInputStream(StringIO.StringIO("\r" * size + "\n"))
+        self.assertEquals(stream.charsUntil('x'), "\n" * size)
+
+    def test_whole_buffer(self):
+        stream = HTMLInputStream("a\r\n" * 10000)
+        self.assertEquals(stream.nextChunkSize, -1)
+        self.assert_(stream.readChunk())
+        self.assertEquals(stream.chunkSize, 20000)
+        self.failIf(stream.readChunk())
+
+    def test_chunk_growth(self):
+        class GrowingStream(HTMLInputStream):
+            _defaultChunkSize = 4
+            maxChunkSize = 32
+        stream = GrowingStream(StringIO.StringIO("a" * 100), encoding="ascii")
+        sizes = []
+        while stream.readChunk():
+            sizes.append(stream.chunkSize)
+        self.assertEquals(sizes, [4, 8, 16, 32, 32, 8])
+
     def test_position(self):
         stream = HTMLInputStreamShortChunk(codecs.BOM_UTF8 + "a\nbb\nccc\nddde\nf\ngh")
         self.assertEquals(stream.position(), (1, 0))
@@ -86,6 +156,140 @@ class HTMLInputStreamTest(unittest.TestCase):
         self.assertEquals(stream.char(), u"d")
         self.assertEquals(stream.position(), (2, 1))
 
+    def test_position_untracked(self):
+        stream = HTMLInputStreamShortChunk("a\nbc", trackPositions=False)
+        self.assertEquals(stream.charsUntil('c'), u"a\nb")
+        self.assertEquals(stream.position(), None)
+        self.assertEquals(stream.prevNumLines, 0)
+
+    def test_mmap_file(self):
+        f = tempfile.TemporaryFile()
+        f.write(codecs.BOM_UTF8 + u"a\r\nb\u2018".encode("utf-8"))
+        f.seek(0)
+        stream = HTMLInputStreamShortChunk(f)
+        self.assert_(isinstance(stream.rawStream, mmap.mmap))
+        self.assertEquals(stream.charEncoding[0], 'utf-8')
+        self.assertEquals(stream.charsUntil('x'), u"a\nb\u2018")
+
+    def test_mmap_close(self):
+        f = tempfile.TemporaryFile()
+        f.write("a\r\nbc")
+        f.seek(0)
+        stream = HTMLInputStreamShortChunk(f, encoding="utf-8")
+        mapping = stream.rawStream
+        self.assertEquals(stream.char(), u"a")
+        # Resetting the stream unmaps the file and maps it again
+        stream.reset()
+        self.assertRaises(ValueError, mapping.read, 1)
+        mapping = stream.rawStream
+        self.assert_(isinstance(mapping, mmap.mmap))
+        self.assertEquals(stream.charsUntil('x'), u"a\nbc")
+        # Reaching EOF unmaps it
+        self.assertRaises(ValueError, mapping.read, 1)
+        self.assertEquals(stream.char(), None)
+
+    def test_chars_until_end_tag(self):
+        lessThanSign = scriptDataLessThanSign
+        stream = HTMLInputStream(u"a<b</scripty></scr><!-</SCRIPT >x")
+        self.assertEquals(stream.charsUntilEndTag(u"\u0000", u"script",
+                                                  lessThanSign),
+                          u"a<b</scripty></scr><!-")
+        self.assertEquals(stream.charsUntil(u">"), u"</SCRIPT ")
+        stream = HTMLInputStream(u"a<b<!--</script>\u0000")
+        self.assertEquals(stream.charsUntilEndTag(u"\u0000", None,
+                                                  lessThanSign), u"a<b")
+        stream.charsUntil(u"\u0000")
+        self.assertEquals(stream.charsUntilEndTag(u"\u0000", None,
+                                                  lessThanSign), u"")
+        # A "<" the chunk ends too soon after is left to the tokenizer
+        stream = HTMLInputStreamShortChunk(u"ab<!--")
+        self.assertEquals(stream.charsUntilEndTag(u"", u"script",
+                                                  lessThanSign), u"ab")
+
+    def test_feed_queue(self):
+        queue = FeedQueue()
+        queue.append("ab\r")
+        stream = HTMLInputStream(queue, encoding="utf-8")
+        # The CR is held back until it is known whether a LF follows
+        self.assertRaises(NeedMoreInput, stream.charsUntil, "x")
+        self.assertEquals(stream.chunk, u"ab")
+        stream.chunkOffset = stream.chunkMark = 1
+        queue.append("\ncd")
+        self.assertEquals(stream.charsUntil("d"), u"b\nc")
+        self.assertEquals(stream.position(), (2, 1))
+        queue.close()
+        self.assertEquals(stream.charsUntil("x"), u"d")
+        self.assertEquals(stream.char(), None)
+
+    def test_mmap_split_character(self):
+        f = tempfile.TemporaryFile()
+        f.write(u"\u2018\u2019".encode("utf-8"))
+        f.seek(0)
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = MappedStreamReader(mapping, "utf-8", sliceSize=1)
+        chars = []
+        data = reader.read(1)
+        while data:
+            chars.append(data)
+            data = reader.read(1)
+        self.assertEquals(chars, [u"\u2018", u"\u2019"])
+
+class BufferedStreamTest(unittest.TestCase):
+
+    def test_seek(self):
+        stream = BufferedStream(UnseekableStream("abcdefghij"))
+        self.assertEquals(stream.read(4), "abcd")
+        self.assertEquals(stream.tell(), 4)
+        stream.seek(1)
+        self.assertEquals(stream.tell(), 1)
+        self.assertEquals(stream.read(2), "bc")
+        self.assertEquals(stream.read(5), "defgh")
+        self.assertEquals(stream.tell(), 8)
+        stream.seek(0)
+        self.assertEquals(stream.read(), "abcdefghij")
+
+    def test_release(self):
+        stream = BufferedStream(UnseekableStream("abcdefghij"))
+        self.assertEquals(stream.read(6), "abcdef")
+        stream.seek(2)
+        stream.release()
+        self.assertRaises(IOError, stream.seek, 0)
+        self.assertEquals(stream.read(2), "cd")
+        self.assertEquals(stream.read(3), "efg")
+        self.assertEquals(stream.buffer, None)
+        self.assertEquals(stream.tell(), 7)
+        self.assertEquals(stream.read(10), "hij")
+
+    def test_max_buffer_size(self):
+        class SmallBufferedStream(BufferedStream):
+            maxBufferSize = 4
+        stream = SmallBufferedStream(UnseekableStream("abcdefghij"))
+        self.assertEquals(stream.read(3), "abc")
+        stream.seek(0)
+        self.assertEquals(stream.read(5), "abcde")
+        self.failIf(stream.rewindable)
+        self.assertRaises(IOError, stream.seek, 0)
+        self.assertEquals(stream.tell(), 5)
+        self.assertEquals(stream.read(), "fghij")
+
+    def test_input_stream(self):
+        stream = HTMLInputStream(UnseekableStream(codecs.BOM_UTF8 + "a\xc3\xa9"))
+        self.assertEquals(stream.charEncoding, ("utf-8", "certain"))
+        self.assertEquals(stream.charsUntil("x"), u"a\xe9")
+        self.assertEquals(stream.rawStream.buffer, None)
+
+    def test_detection_block(self):
+        class ShortReadStream(UnseekableStream):
+            def read(self, size=-1):
+                return self.stream.read(min(size, 3))
+        stream = HTMLInputStream(ShortReadStream('<meta charset="koi8-r">\xe9'),
+                                 chardet=False)
+        self.assertEquals(stream.charEncoding, ("koi8-r", "tentative"))
+        # The decoder starts on the block read for detection, without a seek
+        self.assertEquals(stream.rawStream.tell(), 24)
+        self.assertEquals(stream.charsUntil("x"),
+                          u'<meta charset="koi8-r">\u0418')
+
 def buildTestSuite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
 
@@ -11,8 +11,9 @@ except ImportError:
     import simplejson as json
 
 from support import html5lib_test_files
-from html5lib.tokenizer import HTMLTokenizer
+from html5lib.tokenizer import HTMLTokenizer, TagToken
 from html5lib import constants
+from html5lib.inputstream import HTMLInputStream
 
 class TokenizerTestParser(object):
     def __init__(self, initialState, lastStartTag=None):
@@ -26,8 +27,8 @@ class TokenizerTestParser(object):
 
         tokenizer.state = getattr(tokenizer, self._state)
         if self._lastStartTag is not None:
-            tokenizer.currentToken = {"type": "startTag", 
-                                      "name":self._lastStartTag}
+            tokenizer.currentToken = TagToken(
+                constants.tokenTypes["StartTag"], self._lastStartTag, [])
 
         types = dict((v,k) for k,v in constants.tokenTypes.iteritems())
         for token in tokenizer:
@@ -177,6 +178,142 @@ def capitalize(s):
     return s
 
 
+def test_token_mapping():
+    # Tokens can still be used as the dicts they used to be
+    token = list(HTMLTokenizer("<p class=a>"))[0]
+    assert token["name"] == token.name == u"p"
+    assert token.get("selfClosing") is False
+    assert token.get("namespace", "x") == "x"
+    assert "data" in token and "namespace" not in token
+    assert dict(token) == {"type": constants.tokenTypes["StartTag"],
+                           "name": u"p", "data": [[u"class", u"a"]],
+                           "selfClosing": False,
+                           "selfClosingAcknowledged": False}
+    token["data"] = []
+    del token["selfClosingAcknowledged"]
+    assert token == {"type": constants.tokenTypes["StartTag"], "name": u"p",
+                     "data": [], "selfClosing": False}
+    try:
+        token["foo"] = 1
+    except KeyError:
+        pass
+    else:
+        assert False, "unknown field was set"
+
+def tokenize(data, initialState="dataState"):
+    return concatenateCharacterTokens(
+        TokenizerTestParser(initialState).parse(data))
+
+def runTokenizeTest(data, expected):
+    received = tokenize(data)
+    assert received == expected, "%r: %r != %r" % (data, received, expected)
+
+withoutSemicolon = [u"ParseError", "named-entity-without-semicolon"]
+noEntity = [u"ParseError", "expected-named-entity"]
+
+def test_named_entities():
+    tests = [
+        # The longest entity name that matches is used
+        (u"&notin;", [[u"Character", u"\u2209"]]),
+        (u"&noti;", [withoutSemicolon, [u"Character", u"\xaci;"]]),
+        (u"&notit;", [withoutSemicolon, [u"Character", u"\xacit;"]]),
+        (u"x&notinx", [[u"Character", u"x"], withoutSemicolon,
+                       [u"Character", u"\xacinx"]]),
+        (u"&AMP;", [[u"Character", u"&"]]),
+        (u"&amp;x", [[u"Character", u"&x"]]),
+        (u"&ampx", [withoutSemicolon, [u"Character", u"&x"]]),
+        # Only the start of an entity name
+        (u"&am", [noEntity, [u"Character", u"&am"]]),
+        (u"&n", [noEntity, [u"Character", u"&n"]]),
+        (u"&zzzz;", [noEntity, [u"Character", u"&zzzz;"]]),
+        (u"&\xe9", [noEntity, [u"Character", u"&\xe9"]]),
+        # Not an entity at all
+        (u"& x", [[u"Character", u"& x"]]),
+        (u"&&amp;", [[u"Character", u"&&"]]),
+        # EOF inside the name
+        (u"&not", [withoutSemicolon, [u"Character", u"\xac"]]),
+        (u"&notin", [withoutSemicolon, [u"Character", u"\xacin"]]),
+        (u"&nota", [withoutSemicolon, [u"Character", u"\xaca"]]),
+        (u"&no", [noEntity, [u"Character", u"&no"]]),
+        (u"&amp", [withoutSemicolon, [u"Character", u"&"]]),
+        # In attribute values, an entity without a semicolon is only
+        # replaced if it isn't followed by a letter, digit or "="
+        (u'<a b="&amp;x">', [[u"StartTag", u"a", {u"b": u"&x"}, False]]),
+        (u'<a b="&amp x">', [withoutSemicolon,
+                             [u"StartTag", u"a", {u"b": u"& x"}, False]]),
+        (u'<a b="&not">', [withoutSemicolon,
+                           [u"StartTag", u"a", {u"b": u"\xac"}, False]]),
+        (u'<a b="&ampx">', [withoutSemicolon,
+                            [u"StartTag", u"a", {u"b": u"&ampx"}, False]]),
+        (u"<a b='&lt1'>", [withoutSemicolon,
+                           [u"StartTag", u"a", {u"b": u"&lt1"}, False]]),
+        (u'<a b="&amp=2">', [withoutSemicolon,
+                             [u"StartTag", u"a", {u"b": u"&amp=2"}, False]]),
+        (u'<a b="&notin">', [withoutSemicolon,
+                             [u"StartTag", u"a", {u"b": u"&notin"}, False]]),
+        (u'<a b="&noti;">', [withoutSemicolon,
+                             [u"StartTag", u"a", {u"b": u"&noti;"}, False]]),
+        (u'<a b="&am">', [noEntity,
+                          [u"StartTag", u"a", {u"b": u"&am"}, False]]),
+        (u"<a b=&amp>", [withoutSemicolon,
+                         [u"StartTag", u"a", {u"b": u"&"}, False]]),
+        (u"<a b=&ampx>", [withoutSemicolon,
+                          [u"StartTag", u"a", {u"b": u"&ampx"}, False]]),
+        (u'<a b="&not', [withoutSemicolon,
+                         [u"ParseError",
+                          "eof-in-attribute-value-double-quote"]])]
+    for data, expected in tests:
+        yield runTokenizeTest, data, expected
+
+def tokenizeInChunks(data, chunkSize):
+    """Tokenize data read from a file object chunkSize characters at a
+    time, so that no run of characters the tokenizer scans in one go is
+    longer than that"""
+    stream = cStringIO.StringIO(data.encode("utf-8"))
+    saved = HTMLInputStream._defaultChunkSize, HTMLInputStream.maxChunkSize
+    HTMLInputStream._defaultChunkSize = HTMLInputStream.maxChunkSize = chunkSize
+    try:
+        return concatenateCharacterTokens(
+            TokenizerTestParser("dataState").parse(stream, "utf-8"))
+    finally:
+        HTMLInputStream._defaultChunkSize, HTMLInputStream.maxChunkSize = saved
+
+def runChunkedNameTest(data, chunkSize):
+    expected = tokenize(data)
+    received = tokenizeInChunks(data, chunkSize)
+    assert received == expected, "%r in chunks of %d: %r != %r" % (
+        data, chunkSize, received, expected)
+
+def test_names():
+    # Tag and attribute names are scanned up to the next character that
+    # ends them, or to the end of the chunk
+    tests = [
+        (u"<aB\x00c d>", [[u"ParseError", "invalid-codepoint"],
+                          [u"StartTag", u"ab\ufffdc", {u"d": u""}, False]]),
+        (u"</Ab\x00C>", [[u"ParseError", "invalid-codepoint"],
+                         [u"EndTag", u"ab\ufffdc", False]]),
+        (u"<a/b>", [[u"ParseError",
+                     "unexpected-character-after-soldius-in-tag"],
+                    [u"StartTag", u"a", {u"b": u""}, False]]),
+        (u"<ab/>", [[u"StartTag", u"ab", {}, True]]),
+        (u"<abc", [[u"ParseError", "eof-in-tag-name"]]),
+        (u"</abc", [[u"ParseError", "eof-in-tag-name"]]),
+        (u'<a Bc\x00D=1 eF/g h="i" J>',
+         [[u"ParseError", "invalid-codepoint"],
+          [u"ParseError", "unexpected-character-after-soldius-in-tag"],
+          [u"StartTag", u"a", {u"bc\ufffdd": u"1", u"ef": u"", u"g": u"",
+                               u"h": u"i", u"j": u""}, False]]),
+        (u"<a b<c d'e>", [[u"ParseError", "invalid-character-in-attribute-name"],
+                          [u"ParseError", "invalid-character-in-attribute-name"],
+                          [u"StartTag", u"a", {u"b<c": u"", u"d'e": u""},
+                           False]]),
+        (u"<a bC", [[u"ParseError", "eof-in-attribute-name"]]),
+        (u"<a b c", [[u"ParseError", "eof-in-attribute-name"]])]
+    for data, expected in tests:
+        yield runTokenizeTest, data, expected
+        for chunkSize in (1, 2, 3):
+            yield runChunkedNameTest, data, chunkSize
+
 def test_tokenizer():
     for filename in html5lib_test_files('tokenizer', '*.test'):
         tests = json.load(file(filename))
@@ -8,20 +8,164 @@ try:
     from collections import deque
 except ImportError:
     from utils import deque
+
+import re
     
 from constants import spaceCharacters
 from constants import entitiesWindows1252, entities
 from constants import asciiLowercase, asciiLetters, asciiUpper2Lower
 from constants import digits, hexDigits, EOF
 from constants import tokenTypes, tagTokenTypes
-from constants import replacementCharacters
+from constants import replacementCharacters, NeedMoreInput
 
 from inputstream import HTMLInputStream
 
-# Group entities by their first character, for faster lookups
-entitiesByFirstChar = {}
+# Prefix trie of the entity names, so that the longest entity at a given
+# point can be found in one pass over the input. Each node maps a character
+# to the node for the prefix extended by it, and has the key "" when its
+# prefix is itself an entity name
+entitiesTrie = {}
 for e in entities:
-    entitiesByFirstChar.setdefault(e[0], []).append(e)
+    node = entitiesTrie
+    for c in e:
+        node = node.setdefault(c, {})
+    node[""] = True
+
+# Characters that end a run of ordinary characters in a tag name, an
+# attribute name and an unquoted attribute value. Runs are consumed with a
+# single charsUntil call; the states only look at these characters one at
+# a time
+tagNameEnd = frozenset((u">", u"/", u"\u0000")) | spaceCharacters
+attributeNameEnd = (frozenset((u"=", u">", u"/", u"\u0000", u"'", u'"', u"<")) |
+                    spaceCharacters)
+unquotedAttributeValueEnd = (frozenset((u"&", u">", u'"', u"'", u"=", u"<", u"`")) |
+                             spaceCharacters)
+
+# What may follow a "<" in RCDATA, RAWTEXT and script data for it to need
+# the *LessThanSign/*EndTag* states rather than be plain text: a NUL these
+# states hand back to rcdataState (which replaces it), the start of an
+# escape in script data, or the end of the chunk read so far
+rcdataLessThanSign = re.compile(u"(?:/[a-zA-Z]*)?[\t\n\u000C ]*(?:\u0000|$)")
+rawtextLessThanSign = re.compile(u"(?:/[a-zA-Z]*)?$")
+scriptDataLessThanSign = re.compile(u"!--|(?:/[a-zA-Z]*|!-?)?$")
+
+class Token(object):
+    """Base class of the tokens produced by HTMLTokenizer
+
+    Tokens keep their fields in slots rather than in a dict, which makes
+    them about a third of the size. Code written against dict tokens can
+    still use them as mappings: token["name"], token.get("selfClosing"),
+    "data" in token and dict(token) all work, but fields other than those
+    of the token's class can't be added.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def has_key(self, key):
+        return key in self
+
+    def get(self, key, default=None):
+        if key in self.__slots__:
+            return getattr(self, key, default)
+        return default
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __eq__(self, other):
+        try:
+            return dict(self.items()) == dict(other.items())
+        except AttributeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        rv = self.__eq__(other)
+        if rv is NotImplemented:
+            return rv
+        return not rv
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+class CharacterToken(Token):
+    """A Characters or SpaceCharacters token"""
+    __slots__ = ("type", "data")
+
+    def __init__(self, type, data):
+        self.type = type
+        self.data = data
+
+class CommentToken(Token):
+    __slots__ = ("type", "data")
+
+    def __init__(self, data):
+        self.type = tokenTypes["Comment"]
+        self.data = data
+
+class ParseErrorToken(Token):
+    """A parse error; datavars is only set if the error message needs it"""
+    __slots__ = ("type", "data", "datavars")
+
+    def __init__(self, data, datavars=None):
+        self.type = tokenTypes["ParseError"]
+        self.data = data
+        if datavars is not None:
+            self.datavars = datavars
+
+class TagToken(Token):
+    """A StartTag or EndTag token. data is a list of [name, value] pairs as
+    it comes from the tokenizer and a dict once the parser has normalized
+    it. namespace is only set by the parser, for foreign elements"""
+    __slots__ = ("type", "name", "data", "selfClosing",
+                 "selfClosingAcknowledged", "namespace")
+
+    def __init__(self, type, name, data, selfClosing=False):
+        self.type = type
+        self.name = name
+        self.data = data
+        self.selfClosing = selfClosing
+        self.selfClosingAcknowledged = False
+
+class DoctypeToken(Token):
+    __slots__ = ("type", "name", "publicId", "systemId", "correct")
+
+    def __init__(self, name, publicId, systemId, correct):
+        self.type = tokenTypes["Doctype"]
+        self.name = name
+        self.publicId = publicId
+        self.systemId = systemId
+        self.correct = correct
 
 class HTMLTokenizer(object):
     """ This class takes care of tokenizing HTML.
@@ -37,9 +181,11 @@ class HTMLTokenizer(object):
     """
 
     def __init__(self, stream, encoding=None, parseMeta=True, useChardet=True,
-                 lowercaseElementName=True, lowercaseAttrName=True, parser=None):
+                 lowercaseElementName=True, lowercaseAttrName=True, parser=None,
+                 trackPositions=True, reportErrors=True):
 
-        self.stream = HTMLInputStream(stream, encoding, parseMeta, useChardet)
+        self.stream = HTMLInputStream(stream, encoding, parseMeta, useChardet,
+                                      trackPositions, reportErrors)
         self.parser = parser
 
         #Perform case conversions?
@@ -54,6 +200,16 @@ class HTMLTokenizer(object):
 
         # The current token being created
         self.currentToken = None
+        self.temporaryBuffer = u""
+
+        # Set when the tokens of a document being fed stop because the
+        # data fed so far has run out
+        self.suspended = False
+
+        # Without error reporting no ParseError tokens are produced at all
+        self.reportErrors = reportErrors
+        if not reportErrors:
+            self.parseError = self.ignoreError
         super(HTMLTokenizer, self).__init__()
 
     def __iter__(self):
@@ -66,16 +222,84 @@ class HTMLTokenizer(object):
         self.tokenQueue = deque([])
         # Start processing. When EOF is reached self.state will return False
         # instead of True and the loop will terminate.
+        stream = self.stream
+        if stream.feedQueue is not None:
+            for token in self.fedTokens():
+                yield token
+            return
         while self.state():
-            while self.stream.errors:
-                yield {"type": tokenTypes["ParseError"], "data": self.stream.errors.pop(0)}
+            if stream.errors:
+                errors, stream.errors = stream.errors, []
+                if self.reportErrors:
+                    for error in errors:
+                        yield ParseErrorToken(error)
             while self.tokenQueue:
                 yield self.tokenQueue.popleft()
 
+    def fedTokens(self):
+        """__iter__ for a document given to HTMLParser.feed. A state that
+        runs out of the data fed so far is rolled back to where it started,
+        to run again once there is more, and the tokens stop there with
+        self.suspended set; iterating again carries on from that state.
+
+        The states only change the current token once they have read what
+        they need, so restoring which token is current (and the state and
+        temporary buffer) undoes them. The stream keeps the characters from
+        chunkMark on when it reads more."""
+        stream = self.stream
+        tokenQueue = self.tokenQueue
+        self.suspended = False
+        while True:
+            state = self.state
+            currentToken = self.currentToken
+            temporaryBuffer = self.temporaryBuffer
+            stream.chunkMark = stream.chunkOffset
+            try:
+                if not state():
+                    break
+            except NeedMoreInput:
+                stream.chunkOffset = stream.chunkMark
+                self.state = state
+                self.currentToken = currentToken
+                self.temporaryBuffer = temporaryBuffer
+                tokenQueue.clear()
+                self.suspended = True
+                break
+            if stream.errors:
+                errors, stream.errors = stream.errors, []
+                if self.reportErrors:
+                    for error in errors:
+                        yield ParseErrorToken(error)
+            while tokenQueue:
+                yield tokenQueue.popleft()
+
+    def parseError(self, errorcode, datavars=None):
+        """Queue a ParseError token"""
+        self.tokenQueue.append(ParseErrorToken(errorcode, datavars))
+
+    def ignoreError(self, errorcode, datavars=None):
+        """Stands in for parseError when errors aren't reported"""
+        pass
+
+    def mayReadTree(self):
+        """Whether the states run for the next token might reach
+        markupDeclarationOpenState, which looks at the parser's current
+        node to decide if "<![CDATA[" starts a CDATA section. That is only
+        reached from "<" in the data state, so it is enough to look at the
+        state and, in the data state, at the next character"""
+        state = self.state
+        if state == self.tagOpenState or state == self.markupDeclarationOpenState:
+            return True
+        if state == self.dataState:
+            stream = self.stream
+            return (stream.chunkOffset >= stream.chunkSize or
+                    stream.chunk[stream.chunkOffset] == u"<")
+        return False
+
     def consumeNumberEntity(self, isHex):
         """This function returns either U+FFFD or the character based on the
         decimal or hexadecimal representation. It also discards ";" if present.
-        If not present self.tokenQueue.append({"type": tokenTypes["ParseError"]}) is invoked.
+        If not present a ParseError token is queued.
         """
 
         allowed = digits
@@ -99,15 +323,15 @@ class HTMLTokenizer(object):
         # Certain characters get replaced with others
         if charAsInt in replacementCharacters:
             char = replacementCharacters[charAsInt]
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "illegal-codepoint-for-numeric-entity",
-              "datavars": {"charAsInt": charAsInt}})
+            self.parseError(
+                "illegal-codepoint-for-numeric-entity",
+                {"charAsInt": charAsInt})
         elif ((0xD800 <= charAsInt <= 0xDFFF) or 
               (charAsInt > 0x10FFFF)):
             char = u"\uFFFD"
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "illegal-codepoint-for-numeric-entity",
-              "datavars": {"charAsInt": charAsInt}})
+            self.parseError(
+                "illegal-codepoint-for-numeric-entity",
+                {"charAsInt": charAsInt})
         else:
             #Should speed up this check somehow (e.g. move the set to a constant)
             if ((0x0001 <= charAsInt <= 0x0008) or 
@@ -123,10 +347,9 @@ class HTMLTokenizer(object):
                                         0xBFFFF, 0xCFFFE, 0xCFFFF, 0xDFFFE, 
                                         0xDFFFF, 0xEFFFE, 0xEFFFF, 0xFFFFE, 
                                         0xFFFFF, 0x10FFFE, 0x10FFFF])):
-                self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                        "data":
-                                            "illegal-codepoint-for-numeric-entity",
-                                        "datavars": {"charAsInt": charAsInt}})
+                self.parseError(
+                    "illegal-codepoint-for-numeric-entity",
+                    {"charAsInt": charAsInt})
             try:
                 # Try/except needed as UCS-2 Python builds' unichar only works
                 # within the BMP.
@@ -137,8 +360,7 @@ class HTMLTokenizer(object):
         # Discard the ; if present. Otherwise, put it back on the queue and
         # invoke parseError on parser.
         if c != u";":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "numeric-entity-without-semicolon"})
+            self.parseError("numeric-entity-without-semicolon")
             self.stream.unget(c)
 
         return char
@@ -168,8 +390,7 @@ class HTMLTokenizer(object):
                 output = self.consumeNumberEntity(hex)
             else:
                 # No digits found
-                self.tokenQueue.append({"type": tokenTypes["ParseError"],
-                    "data": "expected-numeric-entity"})
+                self.parseError("expected-numeric-entity")
                 self.stream.unget(charStack.pop())
                 output = u"&" + u"".join(charStack)
 
@@ -177,33 +398,24 @@ class HTMLTokenizer(object):
             # At this point in the process might have named entity. Entities
             # are stored in the global variable "entities".
             #
-            # Consume characters and compare to these to a substring of the
-            # entity names in the list until the substring no longer matches.
-            filteredEntityList = entitiesByFirstChar.get(charStack[0], [])
-
-            def entitiesStartingWith(name):
-                return [e for e in filteredEntityList if e.startswith(name)]
-
-            while (charStack[-1] is not EOF and
-                   entitiesStartingWith("".join(charStack))):
+            # Consume characters while they spell the start of an entity name,
+            # remembering the longest entity seen to take care of &noti for
+            # instance.
+            node = entitiesTrie.get(charStack[0])
+            entityLength = 0
+            while node is not None:
+                if "" in node:
+                    entityLength = len(charStack)
                 charStack.append(self.stream.char())
+                node = node.get(charStack[-1])
 
-            # At this point we have a string that starts with some characters
-            # that may match an entity
             entityName = None
-
-            # Try to find the longest entity the string will match to take care
-            # of &noti for instance.
-            for entityLength in xrange(len(charStack)-1, 1, -1):
-                possibleEntityName = "".join(charStack[:entityLength])
-                if possibleEntityName in entities:
-                    entityName = possibleEntityName
-                    break
+            if entityLength:
+                entityName = "".join(charStack[:entityLength])
 
             if entityName is not None:
                 if entityName[-1] != ";":
-                    self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-                      "named-entity-without-semicolon"})
+                    self.parseError("named-entity-without-semicolon")
                 if (entityName[-1] != ";" and fromAttribute and
                     (charStack[entityLength] in asciiLetters or
                      charStack[entityLength] in digits or
@@ -215,19 +427,19 @@ class HTMLTokenizer(object):
                     self.stream.unget(charStack.pop())
                     output += u"".join(charStack[entityLength:])
             else:
-                self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-                  "expected-named-entity"})
+                self.parseError("expected-named-entity")
                 self.stream.unget(charStack.pop())
                 output = u"&" + u"".join(charStack)
 
         if fromAttribute:
-            self.currentToken["data"][-1][1] += output
+            self.currentToken.data[-1][1] += output
         else:
             if output in spaceCharacters:
                 tokenType = "SpaceCharacters"
             else:
                 tokenType = "Characters"
-            self.tokenQueue.append({"type": tokenTypes[tokenType], "data": output})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes[tokenType], output))
 
     def processEntityInAttribute(self, allowedChar):
         """This method replaces the need for "entityInAttributeValueState".
@@ -241,16 +453,14 @@ class HTMLTokenizer(object):
         """
         token = self.currentToken
         # Add token to the queue to be yielded
-        if (token["type"] in tagTokenTypes):
+        if (token.type in tagTokenTypes):
             if self.lowercaseElementName:
-                token["name"] = token["name"].translate(asciiUpper2Lower)
-            if token["type"] == tokenTypes["EndTag"]:
-                if token["data"]:
-                    self.tokenQueue.append({"type":tokenTypes["ParseError"],
-                                            "data":"attributes-in-end-tag"})
-                if token["selfClosing"]:
-                    self.tokenQueue.append({"type":tokenTypes["ParseError"],
-                                            "data":"self-closing-flag-on-end-tag"})
+                token.name = token.name.translate(asciiUpper2Lower)
+            if token.type == tokenTypes["EndTag"]:
+                if token.data:
+                    self.parseError("attributes-in-end-tag")
+                if token.selfClosing:
+                    self.parseError("self-closing-flag-on-end-tag")
         self.tokenQueue.append(token)
         self.state = self.dataState
 
@@ -264,10 +474,9 @@ class HTMLTokenizer(object):
         elif data == "<":
             self.state = self.tagOpenState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data":"invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\u0000"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\u0000"))
         elif data is EOF:
             # Tokenization ends.
             return False
@@ -275,15 +484,16 @@ class HTMLTokenizer(object):
             # Directly after emitting a token you switch back to the "data
             # state". At that point spaceCharacters are important so they are
             # emitted separately.
-            self.tokenQueue.append({"type": tokenTypes["SpaceCharacters"], "data":
-              data + self.stream.charsUntil(spaceCharacters, True)})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["SpaceCharacters"],
+                data + self.stream.charsUntil(spaceCharacters, True)))
             # No need to update lastFourChars here, since the first space will
             # have already been appended to lastFourChars and will have broken
             # any <!-- or --> sequences
         else:
             chars = self.stream.charsUntil((u"&", u"<", u"\u0000"))
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": 
-              data + chars})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data + chars))
         return True
 
     def entityDataState(self):
@@ -301,23 +511,25 @@ class HTMLTokenizer(object):
             # Tokenization ends.
             return False
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
         elif data in spaceCharacters:
             # Directly after emitting a token you switch back to the "data
             # state". At that point spaceCharacters are important so they are
             # emitted separately.
-            self.tokenQueue.append({"type": tokenTypes["SpaceCharacters"], "data":
-              data + self.stream.charsUntil(spaceCharacters, True)})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["SpaceCharacters"],
+                data + self.stream.charsUntil(spaceCharacters, True)))
             # No need to update lastFourChars here, since the first space will
             # have already been appended to lastFourChars and will have broken
             # any <!-- or --> sequences
         else:
-            chars = self.stream.charsUntil((u"&", u"<"))
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": 
-              data + chars})
+            chars = self.stream.charsUntilEndTag(
+                (u"&",), self.currentToken and self.currentToken.name.lower(),
+                rcdataLessThanSign)
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data + chars))
         return True
 
     def characterReferenceInRcdata(self):
@@ -330,17 +542,19 @@ class HTMLTokenizer(object):
         if data == "<":
             self.state = self.rawtextLessThanSignState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
         elif data == EOF:
             # Tokenization ends.
             return False
         else:
-            chars = self.stream.charsUntil((u"<", u"\u0000"))
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": 
-              data + chars})
+            chars = self.stream.charsUntilEndTag(
+                (u"\u0000",),
+                self.currentToken and self.currentToken.name.lower(),
+                rawtextLessThanSign)
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data + chars))
         return True
     
     def scriptDataState(self):
@@ -348,17 +562,19 @@ class HTMLTokenizer(object):
         if data == "<":
             self.state = self.scriptDataLessThanSignState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
         elif data == EOF:
             # Tokenization ends.
             return False
         else:
-            chars = self.stream.charsUntil((u"<", u"\u0000"))
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": 
-              data + chars})
+            chars = self.stream.charsUntilEndTag(
+                (u"\u0000",),
+                self.currentToken and self.currentToken.name.lower(),
+                scriptDataLessThanSign)
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data + chars))
         return True
     
     def plaintextState(self):
@@ -367,13 +583,13 @@ class HTMLTokenizer(object):
             # Tokenization ends.
             return False
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": 
-                                    data + self.stream.charsUntil(u"\u0000")})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"],
+                data + self.stream.charsUntil(u"\u0000")))
         return True
 
     def tagOpenState(self):
@@ -383,30 +599,29 @@ class HTMLTokenizer(object):
         elif data == u"/":
             self.state = self.closeTagOpenState
         elif data in asciiLetters:
-            self.currentToken = {"type": tokenTypes["StartTag"], 
-                                 "name": data, "data": [],
-                                 "selfClosing": False,
-                                 "selfClosingAcknowledged": False}
+            self.currentToken = TagToken(
+                tokenTypes["StartTag"],
+                data + self.stream.charsUntil(tagNameEnd),
+                [])
             self.state = self.tagNameState
         elif data == u">":
             # XXX In theory it could be something besides a tag name. But
             # do we really care?
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-tag-name-but-got-right-bracket"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<>"})
+            self.parseError("expected-tag-name-but-got-right-bracket")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<>"))
             self.state = self.dataState
         elif data == u"?":
             # XXX In theory it could be something besides a tag name. But
             # do we really care?
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-tag-name-but-got-question-mark"})
+            self.parseError("expected-tag-name-but-got-question-mark")
             self.stream.unget(data)
             self.state = self.bogusCommentState
         else:
             # XXX
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-tag-name"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.parseError("expected-tag-name")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.stream.unget(data)
             self.state = self.dataState
         return True
@@ -414,23 +629,23 @@ class HTMLTokenizer(object):
     def closeTagOpenState(self):
         data = self.stream.char()
         if data in asciiLetters:
-            self.currentToken = {"type": tokenTypes["EndTag"], "name": data,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"],
+                data + self.stream.charsUntil(tagNameEnd),
+                [])
             self.state = self.tagNameState
         elif data == u">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-closing-tag-but-got-right-bracket"})
+            self.parseError("expected-closing-tag-but-got-right-bracket")
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-closing-tag-but-got-eof"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"</"})
+            self.parseError("expected-closing-tag-but-got-eof")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</"))
             self.state = self.dataState
         else:
             # XXX data can be _'_...
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-closing-tag-but-got-char",
-              "datavars": {"data": data}})
+            self.parseError(
+                "expected-closing-tag-but-got-char", {"data": data})
             self.stream.unget(data)
             self.state = self.bogusCommentState
         return True
@@ -442,19 +657,15 @@ class HTMLTokenizer(object):
         elif data == u">":
             self.emitCurrentToken()
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-tag-name"})
+            self.parseError("eof-in-tag-name")
             self.state = self.dataState
         elif data == u"/":
             self.state = self.selfClosingStartTagState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["name"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.name += u"\uFFFD"
         else:
-            self.currentToken["name"] += data
-            # (Don't use charsUntil here, because tag names are
-            # very short and it's faster to not do anything fancy)
+            self.currentToken.name += data + self.stream.charsUntil(tagNameEnd)
         return True
     
     def rcdataLessThanSignState(self):
@@ -463,7 +674,8 @@ class HTMLTokenizer(object):
             self.temporaryBuffer = ""
             self.state = self.rcdataEndTagOpenState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.stream.unget(data)
             self.state = self.rcdataState
         return True
@@ -474,35 +686,33 @@ class HTMLTokenizer(object):
             self.temporaryBuffer += data
             self.state = self.rcdataEndTagNameState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"</"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</"))
             self.stream.unget(data)
             self.state = self.rcdataState
         return True
     
     def rcdataEndTagNameState(self):
-        appropriate = self.currentToken and self.currentToken["name"].lower() == self.temporaryBuffer.lower()
+        appropriate = self.currentToken and self.currentToken.name.lower() == self.temporaryBuffer.lower()
         data = self.stream.char()
         if data in spaceCharacters and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.beforeAttributeNameState
         elif data == "/" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.selfClosingStartTagState
         elif data == ">" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.emitCurrentToken()
             self.state = self.dataState
         elif data in asciiLetters:
             self.temporaryBuffer += data
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"],
-                                    "data": u"</" + self.temporaryBuffer})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</" + self.temporaryBuffer))
             self.stream.unget(data)
             self.state = self.rcdataState
         return True
@@ -513,7 +723,8 @@ class HTMLTokenizer(object):
             self.temporaryBuffer = ""
             self.state = self.rawtextEndTagOpenState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.stream.unget(data)
             self.state = self.rawtextState
         return True
@@ -524,35 +735,33 @@ class HTMLTokenizer(object):
             self.temporaryBuffer += data
             self.state = self.rawtextEndTagNameState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"</"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</"))
             self.stream.unget(data)
             self.state = self.rawtextState
         return True
     
     def rawtextEndTagNameState(self):
-        appropriate = self.currentToken and self.currentToken["name"].lower() == self.temporaryBuffer.lower()
+        appropriate = self.currentToken and self.currentToken.name.lower() == self.temporaryBuffer.lower()
         data = self.stream.char()
         if data in spaceCharacters and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.beforeAttributeNameState
         elif data == "/" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.selfClosingStartTagState
         elif data == ">" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.emitCurrentToken()
             self.state = self.dataState
         elif data in asciiLetters:
             self.temporaryBuffer += data
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"],
-                                    "data": u"</" + self.temporaryBuffer})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</" + self.temporaryBuffer))
             self.stream.unget(data)
             self.state = self.rawtextState
         return True
@@ -563,10 +772,12 @@ class HTMLTokenizer(object):
             self.temporaryBuffer = ""
             self.state = self.scriptDataEndTagOpenState
         elif data == "!":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<!"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<!"))
             self.state = self.scriptDataEscapeStartState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.stream.unget(data)
             self.state = self.scriptDataState
         return True
@@ -577,35 +788,33 @@ class HTMLTokenizer(object):
             self.temporaryBuffer += data
             self.state = self.scriptDataEndTagNameState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"</"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</"))
             self.stream.unget(data)
             self.state = self.scriptDataState
         return True
     
     def scriptDataEndTagNameState(self):
-        appropriate = self.currentToken and self.currentToken["name"].lower() == self.temporaryBuffer.lower()
+        appropriate = self.currentToken and self.currentToken.name.lower() == self.temporaryBuffer.lower()
         data = self.stream.char()
         if data in spaceCharacters and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.beforeAttributeNameState
         elif data == "/" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.selfClosingStartTagState
         elif data == ">" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.emitCurrentToken()
             self.state = self.dataState
         elif data in asciiLetters:
             self.temporaryBuffer += data
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"],
-                                    "data": u"</" + self.temporaryBuffer})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</" + self.temporaryBuffer))
             self.stream.unget(data)
             self.state = self.scriptDataState
         return True
@@ -613,7 +822,8 @@ class HTMLTokenizer(object):
     def scriptDataEscapeStartState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
             self.state = self.scriptDataEscapeStartDashState
         else:
             self.stream.unget(data)
@@ -623,7 +833,8 @@ class HTMLTokenizer(object):
     def scriptDataEscapeStartDashState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
             self.state = self.scriptDataEscapedDashDashState
         else:
             self.stream.unget(data)
@@ -633,62 +844,65 @@ class HTMLTokenizer(object):
     def scriptDataEscapedState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
             self.state = self.scriptDataEscapedDashState
         elif data == "<":
             self.state = self.scriptDataEscapedLessThanSignState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
         elif data == EOF:
             self.state = self.dataState
         else:
             chars = self.stream.charsUntil((u"<", u"-", u"\u0000"))
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": 
-              data + chars})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data + chars))
         return True
     
     def scriptDataEscapedDashState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
             self.state = self.scriptDataEscapedDashDashState
         elif data == "<":
             self.state = self.scriptDataEscapedLessThanSignState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
             self.state = self.scriptDataEscapedState
         elif data == EOF:
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             self.state = self.scriptDataEscapedState
         return True
     
     def scriptDataEscapedDashDashState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
         elif data == "<":
             self.state = self.scriptDataEscapedLessThanSignState
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u">"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u">"))
             self.state = self.scriptDataState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
             self.state = self.scriptDataEscapedState
         elif data == EOF:
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             self.state = self.scriptDataEscapedState
         return True
     
@@ -698,11 +912,13 @@ class HTMLTokenizer(object):
             self.temporaryBuffer = ""
             self.state = self.scriptDataEscapedEndTagOpenState
         elif data in asciiLetters:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<" + data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<" + data))
             self.temporaryBuffer = data
             self.state = self.scriptDataDoubleEscapeStartState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.stream.unget(data)
             self.state = self.scriptDataEscapedState
         return True
@@ -713,35 +929,33 @@ class HTMLTokenizer(object):
             self.temporaryBuffer = data
             self.state = self.scriptDataEscapedEndTagNameState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"</"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</"))
             self.stream.unget(data)
             self.state = self.scriptDataEscapedState
         return True
     
     def scriptDataEscapedEndTagNameState(self):
-        appropriate = self.currentToken and self.currentToken["name"].lower() == self.temporaryBuffer.lower()
+        appropriate = self.currentToken and self.currentToken.name.lower() == self.temporaryBuffer.lower()
         data = self.stream.char()
         if data in spaceCharacters and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.beforeAttributeNameState
         elif data == "/" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.state = self.selfClosingStartTagState
         elif data == ">" and appropriate:
-            self.currentToken = {"type": tokenTypes["EndTag"],
-                                 "name": self.temporaryBuffer,
-                                 "data": [], "selfClosing":False}
+            self.currentToken = TagToken(
+                tokenTypes["EndTag"], self.temporaryBuffer, [])
             self.emitCurrentToken()
             self.state = self.dataState
         elif data in asciiLetters:
             self.temporaryBuffer += data
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"],
-                                    "data": u"</" + self.temporaryBuffer})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"</" + self.temporaryBuffer))
             self.stream.unget(data)
             self.state = self.scriptDataEscapedState
         return True
@@ -749,13 +963,15 @@ class HTMLTokenizer(object):
     def scriptDataDoubleEscapeStartState(self):
         data = self.stream.char()
         if data in (spaceCharacters | frozenset(("/", ">"))):
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             if self.temporaryBuffer.lower() == "script":
                 self.state = self.scriptDataDoubleEscapedState
             else:
                 self.state = self.scriptDataEscapedState
         elif data in asciiLetters:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             self.temporaryBuffer += data
         else:
             self.stream.unget(data)
@@ -765,76 +981,81 @@ class HTMLTokenizer(object):
     def scriptDataDoubleEscapedState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
             self.state = self.scriptDataDoubleEscapedDashState
         elif data == "<":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.state = self.scriptDataDoubleEscapedLessThanSignState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
         elif data == EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-script-in-script"})
+            self.parseError("eof-in-script-in-script")
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
         return True
     
     def scriptDataDoubleEscapedDashState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
             self.state = self.scriptDataDoubleEscapedDashDashState
         elif data == "<":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.state = self.scriptDataDoubleEscapedLessThanSignState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
             self.state = self.scriptDataDoubleEscapedState
         elif data == EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-script-in-script"})
+            self.parseError("eof-in-script-in-script")
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             self.state = self.scriptDataDoubleEscapedState
         return True
     
     def scriptDataDoubleEscapedDashState(self):
         data = self.stream.char()
         if data == "-":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"-"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"-"))
         elif data == "<":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"<"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"<"))
             self.state = self.scriptDataDoubleEscapedLessThanSignState
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u">"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u">"))
             self.state = self.scriptDataState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": u"\uFFFD"})
+            self.parseError("invalid-codepoint")
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"\uFFFD"))
             self.state = self.scriptDataDoubleEscapedState
         elif data == EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-script-in-script"})
+            self.parseError("eof-in-script-in-script")
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             self.state = self.scriptDataDoubleEscapedState
         return True
     
     def scriptDataDoubleEscapedLessThanSignState(self):
         data = self.stream.char()
         if data == "/":
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": u"/"})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], u"/"))
             self.temporaryBuffer = ""
             self.state = self.scriptDataDoubleEscapeEndState
         else:
@@ -845,13 +1066,15 @@ class HTMLTokenizer(object):
     def scriptDataDoubleEscapeEndState(self):
         data = self.stream.char()
         if data in (spaceCharacters | frozenset(("/", ">"))):
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             if self.temporaryBuffer.lower() == "script":
                 self.state = self.scriptDataEscapedState
             else:
                 self.state = self.scriptDataDoubleEscapedState
         elif data in asciiLetters:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
             self.temporaryBuffer += data
         else:
             self.stream.unget(data)
@@ -863,28 +1086,26 @@ class HTMLTokenizer(object):
         if data in spaceCharacters:
             self.stream.charsUntil(spaceCharacters, True)
         elif data in asciiLetters:
-            self.currentToken["data"].append([data, ""])
+            self.currentToken.data.append(
+                [data + self.stream.charsUntil(attributeNameEnd), ""])
             self.state = self.attributeNameState
         elif data == u">":
             self.emitCurrentToken()
         elif data == u"/":
             self.state = self.selfClosingStartTagState
         elif data in (u"'", u'"', u"=", u"<"):
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "invalid-character-in-attribute-name"})
-            self.currentToken["data"].append([data, ""])
+            self.parseError("invalid-character-in-attribute-name")
+            self.currentToken.data.append([data, ""])
             self.state = self.attributeNameState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"].append([u"\uFFFD", ""])
+            self.parseError("invalid-codepoint")
+            self.currentToken.data.append([u"\uFFFD", ""])
             self.state = self.attributeNameState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-attribute-name-but-got-eof"})
+            self.parseError("expected-attribute-name-but-got-eof")
             self.state = self.dataState
         else:
-            self.currentToken["data"].append([data, ""])
+            self.currentToken.data.append([data, ""])
             self.state = self.attributeNameState
         return True
 
@@ -895,8 +1116,8 @@ class HTMLTokenizer(object):
         if data == u"=":
             self.state = self.beforeAttributeValueState
         elif data in asciiLetters:
-            self.currentToken["data"][-1][0] += data +\
-              self.stream.charsUntil(asciiLetters, True)
+            self.currentToken.data[-1][0] += data +\
+              self.stream.charsUntil(attributeNameEnd)
             leavingThisState = False
         elif data == u">":
             # XXX If we emit here the attributes are converted to a dict
@@ -908,22 +1129,19 @@ class HTMLTokenizer(object):
         elif data == u"/":
             self.state = self.selfClosingStartTagState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"][-1][0] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data[-1][0] += u"\uFFFD"
             leavingThisState = False
         elif data in (u"'", u'"', u"<"):
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data":
-                                        "invalid-character-in-attribute-name"})
-            self.currentToken["data"][-1][0] += data
+            self.parseError("invalid-character-in-attribute-name")
+            self.currentToken.data[-1][0] += data
             leavingThisState = False
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "eof-in-attribute-name"})
+            self.parseError("eof-in-attribute-name")
             self.state = self.dataState
         else:
-            self.currentToken["data"][-1][0] += data
+            self.currentToken.data[-1][0] += data +\
+              self.stream.charsUntil(attributeNameEnd)
             leavingThisState = False
 
         if leavingThisState:
@@ -931,12 +1149,11 @@ class HTMLTokenizer(object):
             # start tag token is emitted so values can still be safely appended
             # to attributes, but we do want to report the parse error in time.
             if self.lowercaseAttrName:
-                self.currentToken["data"][-1][0] = (
-                    self.currentToken["data"][-1][0].translate(asciiUpper2Lower))
-            for name, value in self.currentToken["data"][:-1]:
-                if self.currentToken["data"][-1][0] == name:
-                    self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-                      "duplicate-attribute"})
+                self.currentToken.data[-1][0] = (
+                    self.currentToken.data[-1][0].translate(asciiUpper2Lower))
+            for name, value in self.currentToken.data[:-1]:
+                if self.currentToken.data[-1][0] == name:
+                    self.parseError("duplicate-attribute")
                     break
             # XXX Fix for above XXX
             if emitToken:
@@ -952,26 +1169,24 @@ class HTMLTokenizer(object):
         elif data == u">":
             self.emitCurrentToken()
         elif data in asciiLetters:
-            self.currentToken["data"].append([data, ""])
+            self.currentToken.data.append(
+                [data + self.stream.charsUntil(attributeNameEnd), ""])
             self.state = self.attributeNameState
         elif data == u"/":
             self.state = self.selfClosingStartTagState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"].append([u"\uFFFD", ""])
+            self.parseError("invalid-codepoint")
+            self.currentToken.data.append([u"\uFFFD", ""])
             self.state = self.attributeNameState
         elif data in (u"'", u'"', u"<"):
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "invalid-character-after-attribute-name"})
-            self.currentToken["data"].append([data, ""])
+            self.parseError("invalid-character-after-attribute-name")
+            self.currentToken.data.append([data, ""])
             self.state = self.attributeNameState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-end-of-tag-but-got-eof"})
+            self.parseError("expected-end-of-tag-but-got-eof")
             self.state = self.dataState
         else:
-            self.currentToken["data"].append([data, ""])
+            self.currentToken.data.append([data, ""])
             self.state = self.attributeNameState
         return True
 
@@ -987,25 +1202,21 @@ class HTMLTokenizer(object):
         elif data == u"'":
             self.state = self.attributeValueSingleQuotedState
         elif data == u">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-attribute-value-but-got-right-bracket"})
+            self.parseError("expected-attribute-value-but-got-right-bracket")
             self.emitCurrentToken()
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"][-1][1] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data[-1][1] += u"\uFFFD"
             self.state = self.attributeValueUnQuotedState
         elif data in (u"=", u"<", u"`"):
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "equals-in-unquoted-attribute-value"})
-            self.currentToken["data"][-1][1] += data
+            self.parseError("equals-in-unquoted-attribute-value")
+            self.currentToken.data[-1][1] += data
             self.state = self.attributeValueUnQuotedState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-attribute-value-but-got-eof"})
+            self.parseError("expected-attribute-value-but-got-eof")
             self.state = self.dataState
         else:
-            self.currentToken["data"][-1][1] += data
+            self.currentToken.data[-1][1] += data
             self.state = self.attributeValueUnQuotedState
         return True
 
@@ -1016,15 +1227,13 @@ class HTMLTokenizer(object):
         elif data == u"&":
             self.processEntityInAttribute(u'"')
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"][-1][1] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data[-1][1] += u"\uFFFD"
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-attribute-value-double-quote"})
+            self.parseError("eof-in-attribute-value-double-quote")
             self.state = self.dataState
         else:
-            self.currentToken["data"][-1][1] += data +\
+            self.currentToken.data[-1][1] += data +\
               self.stream.charsUntil(("\"", u"&"))
         return True
 
@@ -1035,15 +1244,13 @@ class HTMLTokenizer(object):
         elif data == u"&":
             self.processEntityInAttribute(u"'")
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"][-1][1] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data[-1][1] += u"\uFFFD"
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-attribute-value-single-quote"})
+            self.parseError("eof-in-attribute-value-single-quote")
             self.state = self.dataState
         else:
-            self.currentToken["data"][-1][1] += data +\
+            self.currentToken.data[-1][1] += data +\
               self.stream.charsUntil(("'", u"&"))
         return True
 
@@ -1056,20 +1263,17 @@ class HTMLTokenizer(object):
         elif data == u">":
             self.emitCurrentToken()
         elif data in (u'"', u"'", u"=", u"<", u"`"):
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-character-in-unquoted-attribute-value"})
-            self.currentToken["data"][-1][1] += data
+            self.parseError("unexpected-character-in-unquoted-attribute-value")
+            self.currentToken.data[-1][1] += data
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"][-1][1] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data[-1][1] += u"\uFFFD"
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-attribute-value-no-quotes"})
+            self.parseError("eof-in-attribute-value-no-quotes")
             self.state = self.dataState
         else:
-            self.currentToken["data"][-1][1] += data + self.stream.charsUntil(
-              frozenset((u"&", u">", u'"', u"'", u"=", u"<", u"`")) | spaceCharacters)
+            self.currentToken.data[-1][1] += data +\
+              self.stream.charsUntil(unquotedAttributeValueEnd)
         return True
 
     def afterAttributeValueState(self):
@@ -1081,13 +1285,11 @@ class HTMLTokenizer(object):
         elif data == u"/":
             self.state = self.selfClosingStartTagState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-EOF-after-attribute-value"})
+            self.parseError("unexpected-EOF-after-attribute-value")
             self.stream.unget(data)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-character-after-attribute-value"})
+            self.parseError("unexpected-character-after-attribute-value")
             self.stream.unget(data)
             self.state = self.beforeAttributeNameState
         return True
@@ -1095,17 +1297,14 @@ class HTMLTokenizer(object):
     def selfClosingStartTagState(self):
         data = self.stream.char()
         if data == ">":
-            self.currentToken["selfClosing"] = True
+            self.currentToken.selfClosing = True
             self.emitCurrentToken()
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data":
-                                        "unexpected-EOF-after-solidus-in-tag"})
+            self.parseError("unexpected-EOF-after-solidus-in-tag")
             self.stream.unget(data)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-character-after-soldius-in-tag"})
+            self.parseError("unexpected-character-after-soldius-in-tag")
             self.stream.unget(data)
             self.state = self.beforeAttributeNameState
         return True
@@ -1117,7 +1316,7 @@ class HTMLTokenizer(object):
         data = self.stream.charsUntil(u">")
         data = data.replace(u"\u0000", u"\uFFFD")
         self.tokenQueue.append(
-          {"type": tokenTypes["Comment"], "data": data})
+          CommentToken(data))
 
         # Eat the character directly after the bogus comment which is either a
         # ">" or an EOF.
@@ -1130,7 +1329,7 @@ class HTMLTokenizer(object):
         if charStack[-1] == u"-":
             charStack.append(self.stream.char())
             if charStack[-1] == u"-":
-                self.currentToken = {"type": tokenTypes["Comment"], "data": u""}
+                self.currentToken = CommentToken(u"")
                 self.state = self.commentStartState
                 return True
         elif charStack[-1] in (u'd', u'D'):
@@ -1142,10 +1341,7 @@ class HTMLTokenizer(object):
                     matched = False
                     break
             if matched:
-                self.currentToken = {"type": tokenTypes["Doctype"],
-                                     "name": u"",
-                                     "publicId": None, "systemId": None, 
-                                     "correct": True}
+                self.currentToken = DoctypeToken(u"", None, None, True)
                 self.state = self.doctypeState
                 return True
         elif (charStack[-1] == "[" and 
@@ -1162,8 +1358,7 @@ class HTMLTokenizer(object):
                 self.state = self.cdataSectionState
                 return True
 
-        self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-          "expected-dashes-or-doctype"})
+        self.parseError("expected-dashes-or-doctype")
 
         while charStack:
             self.stream.unget(charStack.pop())
@@ -1175,21 +1370,18 @@ class HTMLTokenizer(object):
         if data == "-":
             self.state = self.commentStartDashState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data += u"\uFFFD"
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "incorrect-comment"})
+            self.parseError("incorrect-comment")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-comment"})
+            self.parseError("eof-in-comment")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["data"] += data
+            self.currentToken.data += data
             self.state = self.commentState
         return True
     
@@ -1198,21 +1390,18 @@ class HTMLTokenizer(object):
         if data == "-":
             self.state = self.commentEndState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"] += u"-\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data += u"-\uFFFD"
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "incorrect-comment"})
+            self.parseError("incorrect-comment")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-comment"})
+            self.parseError("eof-in-comment")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["data"] += "-" + data
+            self.currentToken.data += "-" + data
             self.state = self.commentState
         return True
 
@@ -1222,16 +1411,14 @@ class HTMLTokenizer(object):
         if data == u"-":
             self.state = self.commentEndDashState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data += u"\uFFFD"
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "eof-in-comment"})
+            self.parseError("eof-in-comment")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["data"] += data + \
+            self.currentToken.data += data + \
                 self.stream.charsUntil((u"-", u"\u0000"))
         return True
 
@@ -1240,17 +1427,15 @@ class HTMLTokenizer(object):
         if data == u"-":
             self.state = self.commentEndState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"] += u"-\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data += u"-\uFFFD"
             self.state = self.commentState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-comment-end-dash"})
+            self.parseError("eof-in-comment-end-dash")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["data"] += u"-" + data
+            self.currentToken.data += u"-" + data
             self.state = self.commentState
         return True
 
@@ -1260,28 +1445,23 @@ class HTMLTokenizer(object):
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"] += u"--\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data += u"--\uFFFD"
             self.state = self.commentState
         elif data == "!":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-bang-after-double-dash-in-comment"})
+            self.parseError("unexpected-bang-after-double-dash-in-comment")
             self.state = self.commentEndBangState
         elif data == u"-":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-             "unexpected-dash-after-double-dash-in-comment"})
-            self.currentToken["data"] += data
+            self.parseError("unexpected-dash-after-double-dash-in-comment")
+            self.currentToken.data += data
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-comment-double-dash"})
+            self.parseError("eof-in-comment-double-dash")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
             # XXX
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-comment"})
-            self.currentToken["data"] += u"--" + data
+            self.parseError("unexpected-char-in-comment")
+            self.currentToken.data += u"--" + data
             self.state = self.commentState
         return True
 
@@ -1291,20 +1471,18 @@ class HTMLTokenizer(object):
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data == u"-":
-            self.currentToken["data"] += "--!"
+            self.currentToken.data += "--!"
             self.state = self.commentEndDashState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["data"] += u"--!\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.data += u"--!\uFFFD"
             self.state = self.commentState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-comment-end-bang-state"})
+            self.parseError("eof-in-comment-end-bang-state")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["data"] += u"--!" + data
+            self.currentToken.data += u"--!" + data
             self.state = self.commentState
         return True
 
@@ -1313,14 +1491,12 @@ class HTMLTokenizer(object):
         if data in spaceCharacters:
             self.state = self.beforeDoctypeNameState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-doctype-name-but-got-eof"})
-            self.currentToken["correct"] = False
+            self.parseError("expected-doctype-name-but-got-eof")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "need-space-after-doctype"})
+            self.parseError("need-space-after-doctype")
             self.stream.unget(data)
             self.state = self.beforeDoctypeNameState
         return True
@@ -1330,50 +1506,45 @@ class HTMLTokenizer(object):
         if data in spaceCharacters:
             pass
         elif data == u">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-doctype-name-but-got-right-bracket"})
-            self.currentToken["correct"] = False
+            self.parseError("expected-doctype-name-but-got-right-bracket")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["name"] = u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.name = u"\uFFFD"
             self.state = self.doctypeNameState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "expected-doctype-name-but-got-eof"})
-            self.currentToken["correct"] = False
+            self.parseError("expected-doctype-name-but-got-eof")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["name"] = data
+            self.currentToken.name = data
             self.state = self.doctypeNameState
         return True
 
     def doctypeNameState(self):
         data = self.stream.char()
         if data in spaceCharacters:
-            self.currentToken["name"] = self.currentToken["name"].translate(asciiUpper2Lower)
+            self.currentToken.name = self.currentToken.name.translate(asciiUpper2Lower)
             self.state = self.afterDoctypeNameState
         elif data == u">":
-            self.currentToken["name"] = self.currentToken["name"].translate(asciiUpper2Lower)
+            self.currentToken.name = self.currentToken.name.translate(asciiUpper2Lower)
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["name"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.name += u"\uFFFD"
             self.state = self.doctypeNameState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype-name"})
-            self.currentToken["correct"] = False
-            self.currentToken["name"] = self.currentToken["name"].translate(asciiUpper2Lower)
+            self.parseError("eof-in-doctype-name")
+            self.currentToken.correct = False
+            self.currentToken.name = self.currentToken.name.translate(asciiUpper2Lower)
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["name"] += data
+            self.currentToken.name += data
         return True
 
     def afterDoctypeNameState(self):
@@ -1384,10 +1555,9 @@ class HTMLTokenizer(object):
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.currentToken["correct"] = False
+            self.currentToken.correct = False
             self.stream.unget(data)
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
+            self.parseError("eof-in-doctype")
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
@@ -1419,10 +1589,9 @@ class HTMLTokenizer(object):
             # discarded; only the latest character might be '>' or EOF
             # and needs to be ungetted
             self.stream.unget(data)
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-                "expected-space-or-right-bracket-in-doctype", "datavars":
-                {"data": data}})
-            self.currentToken["correct"] = False
+            self.parseError(
+                "expected-space-or-right-bracket-in-doctype", {"data": data})
+            self.currentToken.correct = False
             self.state = self.bogusDoctypeState
 
         return True
@@ -1432,14 +1601,12 @@ class HTMLTokenizer(object):
         if data in spaceCharacters:
             self.state = self.beforeDoctypePublicIdentifierState
         elif data in ("'", '"'):
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
+            self.parseError("unexpected-char-in-doctype")
             self.stream.unget(data)
             self.state = self.beforeDoctypePublicIdentifierState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
@@ -1452,27 +1619,24 @@ class HTMLTokenizer(object):
         if data in spaceCharacters:
             pass
         elif data == "\"":
-            self.currentToken["publicId"] = u""
+            self.currentToken.publicId = u""
             self.state = self.doctypePublicIdentifierDoubleQuotedState
         elif data == "'":
-            self.currentToken["publicId"] = u""
+            self.currentToken.publicId = u""
             self.state = self.doctypePublicIdentifierSingleQuotedState
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-end-of-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-end-of-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-char-in-doctype")
+            self.currentToken.correct = False
             self.state = self.bogusDoctypeState
         return True
 
@@ -1481,23 +1645,20 @@ class HTMLTokenizer(object):
         if data == "\"":
             self.state = self.afterDoctypePublicIdentifierState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["publicId"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.publicId += u"\uFFFD"
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-end-of-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-end-of-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["publicId"] += data
+            self.currentToken.publicId += data
         return True
 
     def doctypePublicIdentifierSingleQuotedState(self):
@@ -1505,23 +1666,20 @@ class HTMLTokenizer(object):
         if data == "'":
             self.state = self.afterDoctypePublicIdentifierState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["publicId"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.publicId += u"\uFFFD"
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-end-of-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-end-of-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["publicId"] += data
+            self.currentToken.publicId += data
         return True
 
     def afterDoctypePublicIdentifierState(self):
@@ -1532,25 +1690,21 @@ class HTMLTokenizer(object):
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data == '"':
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
-            self.currentToken["systemId"] = u""
+            self.parseError("unexpected-char-in-doctype")
+            self.currentToken.systemId = u""
             self.state = self.doctypeSystemIdentifierDoubleQuotedState
         elif data == "'":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
-            self.currentToken["systemId"] = u""
+            self.parseError("unexpected-char-in-doctype")
+            self.currentToken.systemId = u""
             self.state = self.doctypeSystemIdentifierSingleQuotedState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-char-in-doctype")
+            self.currentToken.correct = False
             self.state = self.bogusDoctypeState
         return True
     
@@ -1562,21 +1716,19 @@ class HTMLTokenizer(object):
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data == '"':
-            self.currentToken["systemId"] = u""
+            self.currentToken.systemId = u""
             self.state = self.doctypeSystemIdentifierDoubleQuotedState
         elif data == "'":
-            self.currentToken["systemId"] = u""
+            self.currentToken.systemId = u""
             self.state = self.doctypeSystemIdentifierSingleQuotedState
         elif data == EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-char-in-doctype")
+            self.currentToken.correct = False
             self.state = self.bogusDoctypeState
         return True
     
@@ -1585,14 +1737,12 @@ class HTMLTokenizer(object):
         if data in spaceCharacters:
             self.state = self.beforeDoctypeSystemIdentifierState
         elif data in ("'", '"'):
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
+            self.parseError("unexpected-char-in-doctype")
             self.stream.unget(data)
             self.state = self.beforeDoctypeSystemIdentifierState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
@@ -1605,27 +1755,24 @@ class HTMLTokenizer(object):
         if data in spaceCharacters:
             pass
         elif data == "\"":
-            self.currentToken["systemId"] = u""
+            self.currentToken.systemId = u""
             self.state = self.doctypeSystemIdentifierDoubleQuotedState
         elif data == "'":
-            self.currentToken["systemId"] = u""
+            self.currentToken.systemId = u""
             self.state = self.doctypeSystemIdentifierSingleQuotedState
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-char-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-char-in-doctype")
+            self.currentToken.correct = False
             self.state = self.bogusDoctypeState
         return True
 
@@ -1634,23 +1781,20 @@ class HTMLTokenizer(object):
         if data == "\"":
             self.state = self.afterDoctypeSystemIdentifierState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["systemId"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.systemId += u"\uFFFD"
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-end-of-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-end-of-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["systemId"] += data
+            self.currentToken.systemId += data
         return True
 
     def doctypeSystemIdentifierSingleQuotedState(self):
@@ -1658,23 +1802,20 @@ class HTMLTokenizer(object):
         if data == "'":
             self.state = self.afterDoctypeSystemIdentifierState
         elif data == u"\u0000":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                    "data": "invalid-codepoint"})
-            self.currentToken["systemId"] += u"\uFFFD"
+            self.parseError("invalid-codepoint")
+            self.currentToken.systemId += u"\uFFFD"
         elif data == ">":
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-end-of-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("unexpected-end-of-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.currentToken["systemId"] += data
+            self.currentToken.systemId += data
         return True
 
     def afterDoctypeSystemIdentifierState(self):
@@ -1685,14 +1826,12 @@ class HTMLTokenizer(object):
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         elif data is EOF:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "eof-in-doctype"})
-            self.currentToken["correct"] = False
+            self.parseError("eof-in-doctype")
+            self.currentToken.correct = False
             self.tokenQueue.append(self.currentToken)
             self.state = self.dataState
         else:
-            self.tokenQueue.append({"type": tokenTypes["ParseError"], "data":
-              "unexpected-char-in-doctype"})
+            self.parseError("unexpected-char-in-doctype")
             self.state = self.bogusDoctypeState
         return True
 
@@ -1734,11 +1873,10 @@ class HTMLTokenizer(object):
         nullCount = data.count(u"\u0000")
         if nullCount > 0:
             for i in xrange(nullCount):
-                self.tokenQueue.append({"type": tokenTypes["ParseError"], 
-                                        "data": "invalid-codepoint"})
+                self.parseError("invalid-codepoint")
             data = data.replace(u"\u0000", u"\uFFFD")
         if data:
-            self.tokenQueue.append({"type": tokenTypes["Characters"], 
-                                    "data": data})
+            self.tokenQueue.append(CharacterToken(
+                tokenTypes["Characters"], data))
         self.state = self.dataState
         return True
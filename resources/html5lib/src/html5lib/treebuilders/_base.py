@@ -1,4 +1,8 @@
 from html5lib.constants import scopingElements, tableInsertModeElements, namespaces
+from html5lib.constants import tokenTypes, spaceCharacters
+from html5lib.tokenizer import TagToken
+from bisect import bisect_left, bisect_right, insort
+import re
 try:
     frozenset
 except NameError:
@@ -12,6 +16,8 @@ except NameError:
 Marker = None
 
 class Node(object):
+    __slots__ = ()
+
     def __init__(self, name):
         """Node representing an item in the tree.
         name - The tag name associated with the node
@@ -64,6 +70,14 @@ class Node(object):
         """
         raise NotImplementedError
 
+    def addAttributes(self, attributes):
+        """Add the attributes in the dict attributes that the node does not
+        have yet
+        """
+        for name, value in attributes.iteritems():
+            if name not in self.attributes:
+                self.attributes[name] = value
+
     def reparentChildren(self, newParent):
         """Move all the children of the current node to newParent. 
         This is needed so that trees that don't store text as nodes move the 
@@ -86,28 +100,351 @@ class Node(object):
         """
         raise NotImplementedError
 
-class ActiveFormattingElements(list):
+class NodeStack(list):
+    """A list of nodes that knows where its nodes are
+
+    Alongside the nodes the list keeps the position of each node, so that
+    membership tests and index are constant time, and the ascending
+    positions of the nodes under each of the keys _keys returns for them,
+    by default their name. A node is in the list at most once. Adding or
+    removing the last node updates these in constant time; changes further
+    down the list reindex the nodes after the change."""
+
+    def __init__(self, nodes=()):
+        list.__init__(self)
+        # id(node) -> (position, keys)
+        self.nodePositions = {}
+        # key -> ascending positions of the nodes with that key
+        self.positions = {}
+        if nodes:
+            self.extend(nodes)
+
+    def _keys(self, node):
+        return (node.name,)
+
+    def _add(self, node, position):
+        keys = self._keys(node)
+        self.nodePositions[id(node)] = position, keys
+        for key in keys:
+            positions = self.positions.get(key)
+            if positions is None:
+                self.positions[key] = [position]
+            elif positions[-1] < position:
+                positions.append(position)
+            else:
+                insort(positions, position)
+
+    def _discard(self, node, position):
+        for key in self.nodePositions.pop(id(node))[1]:
+            positions = self.positions[key]
+            if positions[-1] == position:
+                positions.pop()
+            else:
+                del positions[bisect_left(positions, position)]
+            if not positions:
+                del self.positions[key]
+
+    def _index(self, start):
+        for position in xrange(start, len(self)):
+            self._add(self[position], position)
+
+    def _unindex(self, start):
+        for position in xrange(len(self) - 1, start - 1, -1):
+            self._discard(self[position], position)
+
+    def _change(self, start, method, *args):
+        """Apply list method to the list, reindexing from start"""
+        start = max(0, min(start, len(self)))
+        self._unindex(start)
+        try:
+            return method(self, *args)
+        finally:
+            self._index(start)
+
+    def _start(self, index):
+        if isinstance(index, slice):
+            # Extended slices may start anywhere
+            return 0
+        if index < 0:
+            index += len(self)
+        return index
+
+    def __contains__(self, node):
+        return id(node) in self.nodePositions
+
+    def index(self, node, *args):
+        if args:
+            return list.index(self, node, *args)
+        try:
+            return self.nodePositions[id(node)][0]
+        except KeyError:
+            raise ValueError("list.index(x): x not in list")
+
+    def lastNamed(self, name):
+        """Return the last node called name, or None"""
+        positions = self.positions.get(name)
+        if positions:
+            return self[positions[-1]]
+        return None
+
+    # append and pop are _add and _discard at the end of the list, inlined
     def append(self, node):
-        equalCount = 0
-        if node != Marker:
-            for element in self[::-1]:
-                if element == Marker:
-                    break
-                if self.nodesEqual(element, node):
-                    equalCount += 1
-                if equalCount == 3:
-                    self.remove(element)
-                    break
+        position = len(self)
+        keys = self._keys(node)
+        self.nodePositions[id(node)] = position, keys
+        for key in keys:
+            try:
+                self.positions[key].append(position)
+            except KeyError:
+                self.positions[key] = [position]
         list.append(self, node)
 
-    def nodesEqual(self, node1, node2):
-        if not node1.nameTuple == node2.nameTuple:
-            return False
-        
-        if not node1.attributes == node2.attributes:
-            return False
-        
-        return True
+    def pop(self, index=-1):
+        if index != -1:
+            return self._change(self._start(index), list.pop, index)
+        node = list.pop(self)
+        for key in self.nodePositions.pop(id(node))[1]:
+            positions = self.positions[key]
+            positions.pop()
+            if not positions:
+                del self.positions[key]
+        return node
+
+    def insert(self, index, node):
+        self._change(self._start(index), list.insert, index, node)
+
+    def remove(self, node):
+        self._change(self.index(node), list.remove, node)
+
+    def extend(self, nodes):
+        self._change(len(self), list.extend, nodes)
+
+    def __iadd__(self, nodes):
+        self.extend(nodes)
+        return self
+
+    def __setitem__(self, index, node):
+        if isinstance(index, slice):
+            self._change(0, list.__setitem__, index, node)
+            return
+        position = self._start(index)
+        self._discard(self[position], position)
+        list.__setitem__(self, position, node)
+        self._add(node, position)
+
+    def __delitem__(self, index):
+        self._change(self._start(index), list.__delitem__, index)
+
+    def __setslice__(self, i, j, nodes):
+        self._change(i, list.__setslice__, i, j, nodes)
+
+    def __delslice__(self, i, j):
+        self._change(i, list.__delslice__, i, j)
+
+class ActiveFormattingElements(NodeStack):
+    """The list of active formatting elements
+
+    Besides the names of the elements, the list is keyed by their name,
+    namespace and attributes together, and it keeps the positions of the
+    markers."""
+
+    def __init__(self, nodes=()):
+        self.markerPositions = []
+        NodeStack.__init__(self, nodes)
+
+    def _keys(self, node):
+        return (node.name,
+                (node.nameTuple, frozenset(node.attributes.items())))
+
+    def _add(self, node, position):
+        if node is Marker:
+            insort(self.markerPositions, position)
+        else:
+            NodeStack._add(self, node, position)
+
+    def _discard(self, node, position):
+        if node is Marker:
+            self.markerPositions.remove(position)
+        else:
+            NodeStack._discard(self, node, position)
+
+    def __contains__(self, node):
+        if node is Marker:
+            return bool(self.markerPositions)
+        return NodeStack.__contains__(self, node)
+
+    def index(self, node, *args):
+        if node is Marker and not args:
+            if not self.markerPositions:
+                raise ValueError("list.index(x): x not in list")
+            return self.markerPositions[0]
+        return NodeStack.index(self, node, *args)
+
+    def _afterLastMarker(self, key):
+        marker = -1
+        if self.markerPositions:
+            marker = self.markerPositions[-1]
+        for position in reversed(self.positions.get(key, ())):
+            if position < marker:
+                break
+            yield self[position]
+
+    def afterLastMarker(self, name):
+        """Iterate over the elements called name after the last marker, last
+        first"""
+        return self._afterLastMarker(name)
+
+    def matching(self, node):
+        """Iterate over the elements after the last marker with the name,
+        namespace and attributes of node, last first"""
+        return self._afterLastMarker(self._keys(node)[1])
+
+    def append(self, node):
+        if node is Marker:
+            self.markerPositions.append(len(self))
+            list.append(self, node)
+            return
+        equalCount = 0
+        for element in self.matching(node):
+            equalCount += 1
+            if equalCount == 3:
+                self.remove(element)
+                break
+        NodeStack.append(self, node)
+
+    def pop(self, index=-1):
+        if index == -1 and self and self[-1] is Marker:
+            self.markerPositions.pop()
+            return list.pop(self)
+        return NodeStack.pop(self, index)
+
+# For each variant of elementInScope, the elements that end the scope and
+# whether that set is inverted (the select scope is ended by any element other
+# than those listed)
+scopeElements = {
+    None:(scopingElements, False),
+    "button":(scopingElements | frozenset([(namespaces["html"], "button")]),
+              False),
+    "list":(scopingElements | frozenset([(namespaces["html"], "ol"),
+                                         (namespaces["html"], "ul")]), False),
+    "table":(frozenset([(namespaces["html"], "html"),
+                        (namespaces["html"], "table")]), False),
+    "select":(frozenset([(namespaces["html"], "optgroup"),
+                         (namespaces["html"], "option")]), True)
+    }
+
+class OpenElements(NodeStack):
+    """The stack of open elements
+
+    Besides their name, the elements are keyed by each variant of scope they
+    end, as ("scope", variant), so that elementInScope need not walk the
+    stack."""
+
+    # Cache of the keys of each element name tuple
+    nameTupleKeys = {}
+
+    def _keys(self, node):
+        nameTuple = node.nameTuple
+        try:
+            return self.nameTupleKeys[nameTuple]
+        except KeyError:
+            keys = (nameTuple[1],) + tuple([("scope", variant) for
+                                            variant, (elements, invert)
+                                            in scopeElements.iteritems()
+                                            if invert ^ (nameTuple in elements)])
+            self.nameTupleKeys[nameTuple] = keys
+            return keys
+
+class ChildIndex(object):
+    """The positions of the children of a node, by identity
+
+    Positions are known for the children before the first position that
+    changed since they were last looked up; the positions of the children
+    from there on are filled in again when one of them is looked up. Most
+    insertions and removals happen near the end of the children (foster
+    parenting inserts right before the table), so few children are ever
+    looked at again."""
+    __slots__ = ("positions", "known")
+
+    def __init__(self):
+        # id(child) -> position
+        self.positions = {}
+        self.known = 0
+
+    def index(self, children, child):
+        """Return the position of child in the sequence children, or raise
+        ValueError if it is not there"""
+        positions = self.positions
+        position = positions.get(id(child))
+        if (position is not None and position < self.known and
+            children[position] is child):
+            return position
+        for position in xrange(self.known, len(children)):
+            positions[id(children[position])] = position
+        self.known = len(children)
+        position = positions.get(id(child))
+        if position is None or children[position] is not child:
+            raise ValueError("not a child of this node")
+        return position
+
+    def inserted(self, position):
+        """Record that a child was inserted at position"""
+        if position < self.known:
+            self.known = position
+
+    def removed(self, position, child):
+        """Record that child was removed from position"""
+        self.positions.pop(id(child), None)
+        if position < self.known:
+            self.known = position
+
+# Separates the names in a class attribute
+classSeparator = re.compile(u"[%s]+" % "".join(spaceCharacters))
+
+class ElementIndex(object):
+    """The elements of a tree by tag name, id and class, in tree order
+
+    The index is filled in one walk of the tree the parser returns rather
+    than as elements are inserted: the tree construction algorithm moves
+    elements after inserting them (reparentChildren, removeChild, foster
+    parenting), and the walk sees them where they ended up, in tree order,
+    without the index following each move. Lookups then don't walk the
+    tree. Changes made to the tree afterwards aren't reflected."""
+
+    def __init__(self, elements):
+        """elements - (element, name, id, class attribute) for each element
+        of the tree in tree order, with None for a missing attribute"""
+        self.tags = tags = {}
+        self.ids = ids = {}
+        self.classes = classes = {}
+        for element, name, id, classNames in elements:
+            try:
+                tags[name].append(element)
+            except KeyError:
+                tags[name] = [element]
+            if id is not None and id not in ids:
+                ids[id] = element
+            if classNames:
+                for className in frozenset(classSeparator.split(classNames)):
+                    if not className:
+                        continue
+                    try:
+                        classes[className].append(element)
+                    except KeyError:
+                        classes[className] = [element]
+
+    def by_tag(self, name):
+        """Return a list of the elements with the local name name"""
+        return list(self.tags.get(name, ()))
+
+    def by_id(self, id):
+        """Return the first element with the id id, or None"""
+        return self.ids.get(id)
+
+    def by_class(self, name):
+        """Return a list of the elements that have name among their
+        classes"""
+        return list(self.classes.get(name, ()))
 
 class TreeBuilder(object):
     """Base treebuilder implementation
@@ -140,7 +477,7 @@ class TreeBuilder(object):
         self.reset()
     
     def reset(self):
-        self.openElements = []
+        self.openElements = OpenElements()
         self.activeFormattingElements = ActiveFormattingElements()
 
         #XXX - rename these to headElement, formElement
@@ -155,28 +492,14 @@ class TreeBuilder(object):
 
         #If we pass a node in we match that. if we pass a string
         #match any node with that name
-        exactNode = hasattr(target, "nameTuple")
-
-        listElementsMap = {
-            None:(scopingElements, False),
-            "button":(scopingElements | set([(namespaces["html"], "button")]), False),
-            "list":(scopingElements | set([(namespaces["html"], "ol"),
-                                           (namespaces["html"], "ul")]), False),
-            "table":(set([(namespaces["html"], "html"),
-                          (namespaces["html"], "table")]), False),
-            "select":(set([(namespaces["html"], "optgroup"), 
-                           (namespaces["html"], "option")]), True)
-            }
-        listElements, invert = listElementsMap[variant]
-
-        for node in reversed(self.openElements):
-            if (node.name == target and not exactNode or
-                node == target and exactNode):
-                return True
-            elif (invert ^ (node.nameTuple in listElements)):                
-                return False
-
-        assert False # We should never reach this point
+        openElements = self.openElements
+        boundaries = openElements.positions.get(("scope", variant))
+        boundary = boundaries and boundaries[-1] or 0
+        if hasattr(target, "nameTuple"):
+            return (target in openElements and
+                    openElements.index(target) >= boundary)
+        positions = openElements.positions.get(target)
+        return bool(positions) and positions[-1] >= boundary
 
     def reconstructActiveFormattingElements(self):
         # Within this algorithm the order of steps described in the
@@ -212,10 +535,10 @@ class TreeBuilder(object):
             clone = entry.cloneNode() #Mainly to get a new copy of the attributes
 
             # Step 9
-            element = self.insertElement({"type":"StartTag", 
-                                          "name":clone.name, 
-                                          "namespace":clone.namespace, 
-                                          "data":clone.attributes})
+            token = TagToken(tokenTypes["StartTag"], clone.name,
+                             clone.attributes)
+            token.namespace = clone.namespace
+            element = self.insertElement(token)
 
             # Step 10
             self.activeFormattingElements[i] = element
@@ -234,13 +557,8 @@ class TreeBuilder(object):
         formatting elements and the last marker. If it does, return it, else
         return false"""
 
-        for item in self.activeFormattingElements[::-1]:
-            # Check for Marker first because if it's a Marker it doesn't have a
-            # name attribute.
-            if item == Marker:
-                break
-            elif item.name == name:
-                return item
+        for item in self.activeFormattingElements.afterLastMarker(name):
+            return item
         return False
 
     def insertRoot(self, token):
@@ -249,9 +567,9 @@ class TreeBuilder(object):
         self.document.appendChild(element)
 
     def insertDoctype(self, token):
-        name = token["name"]
-        publicId = token["publicId"]
-        systemId = token["systemId"]
+        name = token.name
+        publicId = token.publicId
+        systemId = token.systemId
 
         doctype = self.doctypeClass(name, publicId, systemId)
         self.document.appendChild(doctype)
@@ -259,14 +577,14 @@ class TreeBuilder(object):
     def insertComment(self, token, parent=None):
         if parent is None:
             parent = self.openElements[-1]
-        parent.appendChild(self.commentClass(token["data"]))
+        parent.appendChild(self.commentClass(token.data))
                            
     def createElement(self, token):
         """Create an element but don't insert it anywhere"""
-        name = token["name"]
-        namespace = token.get("namespace", self.defaultNamespace)
+        name = token.name
+        namespace = getattr(token, "namespace", self.defaultNamespace)
         element = self.elementClass(name, namespace)
-        element.attributes = token["data"]
+        element.attributes = token.data
         return element
 
     def _getInsertFromTable(self):
@@ -284,11 +602,11 @@ class TreeBuilder(object):
     insertFromTable = property(_getInsertFromTable, _setInsertFromTable)
         
     def insertElementNormal(self, token):
-        name = token["name"]
+        name = token.name
         assert type(name) == unicode, "Element %s not unicode"%name
-        namespace = token.get("namespace", self.defaultNamespace)
+        namespace = getattr(token, "namespace", self.defaultNamespace)
         element = self.elementClass(name, namespace)
-        element.attributes = token["data"]
+        element.attributes = token.data
         self.openElements[-1].appendChild(element)
         self.openElements.append(element)
         return element
@@ -311,18 +629,23 @@ class TreeBuilder(object):
 
     def insertText(self, data, parent=None):
         """Insert text data."""
+        parent, insertBefore = self.getTextPosition(parent)
+        parent.insertText(data, insertBefore)
+
+    def getTextPosition(self, parent=None):
+        """Get the node text is inserted into, and the sibling to insert it
+        before (or None)"""
         if parent is None:
             parent = self.openElements[-1]
 
         if (not self.insertFromTable or (self.insertFromTable and
                                          self.openElements[-1].name 
                                          not in tableInsertModeElements)):
-            parent.insertText(data)
+            return parent, None
         else:
             # We should be in the InTable mode. This means we want to do
             # special magic element rearranging
-            parent, insertBefore = self.getTableMisnestedNodePosition()
-            parent.insertText(data, insertBefore)
+            return self.getTableMisnestedNodePosition()
             
     def getTableMisnestedNodePosition(self):
         """Get the foster parent element, and sibling to insert before
@@ -330,13 +653,9 @@ class TreeBuilder(object):
         # The foster parent element is the one which comes before the most
         # recently opened table element
         # XXX - this is really inelegant
-        lastTable=None
         fosterParent = None
         insertBefore = None
-        for elm in self.openElements[::-1]:
-            if elm.name == "table":
-                lastTable = elm
-                break
+        lastTable = self.openElements.lastNamed("table")
         if lastTable:
             # XXX - we should really check that this parent is actually a
             # node here
@@ -371,6 +690,12 @@ class TreeBuilder(object):
         self.openElements[0].reparentChildren(fragment)
         return fragment
 
+    def iterElements(self, tree):
+        """Yield (element, name, id, class attribute) for each element of
+        tree, as returned by getDocument or getFragment, in tree order, for
+        an ElementIndex"""
+        raise NotImplementedError
+
     def testSerializer(self, node):
         """Serialize the subtree of node in the format required by unit tests
         node - the node from which to start serializing"""
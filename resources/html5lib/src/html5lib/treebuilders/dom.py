@@ -50,6 +50,11 @@ def getDomBuilder(DomImplementation):
                 return self.element.hasAttribute(name)
     
     class NodeBuilder(_base.Node):
+        # Text appended at the end of the node arrives in many small pieces;
+        # they are kept here and joined into one text node by _flushText
+        # before the node is changed or read
+        _textPieces = None
+
         def __init__(self, element):
             _base.Node.__init__(self, element.nodeName)
             self.element = element
@@ -58,26 +63,42 @@ def getDomBuilder(DomImplementation):
                              and self.element.namespaceURI or None)
 
         def appendChild(self, node):
+            self._flushText()
             node.parent = self
             self.element.appendChild(node.element)
     
         def insertText(self, data, insertBefore=None):
-            text = self.element.ownerDocument.createTextNode(data)
             if insertBefore:
+                self._flushText()
+                text = self.element.ownerDocument.createTextNode(data)
                 self.element.insertBefore(text, insertBefore.element)
+            elif self._textPieces is None:
+                self._textPieces = [data]
             else:
-                self.element.appendChild(text)
+                self._textPieces.append(data)
+
+        def _flushText(self):
+            if self._textPieces is None:
+                return
+            data = "".join(self._textPieces)
+            self._textPieces = None
+            self.element.appendChild(
+                self.element.ownerDocument.createTextNode(data))
     
         def insertBefore(self, node, refNode):
+            self._flushText()
             self.element.insertBefore(node.element, refNode.element)
             node.parent = self
     
         def removeChild(self, node):
+            self._flushText()
             if node.element.parentNode == self.element:
                 self.element.removeChild(node.element)
             node.parent = None
     
         def reparentChildren(self, newParent):
+            self._flushText()
+            newParent._flushText()
             while self.element.hasChildNodes():
                 child = self.element.firstChild
                 self.element.removeChild(child)
@@ -106,6 +127,7 @@ def getDomBuilder(DomImplementation):
             return NodeBuilder(self.element.cloneNode(False))
     
         def hasContent(self):
+            self._flushText()
             return self.element.hasChildNodes()
 
         def getNameTuple(self):
@@ -122,9 +144,9 @@ def getDomBuilder(DomImplementation):
             return weakref.proxy(self)
     
         def insertDoctype(self, token):
-            name = token["name"]
-            publicId = token["publicId"]
-            systemId = token["systemId"]
+            name = token.name
+            publicId = token.publicId
+            systemId = token.systemId
 
             domimpl = Dom.getDOMImplementation()
             doctype = domimpl.createDocumentType(name, publicId, systemId)
@@ -148,20 +170,56 @@ def getDomBuilder(DomImplementation):
     
         def appendChild(self, node):
             self.dom.appendChild(node.element)
+
+        def reset(self):
+            _base.TreeBuilder.reset(self)
+            self.textNode = None
+
+        def flushText(self):
+            if self.textNode is not None:
+                self.textNode._flushText()
+                self.textNode = None
     
         def testSerializer(self, element):
+            self.flushText()
             return testSerializer(element)
     
         def getDocument(self):
+            self.flushText()
             return self.dom
         
         def getFragment(self):
+            self.flushText()
             return _base.TreeBuilder.getFragment(self).element
+
+        def iterElements(self, tree):
+            stack = [iter(tree.childNodes)]
+            while stack:
+                for node in stack[-1]:
+                    if node.nodeType == Node.ELEMENT_NODE:
+                        id = className = None
+                        if node.hasAttribute("id"):
+                            id = node.getAttribute("id")
+                        if node.hasAttribute("class"):
+                            className = node.getAttribute("class")
+                        yield node, node.nodeName, id, className
+                    if node.childNodes:
+                        stack.append(iter(node.childNodes))
+                        break
+                else:
+                    stack.pop()
     
         def insertText(self, data, parent=None):
             data=data
             if parent <> self:
-                _base.TreeBuilder.insertText(self, data, parent)
+                parent, insertBefore = self.getTextPosition(parent)
+                if insertBefore is None and parent is not self.textNode:
+                    # Only one node buffers text at a time: the text of the
+                    # one before is joined now, rather than every node that
+                    # was given text being kept until the tree is returned
+                    self.flushText()
+                    self.textNode = parent
+                parent.insertText(data, insertBefore)
             else:
                 # HACK: allow text nodes as children of the document node
                 if hasattr(self.dom, '_child_node_types'):
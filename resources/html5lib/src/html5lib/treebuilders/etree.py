@@ -4,6 +4,7 @@ except:
     from new import module as ModuleType
 import re
 import types
+import weakref
 
 import _base
 from html5lib import ihatexml
@@ -27,19 +28,52 @@ def getETreeModule(ElementTreeImplementation, fullTree=False):
 
 def getETreeBuilder(ElementTreeImplementation, fullTree=False):
     ElementTree = ElementTreeImplementation
+
+    # The wrapper of each element the parser still refers to. The tree is
+    # built from the ElementTree elements directly; a wrapper, with the
+    # parent pointer and name tuple the parser needs, lives only as long
+    # as the parser holds on to it, and is found here when the element is
+    # moved by its old parent
+    wrappers = weakref.WeakValueDictionary()
+
+    # Name tuples shared by the wrappers, by namespace and name
+    nameTuples = {}
+
     class Element(_base.Node):
+        # Text appended at the end of the element (as its text or as the tail
+        # of its last child) arrives in many small pieces; they are kept
+        # here and joined by _flushText before the element is changed or read
+        _textPieces = None
+        _childIndex = None
+
         def __init__(self, name, namespace=None):
             self._name = name
             self._namespace = namespace
             self._element = ElementTree.Element(self._getETreeTag(name,
                                                                   namespace))
-            if namespace is None:
-                self.nameTuple = namespaces["html"], self._name
-            else:
-                self.nameTuple = self._namespace, self._name
+            self._setNameTuple()
             self.parent = None
-            self._childNodes = []
-            self._flags = []
+            wrappers[self._element] = self
+
+        def _setNameTuple(self):
+            key = self._namespace, self._name
+            try:
+                self.nameTuple = nameTuples[key]
+            except KeyError:
+                if self._namespace is None:
+                    nameTuple = namespaces["html"], self._name
+                else:
+                    nameTuple = key
+                self.nameTuple = nameTuples[key] = nameTuple
+
+        def _getFlags(self):
+            try:
+                return self._flagList
+            except AttributeError:
+                self._flagList = []
+                return self._flagList
+
+        _flags = property(_getFlags)
 
         def _getETreeTag(self, name, namespace):
             if namespace is None:
@@ -51,6 +85,7 @@ def getETreeBuilder(ElementTreeImplementation, fullTree=False):
         def _setName(self, name):
             self._name = name
             self._element.tag = self._getETreeTag(self._name, self._namespace)
+            self._setNameTuple()
         
         def _getName(self):
             return self._name
@@ -60,6 +95,7 @@ def getETreeBuilder(ElementTreeImplementation, fullTree=False):
         def _setNamespace(self, namespace):
             self._namespace = namespace
             self._element.tag = self._getETreeTag(self._name, self._namespace)
+            self._setNameTuple()
 
         def _getNamespace(self):
             return self._namespace
@@ -83,48 +119,47 @@ def getETreeBuilder(ElementTreeImplementation, fullTree=False):
     
         attributes = property(_getAttributes, _setAttributes)
     
-        def _getChildNodes(self):
-            return self._childNodes    
-        def _setChildNodes(self, value):
-            del self._element[:]
-            self._childNodes = []
-            for element in value:
-                self.insertChild(element)
-    
-        childNodes = property(_getChildNodes, _setChildNodes)
-    
         def hasContent(self):
             """Return true if the node has children or text"""
+            self._flushText()
             return bool(self._element.text or len(self._element))
     
         def appendChild(self, node):
-            self._childNodes.append(node)
+            self._flushText()
             self._element.append(node._element)
             node.parent = self
     
+        def _getChildIndex(self):
+            if self._childIndex is None:
+                self._childIndex = _base.ChildIndex()
+            return self._childIndex
+
         def insertBefore(self, node, refNode):
-            index = list(self._element).index(refNode._element)
+            self._flushText()
+            index = self._getChildIndex().index(self._element,
+                                                refNode._element)
             self._element.insert(index, node._element)
+            self._childIndex.inserted(index)
             node.parent = self
     
         def removeChild(self, node):
-            self._element.remove(node._element)
+            self._flushText()
+            index = self._getChildIndex().index(self._element, node._element)
+            del self._element[index]
+            self._childIndex.removed(index, node._element)
             node.parent=None
     
         def insertText(self, data, insertBefore=None):
-            if not(len(self._element)):
-                if not self._element.text:
-                    self._element.text = ""
-                self._element.text += data
-            elif insertBefore is None:
-                #Insert the text as the tail of the last child element
-                if not self._element[-1].tail:
-                    self._element[-1].tail = ""
-                self._element[-1].tail += data
+            if insertBefore is None:
+                if self._textPieces is None:
+                    self._textPieces = [data]
+                else:
+                    self._textPieces.append(data)
             else:
                 #Insert the text before the specified node
-                children = list(self._element)
-                index = children.index(insertBefore._element)
+                self._flushText()
+                index = self._getChildIndex().index(self._element,
+                                                    insertBefore._element)
                 if index > 0:
                     if not self._element[index-1].tail:
                         self._element[index-1].tail = ""
@@ -134,6 +169,21 @@ def getETreeBuilder(ElementTreeImplementation, fullTree=False):
                         self._element.text = ""
                     self._element.text += data
     
+        def _flushText(self):
+            if self._textPieces is None:
+                return
+            data = "".join(self._textPieces)
+            self._textPieces = None
+            if not(len(self._element)):
+                if not self._element.text:
+                    self._element.text = ""
+                self._element.text += data
+            else:
+                #Insert the text as the tail of the last child element
+                if not self._element[-1].tail:
+                    self._element[-1].tail = ""
+                self._element[-1].tail += data
+
         def cloneNode(self):
             element = type(self)(self.name, self.namespace)
             for name, value in self.attributes.iteritems():
@@ -141,24 +191,33 @@ def getETreeBuilder(ElementTreeImplementation, fullTree=False):
             return element
     
         def reparentChildren(self, newParent):
-            if newParent.childNodes:
-                newParent.childNodes[-1]._element.tail += self._element.text
+            self._flushText()
+            newParent._flushText()
+            element = self._element
+            children = list(element)
+            if len(newParent._element):
+                last = newParent._element[-1]
+                last.tail = (last.tail or "") + (element.text or "")
             else:
                 if not newParent._element.text:
                     newParent._element.text = ""
-                if self._element.text is not None:
-                    newParent._element.text += self._element.text
-            self._element.text = ""
-            _base.Node.reparentChildren(self, newParent)
+                if element.text is not None:
+                    newParent._element.text += element.text
+            element.text = ""
+            del element[:]
+            self._childIndex = None
+            newParent._element.extend(children)
+            for child in children:
+                wrapper = wrappers.get(child)
+                if wrapper is not None:
+                    wrapper.parent = newParent
     
     class Comment(Element):
         def __init__(self, data):
-            #Use the superclass constructor to set all properties on the 
-            #wrapper element
+            #The parser never refers to comments after inserting them, so
+            #they are not kept with the element wrappers
             self._element = ElementTree.Comment(data)
             self.parent = None
-            self._childNodes = []
-            self._flags = []
             
         def _getData(self):
             return self._element.text
@@ -325,10 +384,31 @@ def getETreeBuilder(ElementTreeImplementation, fullTree=False):
         commentClass = Comment
         fragmentClass = DocumentFragment
     
+        def reset(self):
+            _base.TreeBuilder.reset(self)
+            self.textElement = None
+
+        def insertText(self, data, parent=None):
+            parent, insertBefore = self.getTextPosition(parent)
+            if insertBefore is None and parent is not self.textElement:
+                # Only one element buffers text at a time: the text of the
+                # one before is joined now, so that its wrapper needn't be
+                # kept alive until the tree is returned
+                self.flushText()
+                self.textElement = parent
+            parent.insertText(data, insertBefore)
+
+        def flushText(self):
+            if self.textElement is not None:
+                self.textElement._flushText()
+                self.textElement = None
+
         def testSerializer(self, element):
+            self.flushText()
             return testSerializer(element)
     
         def getDocument(self):
+            self.flushText()
             if fullTree:
                 return self.document._element
             else:
@@ -339,6 +419,19 @@ def getETreeBuilder(ElementTreeImplementation, fullTree=False):
                     return self.document._element.find("html")
         
         def getFragment(self):
+            self.flushText()
             return _base.TreeBuilder.getFragment(self)._element
+
+        def iterElements(self, tree):
+            for element in tree.getiterator():
+                tag = element.tag
+                if (not isinstance(tag, basestring) or
+                    tag in ("<!DOCTYPE>", "<DOCUMENT_ROOT>",
+                            "<DOCUMENT_FRAGMENT>")):
+                    continue
+                if tag[0] == "{":
+                    tag = tag.split("}", 1)[1]
+                attrib = element.attrib
+                yield element, tag, attrib.get("id"), attrib.get("class")
         
     return locals()
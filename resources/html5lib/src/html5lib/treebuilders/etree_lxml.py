@@ -207,6 +207,7 @@ class TreeBuilder(_base.TreeBuilder):
                 self._name = filter.coerceElement(name)
                 self._element.tag = self._getETreeTag(
                     self._name, self._namespace)
+                self._setNameTuple()
         
             def _getName(self):
                 return filter.fromXmlName(self._name)
@@ -223,7 +224,27 @@ class TreeBuilder(_base.TreeBuilder):
 
             def insertText(self, data, insertBefore=None):
                 data = filter.coerceCharacters(data)
-                builder.Element.insertText(self, data, insertBefore)
+                if insertBefore is None:
+                    builder.Element.insertText(self, data)
+                else:
+                    # lxml elements know their siblings, and finding a
+                    # child by its index walks the children
+                    self._flushText()
+                    previous = insertBefore._element.getprevious()
+                    if previous is None:
+                        self._element.text = (self._element.text or "") + data
+                    else:
+                        previous.tail = (previous.tail or "") + data
+
+            def insertBefore(self, node, refNode):
+                self._flushText()
+                refNode._element.addprevious(node._element)
+                node.parent = self
+
+            def removeChild(self, node):
+                self._flushText()
+                self._element.remove(node._element)
+                node.parent = None
 
             def appendChild(self, child):
                 builder.Element.appendChild(self, child)
@@ -244,6 +265,7 @@ class TreeBuilder(_base.TreeBuilder):
             data = property(_getData, _setData)
 
         self.elementClass = Element
+        self.wrappers = builder.wrappers
         self.commentClass = builder.Comment
         #self.fragmentClass = builder.DocumentFragment
         _base.TreeBuilder.__init__(self, namespaceHTMLElements)
@@ -253,17 +275,34 @@ class TreeBuilder(_base.TreeBuilder):
         self.insertComment = self.insertCommentInitial
         self.initial_comments = []
         self.doctype = None
+        self.textElement = None
+
+    def insertText(self, data, parent=None):
+        parent, insertBefore = self.getTextPosition(parent)
+        if insertBefore is None and parent is not self.textElement:
+            # Only one element buffers text at a time, as for etree
+            self.flushText()
+            self.textElement = parent
+        parent.insertText(data, insertBefore)
+
+    def flushText(self):
+        if self.textElement is not None:
+            self.textElement._flushText()
+            self.textElement = None
 
     def testSerializer(self, element):
+        self.flushText()
         return testSerializer(element)
 
     def getDocument(self):
+        self.flushText()
         if fullTree:
             return self.document._elementTree
         else:
             return self.document._elementTree.getroot()
     
     def getFragment(self):
+        self.flushText()
         fragment = []
         element = self.openElements[0]._element
         if element.text:
@@ -273,10 +312,30 @@ class TreeBuilder(_base.TreeBuilder):
             fragment.append(element.tail)
         return fragment
 
+    def iterElements(self, tree):
+        if hasattr(tree, "getroot"):
+            tree = [tree.getroot()]
+        elif not isinstance(tree, list):
+            tree = [tree]
+        filter = self.filter
+        for node in tree:
+            if isinstance(node, basestring):
+                continue
+            for element in node.iter():
+                tag = element.tag
+                if not isinstance(tag, basestring):
+                    continue
+                nsmatch = tag_regexp.match(tag)
+                if nsmatch is not None:
+                    tag = nsmatch.group(2)
+                attrib = element.attrib
+                yield (element, filter.fromXmlName(tag), attrib.get("id"),
+                       attrib.get("class"))
+
     def insertDoctype(self, token):
-        name = token["name"]
-        publicId = token["publicId"]
-        systemId = token["systemId"]
+        name = token.name
+        publicId = token.publicId
+        systemId = token.systemId
 
         if not name or ihatexml.nonXmlNameBMPRegexp.search(name) or name[0] == '"':
             warnings.warn("lxml cannot represent null or non-xml doctype", DataLossWarning)
@@ -311,15 +370,15 @@ class TreeBuilder(_base.TreeBuilder):
         
         #Append the initial comments:
         for comment_token in self.initial_comments:
-            root.addprevious(etree.Comment(comment_token["data"]))
+            root.addprevious(etree.Comment(comment_token.data))
         
         #Create the root document and add the ElementTree to it
         self.document = self.documentClass()
         self.document._elementTree = root.getroottree()
         
         # Give the root element the right name
-        name = token["name"]
-        namespace = token.get("namespace", self.defaultNamespace)
+        name = token.name
+        namespace = getattr(token, "namespace", self.defaultNamespace)
         if namespace is None:
             etree_tag = name
         else:
@@ -329,6 +388,7 @@ class TreeBuilder(_base.TreeBuilder):
         #Add the root element to the internal child/open data structures
         root_element = self.elementClass(name, namespace)
         root_element._element = root
+        self.wrappers[root] = root_element
         self.document._childNodes.append(root_element)
         self.openElements.append(root_element)
     
@@ -2,21 +2,56 @@ import _base
 from html5lib.constants import voidElements, namespaces, prefixes
 from xml.sax.saxutils import escape
 
+class EmptyAttributes(dict):
+    """The attributes of nodes that have none, shared between them"""
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError("shared empty attributes are read-only")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = \
+        _readOnly
+
+emptyAttributes = EmptyAttributes()
+
+# The children of nodes that have none, shared between them
+emptyChildNodes = ()
+
 # Really crappy basic implementation of a DOM-core like thing
 class Node(_base.Node):
+    """Nodes keep their state in slots. Nodes without children share an
+    empty tuple as childNodes, nodes without attributes share a read-only
+    empty mapping, and the flags list is only allocated when it is used"""
+    __slots__ = ("name", "parent", "childNodes", "_flagList", "_childIndex")
     type = -1
+    value = None
+    namespace = None
+    attributes = emptyAttributes
+
     def __init__(self, name):
         self.name = name
         self.parent = None
-        self.value = None
-        self.childNodes = []
-        self._flags = []
+        self.childNodes = emptyChildNodes
+        self._childIndex = None
+
+    def _getFlags(self):
+        try:
+            return self._flagList
+        except AttributeError:
+            self._flagList = []
+            return self._flagList
+
+    _flags = property(_getFlags)
 
     def __iter__(self):
-        for node in self.childNodes:
-            yield node
-            for item in node:
-                yield item
+        # The descendants in tree order, from a stack of the child iterators
+        # of their ancestors rather than a generator per level
+        stack = [iter(self.childNodes)]
+        while stack:
+            for node in stack[-1]:
+                yield node
+                if node.childNodes:
+                    stack.append(iter(node.childNodes))
+                    break
+            else:
+                stack.pop()
 
     def __unicode__(self):
         return self.name
@@ -32,9 +67,11 @@ class Node(_base.Node):
 
     def appendChild(self, node):
         assert isinstance(node, Node)
-        if (isinstance(node, TextNode) and self.childNodes and
-          isinstance(self.childNodes[-1], TextNode)):
-            self.childNodes[-1].value += node.value
+        if not self.childNodes:
+            self.childNodes = [node]
+        elif (isinstance(node, TextNode) and
+              isinstance(self.childNodes[-1], TextNode)):
+            self.childNodes[-1].appendData(node.value)
         else:
             self.childNodes.append(node)
         node.parent = self
@@ -46,23 +83,34 @@ class Node(_base.Node):
         else:
             self.insertBefore(TextNode(data), insertBefore)
 
+    def _getChildIndex(self):
+        if self._childIndex is None:
+            self._childIndex = _base.ChildIndex()
+        return self._childIndex
+
     def insertBefore(self, node, refNode):
-        index = self.childNodes.index(refNode)
+        index = self._getChildIndex().index(self.childNodes, refNode)
         if (isinstance(node, TextNode) and index > 0 and
           isinstance(self.childNodes[index - 1], TextNode)):
-            self.childNodes[index - 1].value += node.value
+            self.childNodes[index - 1].appendData(node.value)
         else:
             self.childNodes.insert(index, node)
+            self._childIndex.inserted(index)
         node.parent = self
 
     def removeChild(self, node):
-        try:
-            self.childNodes.remove(node)
-        except:
-            # XXX
-            raise
+        index = self._getChildIndex().index(self.childNodes, node)
+        del self.childNodes[index]
+        self._childIndex.removed(index, node)
+        if not self.childNodes:
+            self.childNodes = emptyChildNodes
         node.parent = None
 
+    def reparentChildren(self, newParent):
+        _base.Node.reparentChildren(self, newParent)
+        self.childNodes = emptyChildNodes
+        self._childIndex = None
+
     def cloneNode(self):
         raise NotImplementedError
 
@@ -125,6 +173,7 @@ class DocumentFragment(Document):
         return DocumentFragment()
 
 class DocumentType(Node):
+    __slots__ = ("publicId", "systemId")
     type = 3
     def __init__(self, name, publicId, systemId):
         Node.__init__(self, name)
@@ -151,10 +200,29 @@ class DocumentType(Node):
         return DocumentType(self.name, self.publicId, self.systemId)
 
 class TextNode(Node):
+    """Text that arrives in many tokens is kept as a list of pieces, which
+    is joined once when the value is first read"""
+    __slots__ = ("_value",)
     type = 4
     def __init__(self, value):
         Node.__init__(self, None)
-        self.value = value
+        self._value = value
+
+    def _getValue(self):
+        if type(self._value) is list:
+            self._value = "".join(self._value)
+        return self._value
+
+    def _setValue(self, value):
+        self._value = value
+
+    value = property(_getValue, _setValue)
+
+    def appendData(self, data):
+        if type(self._value) is list:
+            self._value.append(data)
+        else:
+            self._value = [self._value, data]
 
     def __unicode__(self):
         return u"\"%s\"" % self.value
@@ -168,11 +236,25 @@ class TextNode(Node):
         return TextNode(self.value)
 
 class Element(Node):
+    __slots__ = ("namespace", "_attributes")
     type = 5
     def __init__(self, name, namespace=None):
         Node.__init__(self, name)
         self.namespace = namespace
-        self.attributes = {}
+        self._attributes = emptyAttributes
+
+    def _getAttributes(self):
+        return self._attributes
+
+    def _setAttributes(self, attributes):
+        self._attributes = attributes or emptyAttributes
+
+    attributes = property(_getAttributes, _setAttributes)
+
+    def addAttributes(self, attributes):
+        if attributes and self._attributes is emptyAttributes:
+            self._attributes = {}
+        Node.addAttributes(self, attributes)
 
     def __unicode__(self):
         if self.namespace == None:
@@ -220,14 +302,12 @@ class Element(Node):
         return tree
 
     def cloneNode(self):
-        newNode = Element(self.name)
-        if hasattr(self, 'namespace'):
-            newNode.namespace = self.namespace
-        for attr, value in self.attributes.iteritems():
-            newNode.attributes[attr] = value
+        newNode = Element(self.name, self.namespace)
+        newNode.attributes = dict(self.attributes)
         return newNode
 
 class CommentNode(Node):
+    __slots__ = ("data",)
     type = 6
     def __init__(self, data):
         Node.__init__(self, None)
@@ -252,5 +332,12 @@ class TreeBuilder(_base.TreeBuilder):
     commentClass = CommentNode
     fragmentClass = DocumentFragment
     
+    def iterElements(self, tree):
+        for node in tree:
+            if isinstance(node, Element):
+                attributes = node.attributes
+                yield (node, node.name, attributes.get("id"),
+                       attributes.get("class"))
+
     def testSerializer(self, node):
         return node.printTree()
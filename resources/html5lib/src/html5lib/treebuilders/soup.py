@@ -154,9 +154,9 @@ class TreeBuilder(_base.TreeBuilder):
         return Element(self.soup, self.soup, None)
     
     def insertDoctype(self, token):
-        name = token["name"]
-        publicId = token["publicId"]
-        systemId = token["systemId"]
+        name = token.name
+        publicId = token.publicId
+        systemId = token.systemId
 
         if publicId:
             self.soup.insert(0, Declaration("DOCTYPE %s PUBLIC \"%s\" \"%s\""%(name, publicId, systemId or "")))
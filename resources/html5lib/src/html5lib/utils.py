@@ -32,8 +32,10 @@ class MethodDispatcher(dict):
         dict.__init__(self, _dictEntries)
         self.default = None
 
-    def __getitem__(self, key):
-        return dict.get(self, key, self.default)
+    def __missing__(self, key):
+        # Only called for keys that aren't there, so found handlers are
+        # looked up without a Python level call
+        return self.default
 
 #Pure python implementation of deque taken from the ASPN Python Cookbook
 #Original code by Raymond Hettinger